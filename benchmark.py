@@ -0,0 +1,40 @@
+import os
+import json
+import argparse
+import tempfile
+
+from datetime import datetime
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the pipeline on synthetic media, no network needed.")
+    parser.add_argument("--episodes", type=int, default=4, help="Number of episodes with media")
+    parser.add_argument("--chapters", type=int, default=8, help="Number of chapters per episode")
+    parser.add_argument("--seconds", type=int, default=600, help="Length of each episode in seconds")
+    parser.add_argument("--rows", type=int, default=1000, help="Total number of videos in the .csv file")
+    parser.add_argument("--video", action="store_true", help="Generate video instead of audio")
+    parser.add_argument("--folder", default=None, help="Empty folder to work in. Default is a new temporary dir")
+    parser.add_argument("--out", default=None, help="Path of .json results. Default is benchmarks/<date>_<commit>.json")
+    args = parser.parse_args()
+
+    folder = args.folder or tempfile.mkdtemp(prefix="podcast_benchmark_")
+
+    # Start from empty caches and keep the benchmark's measured throughput out of real runs
+    os.environ["PODCAST_CACHE"] = f"{os.path.abspath(folder)}/cache"
+
+    from common.benchmark import run_benchmark
+
+    results = run_benchmark(folder, args.episodes, args.chapters, args.seconds, args.rows,
+                            media_type=0 if args.video else 1)
+
+    out_file = args.out
+    if out_file is None:
+        os.makedirs("benchmarks", exist_ok=True)
+        out_file = f"benchmarks/{datetime.now():%Y%m%d_%H%M%S}_{results['environment']['commit']}.json"
+
+    with open(out_file, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f"Total: {results['total']['wall_seconds']:.2f} s, {results['total']['cpu_seconds']:.2f} cpu-s")
+    print(f"Results saved in: {out_file}")
+    print(f"Work folder: {folder}")
@@ -0,0 +1,260 @@
+import os
+import sys
+import time
+import random
+import resource
+import platform
+import subprocess
+import pandas as pd
+
+from datetime import (
+    date,
+    datetime,
+    timedelta,
+)
+
+from common.image import card_cpu_seconds
+from common.downloader import get_matching_chapters
+from common.info import (
+    split_media_chapters,
+    list_image_info,
+)
+from common.converter import (
+    concat_media_chapters_and_images,
+    concat_media_demuxer,
+)
+from common.timestamp import seconds_to_timestamp
+from common.variables import (
+    column_names,
+    regex_non_word,
+)
+
+
+# Chapter names of the rows without media, so matching has something to skip
+filler_words = ("Introduction", "Physics", "Consciousness", "Music", "Programming", "Love",
+                "Aliens", "History", "Chess", "Startups", "War", "Meaning of life", "Advice")
+
+# Word in every chapter name of the rows with media, used as the benchmark query
+benchmark_keyword = "synthetic"
+
+
+def outline_timestamp(seconds: int) -> str:
+    """
+    Formats seconds like YouTube outlines do, eg. '0:00', '5:36' or '1:04:16'.
+
+    :param seconds: Number of seconds
+    :return: Timestamp string
+    """
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def synthetic_description(
+        guest: str,
+        chapter_names: list,
+        seconds: int,
+) -> str:
+    """
+    Returns a podcast-like video description, with an outline of evenly spaced chapters.
+
+    :param guest: Name of guest
+    :param chapter_names: List of chapter names
+    :param seconds: Length of the video in seconds
+    :return: Description string
+    """
+    step = seconds // len(chapter_names)
+    outline = "\n".join(f"{outline_timestamp(i * step)} - {name}" for i, name in enumerate(chapter_names))
+
+    return (f"{guest} is a synthetic guest.\n\nPlease support this podcast by checking out our sponsors:\n"
+            f"- Nobody: https://example.com\n\nOUTLINE:\n{outline}\n\nSOCIAL:\n- Twitter: https://example.com")
+
+
+def synthetic_csv(
+        filename: str,
+        episodes: int = 4,
+        chapters: int = 8,
+        seconds: int = 600,
+        rows: int = 1000,
+        seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Saves a .csv file of the 'channel_videos_list' type. The first 'episodes' rows are the ones
+    with media, all of their chapters contain 'benchmark_keyword'. The other rows only make
+    the chapter search do realistic work.
+
+    :param filename: Path of .csv file to save
+    :param episodes: Number of videos with media
+    :param chapters: Number of chapters per video
+    :param seconds: Length of each video in seconds
+    :param rows: Total number of videos
+    :param seed: Seed of random chapter names of the other rows
+    :return: DataFrame saved
+    """
+    generator = random.Random(seed)
+    publish_date = date(2020, 1, 1)
+
+    videos = []
+    for row in range(max(rows, episodes)):
+        guest = f"Guest {row}"
+        if row < episodes:
+            chapter_names = [f"Topic {chapter} {benchmark_keyword}" for chapter in range(chapters)]
+        else:
+            chapter_names = generator.sample(filler_words, min(chapters, len(filler_words)))
+
+        videos.append([
+            f"{guest}: Synthetic Episode | Lex Fridman Podcast #{row}",
+            f"https://youtube.com/watch?v=bench{row:06d}",
+            seconds_to_timestamp(seconds),
+            generator.randint(1000, 5000000),
+            str(publish_date + timedelta(days=row)),
+            synthetic_description(guest, chapter_names, seconds),
+            "['synthetic']",
+            "Lex Fridman",
+            f"bench{row:06d}",
+        ])
+
+    dataframe = pd.DataFrame(videos, columns=column_names)
+    dataframe.to_csv(filename, index=False)
+
+    return dataframe
+
+
+def synthetic_media(
+        filename: str,
+        seconds: int = 600,
+        media_type: int = 1,
+) -> str:
+    """
+    Generates a media file locally with ffmpeg lavfi sources: a sine tone for audio and
+    a testsrc pattern with a sine tone for video.
+
+    :param filename: Path of media file to save, eg. 'Guest_0.mp4'
+    :param seconds: Length in seconds
+    :param media_type: 0 for Video, 1 for Audio. Default 1-Audio
+    :return: Path of saved file
+    """
+    command = ["ffmpeg", "-y", "-loglevel", "error"]
+    if media_type == 0:
+        command += ["-f", "lavfi", "-i", f"testsrc=size=640x360:rate=25:duration={seconds}"]
+    command += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}"]
+    if media_type == 0:
+        command += ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p"]
+    command += ["-c:a", "aac", "-b:a", "128k", filename]
+
+    subprocess.run(command, check=True)
+
+    return filename
+
+
+def _measure(results: dict, stage: str, func, *args, **kwargs):
+    # Wall time, this process' CPU time and the CPU time of finished ffmpeg children & card workers
+    wall, cpu = time.perf_counter(), time.process_time()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cards = card_cpu_seconds()
+
+    value = func(*args, **kwargs)
+
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    results[stage] = {
+        'wall_seconds': round(time.perf_counter() - wall, 4),
+        'cpu_seconds': round(time.process_time() - cpu, 4),
+        'child_cpu_seconds': round(children_after.ru_utime + children_after.ru_stime
+                                   - children.ru_utime - children.ru_stime
+                                   + card_cpu_seconds() - cards, 4),
+    }
+    print(f"{stage}: {results[stage]['wall_seconds']:.2f} s")
+
+    return value
+
+
+def environment() -> dict:
+    """
+    Describes the machine and code a benchmark runs on.
+
+    :return: Dict with git commit, Python, ffmpeg & OS versions and CPU count
+    """
+    def output(command):
+        try:
+            return subprocess.run(command, capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except OSError:
+            return None
+
+    ffmpeg_version = output(["ffmpeg", "-version"])
+
+    return {
+        'commit': output(["git", "rev-parse", "--short", "HEAD"]),
+        'python': sys.version.split()[0],
+        'ffmpeg': ffmpeg_version.split("\n")[0] if ffmpeg_version else None,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_benchmark(
+        folder_path: str,
+        episodes: int = 4,
+        chapters: int = 8,
+        seconds: int = 600,
+        rows: int = 1000,
+        media_type: int = 1,
+) -> dict:
+    """
+    Times every stage of a compilation on synthetic inputs, see 'synthetic_csv' and
+    'synthetic_media'. Needs no network. folder_path should be empty, so no stage reuses
+    the output of an earlier run.
+
+    :param folder_path: Name of folder to generate inputs and outputs in
+    :param episodes: Number of episodes with media
+    :param chapters: Number of chapters per episode
+    :param seconds: Length of each episode in seconds
+    :param rows: Total number of videos in the .csv file
+    :param media_type: 0 for Video, 1 for Audio. Default 1-Audio
+    :return: Dict with 'config', 'environment', timings of each stage in 'stages' & 'total'
+    """
+    folder_path = os.path.abspath(folder_path)
+    media_path = f"{folder_path}/media"
+    os.makedirs(media_path, exist_ok=True)
+
+    stages = {}
+
+    def generate():
+        dataframe = synthetic_csv(f"{folder_path}/videos.csv", episodes, chapters, seconds, rows)
+        for name in dataframe['Name'][:episodes]:
+            synthetic_media(f"{media_path}/{regex_non_word.sub('_', name)}.mp4", seconds, media_type)
+
+        return dataframe
+
+    dataframe = _measure(stages, 'generate', generate)
+
+    chapters_dict = _measure(stages, 'get_matching_chapters', get_matching_chapters,
+                             dataframe, [benchmark_keyword])
+    _measure(stages, 'split_media_chapters', split_media_chapters, media_path, chapters_dict,
+             single_pass=True, cache=False)
+    _measure(stages, 'list_image_info', list_image_info, media_path)
+    _measure(stages, 'concat_media_chapters_and_images', concat_media_chapters_and_images,
+             media_path, "concat_media.mp4", "mp4")
+
+    os.makedirs(f"{media_path}/Final", exist_ok=True)
+    _measure(stages, 'final_concat', concat_media_demuxer, media_path, "media.txt", "Final/final_video.mp4")
+
+    measured = [stage for name, stage in stages.items() if name != 'generate']
+
+    return {
+        'date': str(datetime.now()),
+        'config': {
+            'episodes': episodes,
+            'chapters': chapters,
+            'seconds': seconds,
+            'rows': rows,
+            'media_type': media_type,
+        },
+        'environment': environment(),
+        'stages': stages,
+        'total': {
+            'wall_seconds': round(sum(stage['wall_seconds'] for stage in measured), 4),
+            'cpu_seconds': round(sum(stage['cpu_seconds'] + stage['child_cpu_seconds'] for stage in measured), 4),
+        },
+    }
@@ -0,0 +1,284 @@
+import os
+import json
+import hashlib
+import threading
+
+from common.probe import (
+    probe_streams,
+    probe_gops,
+)
+from common.resources import (
+    file_digest,
+    link_file,
+)
+from common.variables import (
+    cache_dir,
+    clip_cache_size,
+)
+
+
+_sources_lock = threading.Lock()
+_evict_lock = threading.Lock()
+# Running total size in bytes of each clip cache dir, as counted by 'evict_clips'
+_clip_cache_sizes = {}
+
+
+def clip_cache_path() -> str:
+    """
+    Returns the default dir of the clip cache.
+
+    :return: Path of 'clips' inside 'cache_dir'
+    """
+    return f"{cache_dir}/clips"
+
+
+def source_digest(
+        filename: str,
+        clip_dir: str = None,
+) -> str:
+    """
+    Returns the content hash of a source media file. Hashes are remembered in 'sources.json'
+    by path, size & modification time, so each file is only read once.
+
+    :param filename: Path of media file
+    :param clip_dir: Path of clip cache dir. Default is 'clip_cache_path()'
+    :return: Hex digest string
+    """
+    if clip_dir is None:
+        clip_dir = clip_cache_path()
+
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    sources_file = f"{clip_dir}/sources.json"
+
+    with _sources_lock:
+        try:
+            with open(sources_file, 'r') as file:
+                sources = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            sources = {}
+
+        record = sources.get(filename)
+        if record is not None and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime_ns:
+            return record['digest']
+
+    digest = file_digest(filename)
+
+    with _sources_lock:
+        try:
+            with open(sources_file, 'r') as file:
+                sources = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            sources = {}
+
+        sources[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'digest': digest}
+
+        os.makedirs(clip_dir, exist_ok=True)
+        with open(sources_file + ".tmp", 'w') as file:
+            json.dump(sources, file, indent=2)
+        os.replace(sources_file + ".tmp", sources_file)
+
+    return digest
+
+
+def clip_key(
+        digest: str,
+        start: str,
+        end: str,
+        options: tuple = (),
+) -> str:
+    """
+    Returns the content address of a clip cut from a source media file.
+
+    :param digest: Content hash of the source, see 'source_digest'
+    :param start: Start timestamp of the clip
+    :param end: End timestamp of the clip
+    :param options: Anything else that changes the clip, eg. codec options
+    :return: Hex digest string
+    """
+    return hashlib.sha1(repr((digest, start, end, tuple(options))).encode('utf-8')).hexdigest()
+
+
+def cut_options(
+        single_pass: bool,
+        smart: bool = False,
+) -> tuple:
+    """
+    Returns the options that change a clip cut by 'split_episode', for 'clip_key'.
+
+    :param single_pass: Whether chapters are cut with one ffmpeg process. Its input seeking
+    can cut at different frames than output seeking
+    :param smart: Whether chapters are cut frame accurately, see 'smart_cut'. single_pass does not apply
+    :return: Tuple of video codec, audio codec & single_pass
+    """
+    if smart:
+        return "smart", "copy", False
+
+    return "copy", "copy", single_pass
+
+
+def keyframe_index(
+        filename: str,
+        keyframe_dir: str = None,
+) -> dict:
+    """
+    Returns the keyframe index of a source media file: the times of its video keyframes, the
+    number of frames of each GOP and its video stream. Indexes are saved under the content hash of the source, see 'source_digest',
+    so each file is only probed once.
+
+    :param filename: Path of media file
+    :param keyframe_dir: Path of dir of keyframe indexes. Default is 'keyframes' inside 'cache_dir'
+    :return: Dict with 'keyframes', a sorted list of seconds, 'gop_frames', the number of frames
+    from each keyframe to the next, 'video', the stream dict of the
+    'probe_streams' type or None for audio only files, and 'audio', whether the file has audio
+    """
+    if keyframe_dir is None:
+        keyframe_dir = f"{cache_dir}/keyframes"
+
+    index_file = f"{keyframe_dir}/{source_digest(filename)}.json"
+    try:
+        with open(index_file, 'r') as file:
+            index = json.load(file)
+        # Indexes saved before frames were counted are probed again
+        if 'gop_frames' in index:
+            return index
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    # Cover art is a video stream of a single attached picture
+    streams = probe_streams(filename)
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'
+                  and stream.get('disposition', {}).get('attached_pic', 0) == 0), None)
+    keyframes, gop_frames = probe_gops(filename) if video is not None else ([], [])
+    index = {
+        'keyframes': keyframes,
+        'gop_frames': gop_frames,
+        'video': video,
+        'audio': any(stream.get('codec_type') == 'audio' for stream in streams),
+    }
+
+    os.makedirs(keyframe_dir, exist_ok=True)
+    tmp_file = f"{index_file}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'w') as file:
+        json.dump(index, file)
+    os.replace(tmp_file, index_file)
+
+    return index
+
+
+def cached_clip(
+        key: str,
+        extension: str,
+        clip_dir: str = None,
+        touch: bool = True,
+) -> str:
+    """
+    Looks up a clip in the cache and marks it as recently used.
+
+    :param key: Clip key of the 'clip_key' type
+    :param extension: Name of media extension, without the dot
+    :param clip_dir: Path of clip cache dir. Default is 'clip_cache_path()'
+    :param touch: Mark the clip as recently used. False only checks that it is cached
+    :return: Path of cached clip, None if it is not cached
+    """
+    if clip_dir is None:
+        clip_dir = clip_cache_path()
+
+    cached_file = f"{clip_dir}/{key[:2]}/{key}.{extension}"
+    if not touch:
+        return cached_file if os.path.exists(cached_file) else None
+
+    try:
+        # Modification time orders clips for eviction
+        os.utime(cached_file)
+    except FileNotFoundError:
+        return None
+
+    return cached_file
+
+
+def add_clip(
+        filename: str,
+        key: str,
+        extension: str,
+        clip_dir: str = None,
+        max_size: int = clip_cache_size,
+) -> str:
+    """
+    Adds a clip to the cache by linking it in, see 'link_file'. The size of the cache is
+    tracked as clips are added, least recently used clips are only evicted once it grows
+    over max_size, see 'evict_clips'.
+
+    :param filename: Path of clip to add
+    :param key: Clip key of the 'clip_key' type
+    :param extension: Name of media extension, without the dot
+    :param clip_dir: Path of clip cache dir. Default is 'clip_cache_path()'
+    :param max_size: Maximum size of the cache in bytes
+    :return: Path of cached clip
+    """
+    if clip_dir is None:
+        clip_dir = clip_cache_path()
+
+    os.makedirs(f"{clip_dir}/{key[:2]}", exist_ok=True)
+    cached_file = f"{clip_dir}/{key[:2]}/{key}.{extension}"
+    replaced = os.path.getsize(cached_file) if os.path.exists(cached_file) else 0
+    link_file(filename, cached_file)
+
+    with _evict_lock:
+        if clip_dir in _clip_cache_sizes:
+            _clip_cache_sizes[clip_dir] += os.path.getsize(cached_file) - replaced
+            evict = _clip_cache_sizes[clip_dir] > max_size
+        else:
+            evict = True
+
+    if evict:
+        evict_clips(clip_dir, max_size)
+
+    return cached_file
+
+
+def evict_clips(
+        clip_dir: str = None,
+        max_size: int = clip_cache_size,
+        low_water: float = 0.9,
+) -> int:
+    """
+    Deletes least recently used clips until the cache is no bigger than max_size * low_water,
+    so that the next clips added do not immediately trigger another scan of the cache.
+    Recounts the size tracked by 'add_clip', which also picks up clips added by other processes.
+
+    :param clip_dir: Path of clip cache dir. Default is 'clip_cache_path()'
+    :param max_size: Maximum size of the cache in bytes
+    :param low_water: Fraction of max_size to shrink the cache to once it is over max_size
+    :return: Number of bytes freed
+    """
+    if clip_dir is None:
+        clip_dir = clip_cache_path()
+
+    with _evict_lock:
+        clips = []
+        for entry in os.scandir(clip_dir):
+            if entry.is_dir():
+                for clip in os.scandir(entry.path):
+                    try:
+                        stat = clip.stat()
+                    except FileNotFoundError:
+                        # Evicted by another process
+                        continue
+                    clips.append((stat.st_mtime_ns, stat.st_size, clip.path))
+
+        total_size = sum(size for _, size, _ in clips)
+        freed = 0
+        if total_size > max_size:
+            for _, size, path in sorted(clips):
+                if total_size - freed <= max_size * low_water:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                freed += size
+
+        _clip_cache_sizes[clip_dir] = total_size - freed
+
+    return freed
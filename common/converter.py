@@ -1,11 +1,42 @@
 import os
-import re
-
+import math
+import time
+import shutil
+import bisect
+import threading
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.dummy import Pool
+
+from common.tracing import (
+    traced,
+    bind,
+)
+from common.scheduler import (
+    get_scheduler,
+    run_ffmpeg,
+    submit_ffmpeg,
+)
+from common.throughput import record_throughput
+from common.probe import (
+    probe_streams,
+    probe_duration,
+    probe_frame_times,
+    concat_signature,
+)
+from common.manifest import (
+    compilation_manifest_name,
+    episode_paths,
+    read_manifest,
+    read_episode_manifest,
+    write_concat_list,
+    read_concat_list,
+    ffmetadata,
+)
 from common.resources import (
-    list_files,
     list_files_paths,
     list_dirs,
-    most_common,
 )
 
 
@@ -23,9 +54,8 @@ def concat_images_list(
     :return:
     """
 
-    os.chdir(folder_path + "/images")
-
-    os.system(f"ffmpeg -f concat -safe 0 -i {media_list} -vsync vfr -pix_fmt yuv420p {out_filename}")
+    run_ffmpeg(["ffmpeg", "-f", "concat", "-safe", "0", "-i", media_list, "-vsync", "vfr",
+                "-pix_fmt", "yuv420p", out_filename], cwd=folder_path + "/images")
 
 
 def add_audio_to_video(
@@ -43,11 +73,11 @@ def add_audio_to_video(
     :param out_filename: Name of output file
     :return: None
     """
-    os.chdir(folder_path)
-
-    os.system(f"ffmpeg -i images/{video_file} -i {audio_file} -c:v copy -c:a aac {out_filename}")
+    run_ffmpeg(["ffmpeg", "-i", f"images/{video_file}", "-i", audio_file, "-c:v", "copy", "-c:a", "aac",
+                out_filename], threads=1, cwd=folder_path)
 
 
+@traced
 def concat_media_demuxer(
         folder_path: str,
         media_list: str = "media.txt",
@@ -61,10 +91,9 @@ def concat_media_demuxer(
     :param out_filename: Name of output file including extension, eg. 'media.mp4'
     :return: Relative filepath of output file
     """
-    os.chdir(folder_path)
-    command = f"ffmpeg -f concat -safe 0 -i '{media_list}' -c copy '{out_filename}'"
+    command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", media_list, "-c", "copy", out_filename]
 
-    os.system(command)
+    run_ffmpeg(command, 'io', cwd=folder_path)
 
     return f"{folder_path}/{out_filename}"
 
@@ -74,6 +103,7 @@ def concat_media_demuxer_filter(
         media_list: str = "media.txt",
         out_filename: str = "concat_media.mp4",
         video_codec: str = 'h264',
+        chunk_seconds: float = None,
 ) -> str:
     """¨
     ffmpeg concat demuxer with filter a series of media files in a single one.
@@ -82,12 +112,203 @@ def concat_media_demuxer_filter(
     :param media_list: Name of Text file containing media to be concatenated
     :param out_filename: Name of output file including extension, eg. 'media.mp4'
     :param video_codec: ffmpeg filter type
+    :param chunk_seconds: Encode the video in chunks of this many seconds in parallel, see 'encode_chunked'.
+    Default is one ffmpeg process
     :return: Relative filepath of output file
     """
-    os.chdir(folder_path)
-    command = f"ffmpeg -f concat -safe 0 -i '{media_list}' -c:v {video_codec} -c:a copy '{out_filename}'"
+    if chunk_seconds is not None:
+        return encode_chunked(folder_path, media_list, out_filename, ["-c:v", video_codec],
+                              input_format="concat", chunk_seconds=chunk_seconds)
+
+    command = ["ffmpeg", "-f", "concat", "-safe", "0", "-i", media_list, "-c:v", video_codec, "-c:a", "copy",
+               out_filename]
 
-    os.system(command)
+    run_ffmpeg(command, cwd=folder_path)
+
+    return f"{folder_path}/{out_filename}"
+
+
+@traced
+def encode_chunked(
+        folder_path: str,
+        input_file: str,
+        out_filename: str,
+        video_args: list,
+        audio_args: list = ("-c:a", "copy"),
+        input_format: str = None,
+        chunk_seconds: float = 300,
+        join: bool = True,
+        poll_seconds: float = 1.0,
+        stale_seconds: float = 600,
+) -> str:
+    """
+    Re-encodes the video of a media file in independent chunks of the timeline, run in parallel
+    as ffmpeg jobs of the scheduler, and joins them with stream copy. The audio is processed
+    whole alongside, so it has no gaps at chunk boundaries. Wall time falls with the number
+    of cores instead of being capped by the threading of one encoder.
+
+    Chunks are saved in '<out_filename without extension>.chunks' and claimed with '.claim'
+    files, so processes on several machines sharing the dir can work on the same encode:
+    helpers call this with join=False, the one with join=True waits for all chunks and joins them.
+    Chunks already encoded are kept, so a stopped encode resumes. Chunks another process failed
+    to encode are encoded by the joining one. Claims are touched while their chunk is encoded,
+    a claim not touched for stale_seconds is left by a process that died and is claimed again.
+
+    :param folder_path: Name of folder that input_file and out_filename are relative to
+    :param input_file: Name of media file, or of a list for the concat demuxer if input_format is 'concat'
+    :param out_filename: Name of output file including extension, eg. 'media.mp4'
+    :param video_args: ffmpeg arguments of the video encoder, eg. ['-c:v', 'libx264', '-crf', '20']
+    :param audio_args: ffmpeg arguments of the audio codec
+    :param input_format: ffmpeg input format, eg. 'concat'. Default is to detect it
+    :param chunk_seconds: Length of a chunk in seconds
+    :param join: Join the chunks into out_filename. False only encodes unclaimed chunks
+    :param poll_seconds: Seconds between checks for chunks encoded by other processes
+    :param stale_seconds: Seconds after the last touch of a claim that it is taken as abandoned
+    :return: Path of output file, or of the chunk dir if join is False
+    """
+    folder_path = os.path.abspath(folder_path)
+    input_path = os.path.join(folder_path, input_file)
+
+    input_options = []
+    files = [input_path]
+    if input_format is not None:
+        input_options = ["-f", input_format]
+    if input_format == "concat":
+        input_options += ["-safe", "0"]
+        files = read_concat_list(input_path)
+
+    has_audio = any(stream['codec_type'] == 'audio' for stream in probe_streams(files[0]))
+
+    frame_times = probe_frame_times(input_path, input_options)
+    if len(frame_times) == 0:
+        raise OSError(f"{input_file} has no video.")
+
+    # Chunks start at the first frame at or after each multiple of chunk_seconds and are whole
+    # numbers of frames, so none is dropped or repeated at a boundary, whatever the frame rate
+    firsts = sorted(set(bisect.bisect_left(frame_times, number * chunk_seconds)
+                        for number in range(int(frame_times[-1] // chunk_seconds) + 1)))
+    bounds = firsts + [len(frame_times)]
+    chunk_count = len(firsts)
+
+    base, extension = os.path.splitext(out_filename)
+    chunk_dir = f"{folder_path}/{base}.chunks"
+    os.makedirs(chunk_dir, exist_ok=True)
+    chunk_files = [f"{chunk_dir}/chunk_{number:05d}{extension}" for number in range(chunk_count)]
+
+    # Claims of the chunks being encoded here, kept fresh so other processes do not take them over
+    held = set()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(stale_seconds / 4):
+            for claim_file in list(held):
+                try:
+                    os.utime(claim_file)
+                except FileNotFoundError:
+                    pass
+
+    def claim(chunk_file):
+        claim_file = f"{chunk_file}.claim"
+        try:
+            os.close(os.open(claim_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(claim_file) < stale_seconds:
+                    return False
+                # Only one process can move the abandoned claim away, the others miss it
+                stale_file = f"{claim_file}.{os.getpid()}.{threading.get_ident()}"
+                os.rename(claim_file, stale_file)
+                os.remove(stale_file)
+                os.close(os.open(claim_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except (FileNotFoundError, FileExistsError):
+                return False
+
+        held.add(claim_file)
+        return True
+
+    def encode_chunk(number):
+        chunk_file = chunk_files[number]
+
+        # Half way from the previous frame, so the first frame is not lost to rounding of its timestamp
+        first, last = bounds[number], bounds[number + 1]
+        start = (frame_times[first - 1] + frame_times[first]) / 2 if first > 0 else 0
+        # Frames keep their timestamps, instead of being resampled to 'r_frame_rate'
+        command = ["ffmpeg", "-y"] + input_options + ["-ss", f"{start:.6f}", "-i", input_path,
+                                                      "-map", "0:v:0", "-an", "-frames:v", str(last - first),
+                                                      "-fps_mode", "passthrough", "-enc_time_base", "-1"]
+
+        tmp_file = f"{chunk_dir}/.chunk_{number:05d}{extension}"
+        try:
+            if run_ffmpeg(command + list(video_args) + [tmp_file], cwd=folder_path).returncode != 0:
+                return chunk_file
+            os.replace(tmp_file, chunk_file)
+        finally:
+            held.discard(f"{chunk_file}.claim")
+            try:
+                os.remove(f"{chunk_file}.claim")
+            except FileNotFoundError:
+                pass
+
+    def worker():
+        # Chunks are claimed one at a time when a job can start, leaving the rest to other processes
+        failed = []
+        for number, chunk_file in enumerate(chunk_files):
+            if os.path.exists(chunk_file) or not claim(chunk_file):
+                continue
+            failed.append(encode_chunk(number))
+
+        return [chunk_file for chunk_file in failed if chunk_file is not None]
+
+    # As many workers as cpu jobs the scheduler runs at once
+    scheduler = get_scheduler()
+    workers = max(1, scheduler.cpu_threads // scheduler.threads_per_job)
+    threading.Thread(target=heartbeat, name="chunk-claims", daemon=True).start()
+    try:
+        executor = ThreadPoolExecutor(workers)
+        jobs = [executor.submit(bind(worker)) for _ in range(workers)]
+        executor.shutdown(wait=False)
+
+        audio_job = None
+        audio_file = f"{chunk_dir}/audio{extension}"
+        if join and has_audio:
+            kind = 'io' if list(audio_args) == ["-c:a", "copy"] else 'cpu'
+            audio_job = submit_ffmpeg(["ffmpeg", "-y"] + input_options + ["-i", input_path, "-map", "0:a:0", "-vn"]
+                                      + list(audio_args) + [audio_file], kind, cwd=folder_path)
+
+        failed = [chunk_file for job in jobs for chunk_file in job.result()]
+
+        if audio_job is not None and audio_job.result().returncode != 0:
+            failed.append(audio_file)
+
+        if len(failed) > 0:
+            raise OSError(f"Encoding {', '.join(failed)} failed.")
+
+        if not join:
+            return chunk_dir
+
+        # Wait for chunks claimed by other processes. The claims of chunks they failed to encode are
+        # removed and those of processes that died go stale, so those are claimed & encoded here
+        while not all(os.path.exists(chunk_file) for chunk_file in chunk_files):
+            time.sleep(poll_seconds)
+            failed = worker()
+            if len(failed) > 0:
+                raise OSError(f"Encoding {', '.join(failed)} failed.")
+    finally:
+        stop.set()
+
+    # Each chunk starts where the source's next chunk starts, not where its own last frame ends
+    durations = [frame_times[bounds[number + 1]] - frame_times[bounds[number]] for number in range(chunk_count - 1)]
+    media_list = write_concat_list(f"{chunk_dir}/chunks.txt", chunk_files, durations + [0], repeat_last=False)
+    command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", media_list]
+    if has_audio:
+        command += ["-i", audio_file, "-map", "0:v:0", "-map", "1:a:0"]
+    process = run_ffmpeg(command + ["-c", "copy", out_filename], 'io', cwd=folder_path)
+
+    # Chunks are kept for another try
+    if process.returncode != 0:
+        raise OSError(f"Joining {out_filename} failed.")
+
+    shutil.rmtree(chunk_dir)
 
     return f"{folder_path}/{out_filename}"
 
@@ -106,125 +327,491 @@ def concat_media_chapters(
     :return: Concatenated video of clips in each folder in directory
     """
 
-    os.chdir(folder_path)
-    cwd = os.getcwd()
-    # List of directories inside current dir
-    dirs = list_dirs(folder_path)
+    folder_path = os.path.abspath(folder_path)
+    # Episode dirs inside current dir
+    paths = episode_paths(folder_path)
 
-    assert len(dirs) > 0, f"{folder_path} contains no directories."
+    assert len(paths) > 0, f"{folder_path} contains no episode directories."
 
-    # List of files inside current dir
-    files = list_files(folder_path)
+    for folder_dir in paths:
+        # List chapters in the order of the episode manifest
+        chapters = read_episode_manifest(folder_dir)['chapters']
+        write_concat_list(f"{folder_dir}/{media_list}", [chapter['file'] for chapter in chapters])
 
-    # Get most common file extension and use it as a base
-    extensions = [file.split(".")[-1] for file in files]
-    file_extension = most_common(extensions)
+        concat_media_demuxer(folder_dir, media_list, out_filename)
 
-    for directory in dirs:
-        os.chdir(cwd + "/" + f"{directory}")
-        folder_dir = os.getcwd()
 
-        # write path locations of chapters to .txt file
-        os.system(f"""for f in *.{file_extension};"""
-                  f"""do echo "file '$f'" >> {folder_dir}/{media_list}; done""")
+# Encoders for the boundary GOPs of 'smart_cut', by codec of the stream copied middle
+smart_cut_encoders = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+}
 
-        concat_media_demuxer(folder_dir, media_list, out_filename)
 
+def smart_cut_parts(
+        keyframes: list,
+        start: float,
+        end: float,
+) -> list:
+    """
+    Splits a cut into the parts 'smart_cut' re-encodes and stream copies: the middle from the first
+    keyframe at or after start to the last keyframe at or before end is copied, the partial GOPs
+    before and after it are encoded.
+
+    :param keyframes: Sorted list of keyframe times in seconds, see 'keyframe_index'
+    :param start: Start of the cut in seconds
+    :param end: End of the cut in seconds
+    :return: List of ('encode' or 'copy', start, end) tuples in order
+    """
+    # Keyframes closer than this to a cut point count as on it
+    tolerance = 1e-3
+
+    first = next((keyframe for keyframe in keyframes if keyframe >= start - tolerance), None)
+    last = next((keyframe for keyframe in reversed(keyframes) if keyframe <= end + tolerance), None)
+
+    # No whole GOP inside the cut
+    if first is None or last is None or last - first <= tolerance:
+        return [('encode', start, end)]
+
+    parts = []
+    if first - start > tolerance:
+        parts.append(('encode', start, first))
+    parts.append(('copy', first, last))
+    if end - last > tolerance:
+        parts.append(('encode', last, end))
+
+    return parts
+
+
+@traced
+def smart_cut(
+        folder_path: str,
+        filename: str,
+        start: float,
+        end: float,
+        out_filename: str,
+        index: dict,
+        crf: int = 18,
+) -> subprocess.CompletedProcess:
+    """
+    Cuts a clip frame accurately at close to stream copy cost. The video between the first and
+    last keyframe inside the cut is stream copied, only the partial GOPs at each end are
+    re-encoded, see 'smart_cut_parts'. The parts are joined with the concat demuxer and the
+    audio is stream copied alongside, cut at the audio frame nearest to start.
+
+    :param folder_path: Name of folder that filename and out_filename are relative to
+    :param filename: Name of source media file
+    :param start: Start of the clip in seconds
+    :param end: End of the clip in seconds
+    :param out_filename: Name of output file
+    :param index: Keyframe index of the source, see 'keyframe_index'. Its video must have a codec in 'smart_cut_encoders'
+    :param crf: Quality of the re-encoded parts, lower is better
+    :return: CompletedProcess of the last ffmpeg command, with the run time of all of them in seconds as 'elapsed'
+    """
+    video = index['video']
+    encoder = smart_cut_encoders[video['codec_name']]
+
+    out_path = f"{folder_path}/{out_filename}"
+    base = f"{os.path.dirname(out_path)}/.{os.path.basename(out_path)}"
+    extension = os.path.splitext(out_filename)[1]
+
+    jobs = []
+    part_files = []
+    keyframes = index['keyframes']
+    for number, (kind, part_start, part_end) in enumerate(smart_cut_parts(keyframes, start, end)):
+        part_file = f"{base}.part{number}{extension}"
+        command = ["ffmpeg", "-y", "-ss", f"{part_start:.6f}", "-i", filename, "-map", "0:V:0", "-an"]
+        if kind == 'copy':
+            # '-t' ends a stream copy by decoding time, which lets B-frames of the next GOP through.
+            # Counting the frames of the copied GOPs ends it on the GOP boundary, whatever the frame rate
+            first = bisect.bisect_left(keyframes, part_start)
+            last = bisect.bisect_left(keyframes, part_end)
+            frames = sum(index['gop_frames'][first:last])
+            jobs.append(submit_ffmpeg(command + ["-frames:v", str(frames), "-c:v", "copy", part_file],
+                                      'io', cwd=folder_path))
+        else:
+            # Same codec & pixel format as the copied middle, so the parts join without re-encoding.
+            # Frames keep their timestamps, instead of being resampled to 'r_frame_rate'
+            jobs.append(submit_ffmpeg(command + ["-t", f"{part_end - part_start:.6f}", "-fps_mode", "passthrough",
+                                                 "-enc_time_base", "-1", "-c:v", encoder,
+                                                 "-preset", "veryfast", "-crf", str(crf),
+                                                 "-pix_fmt", video['pix_fmt'], part_file], cwd=folder_path))
+        part_files.append(part_file)
+
+    audio_file = None
+    if index['audio']:
+        # Stream copy keeps packets between the seek point and '-ss' of an input, as an edit list
+        # the concat demuxer ignores. '-ss' of the output drops them
+        seek = max([keyframe for keyframe in keyframes if keyframe <= start], default=0)
+        audio_file = f"{base}.audio{extension}"
+        jobs.append(submit_ffmpeg(["ffmpeg", "-y", "-ss", f"{seek:.6f}", "-i", filename,
+                                   "-ss", f"{start - seek:.6f}", "-t", f"{end - start:.6f}",
+                                   "-map", "0:a:0", "-c:a", "copy", audio_file], 'io', cwd=folder_path))
+        part_files.append(audio_file)
+
+    processes = [job.result() for job in jobs]
+    elapsed = sum(process.elapsed for process in processes)
+
+    if all(process.returncode == 0 for process in processes):
+        media_list = write_concat_list(f"{base}.parts.txt", [file for file in part_files if file != audio_file])
+        command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", media_list]
+        if audio_file is not None:
+            command += ["-i", audio_file, "-map", "0:v:0", "-map", "1:a:0"]
+        process = run_ffmpeg(command + ["-c", "copy", out_filename], 'io', cwd=folder_path)
+        elapsed += process.elapsed
+        os.remove(media_list)
+    else:
+        process = next(process for process in processes if process.returncode != 0)
+
+    for part_file in part_files:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+
+    process.elapsed = elapsed
+
+    return process
+
+
+@traced
+def encode_still_chapter(
+        episode_path: str,
+        image_file: str,
+        media_file: str,
+        out_filename: str,
+        framerate: int = 25,
+        segment_seconds: int = 1,
+) -> str:
+    """
+    Combines a still image with a chapter's audio at a cost that does not grow with the chapter length.
+    The image is encoded once into a short segment, which is then looped under the audio
+    with stream copy. Outputs of the same image size and framerate concat cleanly with 'concat_media_demuxer'.
+
+    :param episode_path: Path of episode dir containing the files
+    :param image_file: Name of image file
+    :param media_file: Name of chapter media file, only its audio is used
+    :param out_filename: Name of output file
+    :param framerate: Framerate of output video
+    :param segment_seconds: Length of the encoded segment in seconds
+    :return: Path of output file
+    """
+    segment_file = f"{os.path.splitext(out_filename)[0]}.still.mp4"
+
+    # Whole frames covering the audio, so no chapter leaves a gap in the video at a concat join.
+    # The chapter's own video may run longer than its audio
+    media_path = f"{episode_path}/{media_file}"
+    duration = next((float(stream['duration']) for stream in probe_streams(media_path)
+                     if stream['codec_type'] == 'audio' and 'duration' in stream), None)
+    if duration is None:
+        duration = probe_duration(media_path)
+    frames = math.ceil(duration * framerate - 1e-6)
+
+    try:
+        # Without B-frames, the first frames of the loop in decode order are its first frames to display
+        still = run_ffmpeg(["ffmpeg", "-y", "-loop", "1", "-framerate", str(framerate), "-i", image_file,
+                            "-t", str(segment_seconds), "-c:v", "libx264", "-tune", "stillimage", "-bf", "0",
+                            "-pix_fmt", "yuv420p", segment_file], threads=1, cwd=episode_path)
+        if still.returncode != 0:
+            raise OSError(f"Encoding {segment_file} failed.")
+        record_throughput('still', 1, still.elapsed)
+
+        mux = run_ffmpeg(["ffmpeg", "-y", "-stream_loop", "-1", "-i", segment_file, "-i", media_file,
+                          "-map", "0:v", "-map", "1:a", "-c", "copy", "-frames:v", str(frames), out_filename],
+                         'io', cwd=episode_path)
+        if mux.returncode != 0:
+            raise OSError(f"Encoding {out_filename} failed.")
+        record_throughput('mux', os.path.getsize(media_path), mux.elapsed)
+    finally:
+        if os.path.exists(f"{episode_path}/{segment_file}"):
+            os.remove(f"{episode_path}/{segment_file}")
+
+    return f"{episode_path}/{out_filename}"
+
+
+@traced
+def encode_episode(
+        episode_path: str,
+        out_filename: str = "concat_media.mp4",
+        file_ext: str = "mp4",
+        still: bool = True,
+) -> str:
+    """
+    Given an episode dir with chapter media files and their images, concats each chapter audio
+    with its image and then all chapters of the episode, in the order of its manifest, into 'out_filename'.
+    Only uses absolute paths, so it is safe to call from several threads at once.
+
+    :param episode_path: Path of episode dir
+    :param out_filename: Name of output file
+    :param file_ext: Not used, chapter files are listed by the episode manifest
+    :param still: Encode each image once and loop it, see 'encode_still_chapter'. Otherwise
+    encode the image over the whole chapter
+    :return: Path of output file
+    """
+    chapters = read_episode_manifest(episode_path)['chapters']
+
+    arguments = []
+    jobs = []
+    chapter_files = []
+    for chapter in chapters:
+        chapter_file = f"chapter_{chapter['file']}"
+
+        # Combine chapter audio and image into a video
+        if still:
+            arguments.append((episode_path, chapter['image'], chapter['file'], chapter_file))
+        else:
+            jobs.append(submit_ffmpeg(["ffmpeg", "-y", "-i", chapter['image'], "-i", chapter['file'],
+                                       "-c:v", "libx264", "-tune", "stillimage", "-c:a", "copy",
+                                       "-pix_fmt", "yuv420p", chapter_file], cwd=episode_path))
+
+        chapter_files.append(chapter_file)
+
+    # List chapter files for the concat
+    write_concat_list(f"{episode_path}/media.txt", chapter_files)
+
+    if len(arguments) > 0:
+        # Threads only wait for their jobs, which are run by the ffmpeg scheduler
+        with Pool(len(arguments)) as pool:
+            pool.starmap(bind(encode_still_chapter), arguments)
+
+    for job in jobs:
+        job.result()
 
+    # Concat all chapter videos into one
+    return concat_media_demuxer(episode_path, "media.txt", out_filename)
+
+
+@traced
 def concat_media_chapters_and_images(
         folder_path: str,
         out_filename: str = "concat_media.mp4",
         file_ext: str = "mp4",
+        still: bool = True,
 ) -> None:
     """
     Given a dir with dirs containing media chapter files, concats each chapter audio with chapter image.
-    It then concats all the chapters together into a 'out_filename' file using 'media.txt' previously created.
-    Finally, it saves another 'media.txt' file in main dir with names for final concat later.
+    It then concats all the chapters together into a 'out_filename' file, see 'encode_episode'.
+    Finally, it saves a 'media.txt' file in main dir listing the episodes for the final concat later,
+    in the order of the compilation manifest saved by 'list_image_info', or by name without one.
+    Episodes are processed in parallel and their chapters encoded through the ffmpeg scheduler,
+    so an episode is concatenated as soon as its own chapters are ready.
 
     :param folder_path: Name of folder containing dirs
     :param out_filename: Name of output file
     :param file_ext: Name of existing media extension, without the dot
+    :param still: Encode each image once and loop it, see 'encode_still_chapter'
     :return: None
     """
 
-    os.chdir(folder_path)
+    folder_path = os.path.abspath(folder_path)
 
-    # List of directories inside current dir
-    dirs = [dir for dir in list_dirs(folder_path)
-            if dir != "images"]
+    # Episode dirs inside current dir, in the order of the compilation manifest if there is one
+    manifest_file = f"{folder_path}/{compilation_manifest_name}"
+    if os.path.exists(manifest_file):
+        paths = [f"{folder_path}/{os.path.basename(episode['path'])}"
+                 for episode in read_manifest(manifest_file)['episodes']]
+    else:
+        paths = episode_paths(folder_path)
 
-    assert len(dirs) > 0, f"{folder_path} contains no directories."
+    assert len(paths) > 0, f"{folder_path} contains no episode directories."
 
-    for directory in dirs:
-        os.chdir(folder_path + "/" + directory)
-        cwd = os.getcwd()
+    arguments = [(path, out_filename, file_ext, still) for path in paths]
+
+    with Pool(len(paths)) as pool:
+        pool.starmap(bind(encode_episode), arguments)
+
+    write_concat_list(f"{folder_path}/media.txt", [f"{path}/{out_filename}" for path in paths])
+
+
+@traced
+def concat_files(
+        folder_path: str,
+        files: list,
+        out_filename: str = "concat_media.mp4",
+) -> str:
+    """
+    Concatenates any number of media files in one ffmpeg run. All files are probed first.
+    If their streams match, see 'concat_signature', they are joined with the concat demuxer
+    and stream copy. Otherwise they are re-encoded once with the concat filter, scaled and
+    padded to the size and framerate of the first file.
+
+    :param folder_path: Name of folder that files and out_filename are relative to
+    :param files: List of media files in concat order
+    :param out_filename: Name of output file including extension, eg. 'media.mp4'
+    :return: Path of output file
+    """
+    assert len(files) > 0, "No files to concatenate."
+
+    folder_path = os.path.abspath(folder_path)
+    paths = [os.path.join(folder_path, file) for file in files]
+
+    with Pool(min(len(paths), 8)) as pool:
+        streams = pool.map(probe_streams, paths)
+
+    signatures = {concat_signature(file_streams) for file_streams in streams}
 
-        # List all media files
-        files = [file for file in list_files(cwd)
-                 if file.endswith(f".{file_ext}") is True]
+    if len(signatures) == 1:
+        media_list = f"{os.path.splitext(out_filename)[0]}.concat.txt"
+        write_concat_list(f"{folder_path}/{media_list}", paths)
 
-        for file in files:
-            file_name = re.split(f".{file_ext}", file)[0]
+        start = time.monotonic()
+        concat_media_demuxer(folder_path, media_list, out_filename)
+        record_throughput('concat', sum(os.path.getsize(path) for path in paths), time.monotonic() - start)
+        os.remove(f"{folder_path}/{media_list}")
 
-            # Combine chapter audio and image into a video
-            os.system(f"ffmpeg -i {file_name}.jpeg -i {file_name}.{file_ext} -c:v libx264 "
-                      f"-tune stillimage -c:a copy -pix_fmt yuv420p chapter_{file_name}.{file_ext}")
+        return f"{folder_path}/{out_filename}"
 
-            # Append chapter file name for later concat
-            os.system(f"""echo "file 'chapter_{file_name}.{file_ext}'" >> media.txt""")
+    print(f"Inputs of {out_filename} differ in codec or parameters, re-encoding.")
 
-        # Concat all chapter videos into one
-        concat_media_demuxer(cwd, "media.txt", out_filename)
+    has_video = all(any(stream['codec_type'] == 'video' for stream in file_streams) for file_streams in streams)
+    has_audio = all(any(stream['codec_type'] == 'audio' for stream in file_streams) for file_streams in streams)
 
-        os.system(f"""echo "file '{directory}/{out_filename}'" >> {folder_path}/media.txt""")
-    # cd back to dir
-    os.chdir(folder_path)
+    command = ["ffmpeg", "-y"]
+    for path in paths:
+        command += ["-i", path]
+
+    filters = []
+    inputs = ""
+    if has_video:
+        first_video = next(stream for stream in streams[0] if stream['codec_type'] == 'video')
+        width, height, framerate = first_video['width'], first_video['height'], first_video['r_frame_rate']
+    for number in range(len(paths)):
+        if has_video:
+            filters.append(f"[{number}:v:0]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                           f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={framerate}[v{number}]")
+            inputs += f"[v{number}]"
+        if has_audio:
+            inputs += f"[{number}:a:0]"
+
+    filters.append(f"{inputs}concat=n={len(paths)}:v={int(has_video)}:a={int(has_audio)}"
+                   + ("[outv]" if has_video else "") + ("[outa]" if has_audio else ""))
+    command += ["-filter_complex", ";".join(filters)]
+
+    if has_video:
+        command += ["-map", "[outv]", "-c:v", "libx264", "-pix_fmt", "yuv420p"]
+    if has_audio:
+        command += ["-map", "[outa]", "-c:a", "aac"]
+
+    run_ffmpeg(command + [out_filename], cwd=folder_path)
+
+    return f"{folder_path}/{out_filename}"
+
+
+# Audio codec each audio output extension can hold as is, and the encoder for any other codec
+audio_codecs = {
+    '.m4a': ('aac', 'aac'),
+    '.mp3': ('mp3', 'libmp3lame'),
+    '.opus': ('opus', 'libopus'),
+    '.flac': ('flac', 'flac'),
+}
+
+# Audio output extensions whose container can hold cover art as an attached picture
+cover_extensions = ('.m4a', '.mp3', '.flac')
+
+
+@traced
+def concat_audio(
+        folder_path: str,
+        manifest: dict,
+        out_filename: str = "Final/final_audio.m4a",
+        cover_file: str = None,
+        title: str = None,
+) -> str:
+    """
+    Joins the chapter clips of a compilation into one audio file with a chapter table, see
+    'ffmetadata', instead of chapter images. Clips are joined with the concat demuxer and their
+    audio is stream copied, unless its codec does not fit out_filename's extension, see 'audio_codecs'.
+    Video streams of the clips are dropped, as is cover_file for outputs without cover art, see 'cover_extensions'.
+
+    :param folder_path: Name of folder that out_filename is relative to
+    :param manifest: Dict of 'compilation_manifest' type
+    :param out_filename: Name of output file, eg. 'final_audio.m4a' or 'final_audio.mp3'
+    :param cover_file: Path of a .jpeg or .png image embedded as cover art. Default is none
+    :param title: Title of the compilation. Default is none
+    :return: Path of output file
+    """
+    folder_path = os.path.abspath(folder_path)
+    extension = os.path.splitext(out_filename)[1].lower()
+    files = [chapter['file'] for episode in manifest['episodes'] for chapter in episode['chapters']]
+
+    assert len(files) > 0, "No chapters to concatenate."
+
+    # Chapters start where the previous clip really ends, not where its timestamps say
+    with Pool(min(len(files), 8)) as pool:
+        durations = pool.map(probe_duration, files)
+
+    codec = next((stream['codec_name'] for stream in probe_streams(files[0]) if stream['codec_type'] == 'audio'), None)
+    copy_codec, encoder = audio_codecs.get(extension, (codec, None))
+
+    # Ogg has no attached pictures, ffmpeg fails on the image stream
+    if extension not in cover_extensions:
+        cover_file = None
+
+    base = f"{folder_path}/{os.path.splitext(out_filename)[0]}"
+    media_list = write_concat_list(f"{base}.concat.txt", files)
+    metadata_file = f"{base}.ffmetadata.txt"
+    with open(metadata_file, 'w') as file:
+        file.write(ffmetadata(manifest, durations, title))
+
+    command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", media_list, "-i", metadata_file]
+    if cover_file is not None:
+        command += ["-i", os.path.abspath(cover_file)]
+    command += ["-map", "0:a", "-map_metadata", "1", "-map_chapters", "1"]
+    if cover_file is not None:
+        command += ["-map", "2:v", "-c:v", "copy", "-disposition:v:0", "attached_pic"]
+
+    if codec == copy_codec:
+        command += ["-c:a", "copy"]
+    else:
+        command += ["-c:a", encoder]
+    if extension == ".mp3":
+        # Cover art & chapters of most players are read from ID3v2.3
+        command += ["-id3v2_version", "3"]
+
+    start = time.monotonic()
+    process = run_ffmpeg(command + [out_filename], 'io' if codec == copy_codec else 'cpu', cwd=folder_path)
+
+    os.remove(media_list)
+    os.remove(metadata_file)
+
+    if process.returncode != 0:
+        if os.path.exists(f"{folder_path}/{out_filename}"):
+            os.remove(f"{folder_path}/{out_filename}")
+        raise OSError(f"Encoding {out_filename} failed.")
+
+    if codec == copy_codec:
+        record_throughput('concat', sum(os.path.getsize(file) for file in files), time.monotonic() - start)
+
+    return f"{folder_path}/{out_filename}"
 
 
 def concat_video_files_filter(
         folder_path: str,
         out_filename: str = "concat_media.mp4",
-) -> None:
+        final_filename: str = "Whole_file.mp4",
+) -> str:
     """
-    Given a directory it searches for the same filename in each of them and concatenates all.
+    Given a directory it searches for the same filename in each of them and concatenates all,
+    see 'concat_files'.
 
     :param folder_path:  Name of folder containing the media files
     :param out_filename: Name of file to concatenate
-    :return:
+    :param final_filename: Name of output file
+    :return: Path of output file
     """
 
-    os.chdir(folder_path)
     files = []
     dirs = list_dirs(folder_path)
     for directory in dirs:
         files.append(f"{directory}/{out_filename}")
 
-    base_file = files[0]
-    count = 2
-    out_files = []
-    for file in files[1:]:
-        extension = '.mp4'
-        out_file = 'Whole_file' + str(count)
-        command = f"""
-        ffmpeg -i '{base_file}' -i '{file}' \
-        -filter_complex "[0:v:0][0:a:0][1:v:0][1:a:0]concat=n=2:v=1:a=1[outv][outa]" \
-        -map "[outv]" -map "[outa]" '{out_file}{extension}'
-        """
-        base_file = out_file + extension
-        out_files.append(out_file + extension)
-        count += 1
-        os.system(command)
-
-        if len(out_files) > 1:
-            os.system(f"rm '{out_files[0]}'")
-            out_files.pop(0)
+    return concat_files(folder_path, files, final_filename)
 
 
 def convert_media(
         folder_path: str,
         video_codec: str = 'copy',
         audio_codec: str = 'copy',
-        file_extension: str = 'mkv'
+        file_extension: str = 'mkv',
+        chunk_seconds: float = None,
 ) -> list:
     """
     Converts all videos from file into new ones with different codecs.
@@ -233,20 +820,33 @@ def convert_media(
     :param video_codec: Name of video codec to apply
     :param audio_codec: Name of audio codec to apply
     :param file_extension: Name of new output file extension
+    :param chunk_seconds: Encode each video in chunks of this many seconds in parallel, see 'encode_chunked'.
+    Default is one ffmpeg process per file
     :return: List of new filenames
     """
-    os.chdir(folder_path)
     files = list_files_paths(folder_path)
 
+    # Stream copying both codecs needs no encoder
+    kind = 'io' if video_codec == audio_codec == 'copy' else 'cpu'
+
     out_files = []
+    jobs = []
     for file in files:
         out_file = file.split(".")[0]
         out_file += "." + file_extension
 
-        command = f"ffmpeg -i {file} -c:v {video_codec} -c:a {audio_codec} {out_file}"
-        p = os.popen(command, 'w')
-        p.write("y\n")
+        if chunk_seconds is not None and video_codec != 'copy':
+            # The chunks of one file already keep all cores busy
+            encode_chunked(folder_path, os.path.basename(file), os.path.relpath(out_file, folder_path),
+                           ["-c:v", video_codec],
+                           ["-c:a", audio_codec], chunk_seconds=chunk_seconds)
+        else:
+            command = ["ffmpeg", "-y", "-i", file, "-c:v", video_codec, "-c:a", audio_codec, out_file]
+            jobs.append(submit_ffmpeg(command, kind))
 
         out_files.append(out_file)
 
+    for job in jobs:
+        job.result()
+
     return out_files
@@ -14,23 +14,71 @@ from pytube import (
     Channel,
     YouTube,
 )
-from common.info import get_chapters
+from pytube.extract import video_id
+from common.tracing import traced
+from common.fetch import (
+    download_files,
+    load_manifest,
+    is_downloaded,
+)
+from common.index import (
+    build_chapter_index,
+    load_chapter_index,
+    query_chapter_index,
+)
 
-from common.variables import (
-    column_names,
-    regex_non_word,
+from common.store import load_chapter_store
+from common.filters import (
+    filter_videos,
+    video_mask,
 )
+from common.variables import column_names
+
+
+def video_info(url: str) -> list:
+    """
+    Fetches the info of a single YouTube video.
+
+    :param url: URL of the YouTube video
+    :returns: List of Name, URL_Link, Length, Views, Publish_date, Description, Keywords, Author, ID
+    """
+    video = YouTube(url)
+
+    time_stamp = str(timedelta(seconds=video.length))
+
+    return [
+        video.title,
+        video.watch_url,
+        time_stamp,
+        video.views,
+        video.publish_date,
+        video.description,
+        video.keywords,
+        video.author,
+        video.video_id,
+    ]
 
 
+@traced
 def channel_videos_list(
         channel_url: str,
         filename: str = "",
+        incremental: bool = False,
+        concurrency: int = 8,
+        chunk_size: int = 50,
 ) -> pd.DataFrame:
     """
     Given a YouTube channel URL, collects the info of all of its videos and constructs a DataFrame.
+    Video info is fetched concurrently in a thread pool.
+
+    In incremental mode, video ids already in an existing 'filename' are skipped and the new videos
+    are appended to it every 'chunk_size' rows, so an interrupted crawl keeps what it fetched.
 
     :param channel_url: A URL of the YouTube channel
     :param filename: Name of the file to save to. If not provided will only return DataFrame
+    :param incremental: Only fetch videos not yet in 'filename' and append them to it
+    :param concurrency: Maximum number of videos fetched at once
+    :param chunk_size: Number of new rows appended to file at a time in incremental mode
     :returns: Pandas DataFrame with columns:
     Name, URL_Link, Length, Views, Publish_date, Description, Keywords, Author, ID
     """
@@ -44,27 +92,36 @@ def channel_videos_list(
         name = re.sub(" ", "", channel.channel_name)
         filename = name + "_videos.csv"
 
+    existing = None
+    if incremental and os.path.isfile(filename):
+        existing = pd.read_csv(filename)
+
+    urls = list(channel.video_urls)
+    if existing is not None:
+        known_ids = set(existing['ID'])
+        urls = [url for url in urls if video_id(url) not in known_ids]
+        print(f"{len(known_ids)} videos already in {filename}, {len(urls)} new")
+
+    def fetch_info(url):
+        try:
+            return video_info(url)
+        except Exception:
+            print(f"Something went wrong while collecting: {url}.")
+
     # Main info list
     videos_info = []
 
-    for video in tqdm(channel.videos):
-
-        time_stamp = str(timedelta(seconds=video.length))
-
-        # Append video info to main list
-        videos_info.append(
-            [
-                video.title,
-                video.watch_url,
-                time_stamp,
-                video.views,
-                video.publish_date,
-                video.description,
-                video.keywords,
-                video.author,
-                video.video_id,
-            ]
-        )
+    with Pool(concurrency) as pool:
+        for info in tqdm(pool.imap(fetch_info, urls), total=len(urls)):
+            if info is not None:
+                videos_info.append(info)
+
+            if incremental and len(videos_info) >= chunk_size:
+                existing = append_videos_info(filename, videos_info, existing)
+                videos_info = []
+
+    if incremental:
+        return append_videos_info(filename, videos_info, existing)
 
     # Construct a Pandas DataFrame and append to file
     df = pd.DataFrame(videos_info, columns=column_names)
@@ -75,17 +132,77 @@ def channel_videos_list(
     return df
 
 
+def append_videos_info(
+        filename: str,
+        videos_info: list,
+        existing: pd.DataFrame = None,
+) -> pd.DataFrame:
+    """
+    Appends rows of video info to a .csv file, creating it if needed. An existing file's
+    layout is kept, including a leading index column if it has one.
+
+    :param filename: Name of the .csv file to append to
+    :param videos_info: List of rows of 'video_info' type
+    :param existing: Pandas DataFrame of rows already in the file, None if there is no file
+    :returns: Pandas DataFrame of existing and appended rows
+    """
+    df = pd.DataFrame(videos_info, columns=column_names)
+
+    if existing is None:
+        df.to_csv(filename, index=False)
+        return df
+
+    if len(df) > 0:
+        with_index = existing.columns[0] not in column_names
+        df.index = range(len(existing), len(existing) + len(df))
+        df.to_csv(filename, mode='a', header=False, index=with_index)
+
+        if with_index:
+            df.insert(0, existing.columns[0], df.index)
+
+    return pd.concat([existing, df], ignore_index=True)
+
+
+def resolve_stream(
+        url: str,
+        media_type: int = 1,
+) -> tuple:
+    """
+    Looks up the direct stream URL of a YouTube video.
+
+    :param url: URL of the YouTube video
+    :param media_type: 0 for highest resolution Video, 1 for Audio. Default 1-Audio
+    :return: Tuple of stream URL and file extension, eg. 'mp4'
+    """
+    yt = YouTube(url)
+
+    if media_type == 0:
+        stream = yt.streams.filter().get_highest_resolution()
+    else:
+        stream = yt.streams.filter(only_audio=True).first()
+
+    return stream.url, stream.mime_type.split("/")[-1]
+
+
+@traced
 def download_media(
         chapter_dict: dict,
         pathname: str = None,
         media_type: int = 1,
+        concurrency: int = 8,
+        on_complete=None,
 ) -> str:
     """
-    Download media from YouTube given a URL list.
+    Download media from YouTube given a URL list. Stream URLs are looked up in a thread pool,
+    then all files are streamed concurrently by the asyncio engine in 'common.fetch'.
+    Progress is kept per video id in '.manifest.json' inside pathname, so a rerun skips finished
+    files and resumes interrupted ones.
 
     :param chapter_dict: Dict of chapters of 'get_matching_chapters' type
     :param pathname: Where to save. Default is current working dir.
     :param media_type: 0 for Video, 1 for Audio. Default 1-Audio
+    :param concurrency: Maximum number of simultaneous downloads. Not tied to CPU count
+    :param on_complete: Function called with (URL, file path) as soon as each media is downloaded
     :return: List of downloaded media
     """
     def error_handler_wrapper(func):
@@ -103,138 +220,83 @@ def download_media(
     if pathname is None:
         pathname = os.getcwd()
 
-    # list of all YouTube URLs
-    url_list = [url for url in chapter_dict.keys()]
+    manifest_file = f"{pathname}/.manifest.json"
+    manifest = load_manifest(manifest_file)
+
+    # Media already downloaded by a previous run
+    done_list = [manifest[video_id(url)]['path'] for url in chapter_dict
+                 if is_downloaded(manifest, video_id(url))]
+
+    # list of all YouTube URLs still to download
+    url_list = [url for url in chapter_dict.keys()
+                if not is_downloaded(manifest, video_id(url))]
     # number of URLs
     media_num = len(url_list)
 
-    media_names = [chapter_dict[chapter]['media_name'] for chapter in chapter_dict]
-
-    arguments = zip(url_list, media_names)
+    media_names = [chapter_dict[url]['media_name'] for url in url_list]
 
     @error_handler_wrapper
-    def download_audio(url_and_filename):
-        url, filename = url_and_filename
-        yt = YouTube(url)
-        extension = yt.streams.filter(only_audio=True).first().mime_type
-        filename += "." + extension.split("/")[-1]
-        file = yt.streams.filter(only_audio=True).first().download(pathname,
-                                                                   max_retries=2, filename=filename)
+    def find_stream(url):
+        return resolve_stream(url, media_type)
 
-        return file
+    os.makedirs(pathname, exist_ok=True)
 
-    @error_handler_wrapper
-    def download_video(url_and_filename):
-        url, filename = url_and_filename
-        yt = YouTube(url)
-        extension = yt.streams.filter().get_highest_resolution().mime_type
-        filename += "." + extension.split("/")[-1]
-        file = yt.streams.filter().get_highest_resolution().download(pathname,
-                                                                     max_retries=2, filename=filename)
-
-        return file
-
-    try:
-        os.chdir(pathname)
-    except FileNotFoundError:
-        os.mkdir(pathname)
-        os.chdir(pathname)
-
-    # If video selected
-    if media_type == 0:
-        print(f"{datetime.now()} - Started downloading video/s.")
-        print(f"Downloading {media_num} item/s in {pathname}")
+    media = "video/s" if media_type == 0 else "audio/s"
+    print(f"{datetime.now()} - Started downloading {media}.")
+    print(f"Downloading {media_num} item/s in {pathname}, {len(done_list)} already downloaded")
+
+    with Pool(concurrency) as pool:
+        streams = pool.map(find_stream, url_list)
 
-        with Pool(os.cpu_count()) as pool:
-            file_names = tqdm(pool.imap(download_video, arguments), total=media_num)
-            media_list = [name for name in file_names]
+    jobs = [(video_id(url), stream[0], f"{pathname}/{filename}.{stream[1]}")
+            for url, stream, filename in zip(url_list, streams, media_names) if stream is not None]
 
-    # If audio is selected
+    if on_complete is not None:
+        for url in chapter_dict:
+            if is_downloaded(manifest, video_id(url)):
+                on_complete(url, manifest[video_id(url)]['path'])
+
+        urls = {video_id(url): url for url in url_list}
+
+        def downloaded(key, filename):
+            on_complete(urls[key], filename)
     else:
-        print(f"{datetime.now()} - Started downloading audio/s.")
-        print(f"Downloading {media_num} item/s in {pathname}")
+        downloaded = None
 
-        with Pool(os.cpu_count()) as pool:
-            file_names = tqdm(pool.imap(download_audio, arguments), total=media_num)
-            media_list = [name for name in file_names]
+    media_list = done_list + download_files(jobs, concurrency, manifest_file=manifest_file,
+                                            on_complete=downloaded)
 
     return f"{datetime.now()} - Downloaded:\n{media_list}"
 
 
+@traced
 def get_matching_chapters(
-        dataframe: pd.DataFrame,
+        dataframe: pd.DataFrame = None,
         keywords: list = None,
+        filters: dict = None,
+        csv_file: str = None,
 ) -> dict:
     """
     Extracts a dict of YouTube video chapters, from a Pandas DataFrame object, that match any of
-    the keywords provided.
+    the keywords provided. Videos are filtered on their columns first, so chapters are only
+    extracted from the rows that pass.
+
+    With csv_file, chapters are looked up in the saved chapter index of the file instead, which
+    is only extended by the rows appended since the last call, see 'load_chapter_index'. Filters
+    are then a mask over its videos and dataframe is not needed.
 
     :param dataframe: Pandas DataFrame of the 'channel_videos_list' return form
     :param keywords: List of string keywords to check against video chapters
+    :param filters: Dict of filters of the 'video_mask' type, eg. {'min_views': '1M'}. Default is none
+    :param csv_file: Path of the .csv file of the 'channel_videos_list' type. Default is to index dataframe
     :returns: Dict of URLs with matching chapters
     """
-    if keywords is None:
-        keywords = [""]
-
-    chapters_to_extract = {}
-    for i, description in enumerate(dataframe['Description']):
-
-        length = dataframe.at[i, 'Length']
-        # Get a dict of video chapters
-        video_chapters = get_chapters(description, length)
-
-        chapters = {}
-        for chapter in video_chapters.keys():
-            # Split chapter into words
-            chapter_words = regex_non_word.split(chapter)
-            # If any of the chapters matches at least one keyword
-            for keyword in keywords:
-                try:
-                    sign = keyword[0]
-                except IndexError:
-                    sign = ""
-
-                if sign == "-":
-                    word = keyword[1:].lower()
-                else:
-                    word = keyword.lower()
-
-                if word in chapter_words and sign == "-":
-                    break
-
-                if word in chapter_words and sign != "-":
-                    # Add chapter to dict
-                    chapters[chapter] = video_chapters[chapter]
-                    break
-
-            # If a negated keyword matches and already added, delete from chapters
-            for keyword in keywords:
-                try:
-                    sign = keyword[0]
-                except IndexError:
-                    sign = ""
-
-                if sign == "-":
-                    word = keyword[1:].lower()
-                else:
-                    word = keyword.lower()
-
-                if word in chapter_words and sign == "-":
-                    try:
-                        del chapters[chapter]
-                    except KeyError:
-                        pass
-
-        # add to dict
-        if len(chapters) > 0:
-            url = dataframe.at[i, 'URL_Link']
-            media_name = regex_non_word.sub("_", dataframe.at[i, 'Name'])
-            guest = dataframe.at[i, 'Description'].split(".")[0]
-
-            chapters_to_extract[url] = {
-                'media_name': media_name,
-                'guest': guest,
-                'chapters': chapters,
-            }
-
-    return chapters_to_extract
+    if csv_file is None:
+        index = build_chapter_index(filter_videos(dataframe, filters))
+
+        return query_chapter_index(index, keywords)
+
+    index = load_chapter_index(csv_file)
+    videos = video_mask(load_chapter_store(csv_file)['videos'], filters) if filters else None
+
+    return query_chapter_index(index, keywords, videos)
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import httpx
+
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+
+from common.tracing import get_tracer
+from common.throughput import record_throughput
+
+
+def _client_options(concurrency: int) -> dict:
+    """
+    Returns AsyncClient keyword arguments for a pool of keep-alive connections that follows
+    redirects. Supports both old (PoolLimits) and new (Limits) httpx versions.
+
+    :param concurrency: Maximum number of connections
+    :return: Dict of keyword arguments
+    """
+    try:
+        return {
+            'limits': httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            'follow_redirects': True,
+        }
+    except AttributeError:
+        return {'pool_limits': httpx.PoolLimits(soft_limit=concurrency, hard_limit=concurrency)}
+
+
+def load_manifest(manifest_file: str) -> dict:
+    """
+    Loads a download manifest, one record per key with the source URL, final path,
+    expected size, bytes received, sha256 content hash and whether the download is complete.
+
+    :param manifest_file: Path of manifest .json file
+    :return: Dict of key -> record. Empty if the file does not exist
+    """
+    try:
+        with open(manifest_file, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(
+        manifest: dict,
+        manifest_file: str,
+) -> None:
+    """
+    Atomically saves a download manifest.
+
+    :param manifest: Dict of 'load_manifest' type
+    :param manifest_file: Path of manifest .json file
+    :return: None
+    """
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    os.replace(tmp_file, manifest_file)
+
+
+def is_downloaded(
+        manifest: dict,
+        key: str,
+) -> bool:
+    """
+    Checks whether the manifest records a complete download for key whose file is still on disk.
+
+    :param manifest: Dict of 'load_manifest' type
+    :param key: Download key, eg. YouTube video id
+    :return: True if complete
+    """
+    record = manifest.get(key)
+    if record is None or not record.get('complete'):
+        return False
+
+    try:
+        size = os.path.getsize(record['path'])
+    except OSError:
+        return False
+
+    return record.get('expected_size') is None or size == record['expected_size']
+
+
+def _file_sha256(filename: str):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest
+
+
+async def fetch_file(
+        client: httpx.AsyncClient,
+        url: str,
+        filename: str,
+        chunk_size: int = 1 << 20,
+        record: dict = None,
+) -> str:
+    """
+    Streams a URL into a file, writing in chunks. The file is written as 'filename.part' and
+    only renamed to 'filename' once complete. An existing 'filename.part' is resumed with an
+    HTTP Range request. If the server ignores the range, the download restarts from zero.
+    Chunks are written and hashed on executor threads, so other downloads on the event loop
+    do not wait for the disk or for the hash of a finished file.
+
+    :param client: Shared httpx AsyncClient
+    :param url: URL to download
+    :param filename: Path of file to save to
+    :param chunk_size: Size of the file write buffer in bytes
+    :param record: Manifest record to keep updated, see 'load_manifest'
+    :return: Path of saved file
+    """
+    if record is None:
+        record = {}
+
+    loop = asyncio.get_running_loop()
+    part_file = filename + ".part"
+    try:
+        received = os.path.getsize(part_file)
+    except FileNotFoundError:
+        received = 0
+
+    record.update({
+        'url': url,
+        'path': filename,
+        'bytes_received': received,
+        'complete': False,
+    })
+
+    # Part file already holds everything a previous run expected
+    if received == 0 or received != record.get('expected_size'):
+        headers = {'Range': f"bytes={received}-"} if received > 0 else {}
+
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 416:
+                # Range past the end of the file, the part file cannot be trusted
+                os.remove(part_file)
+                return await fetch_file(client, url, filename, chunk_size, record)
+
+            response.raise_for_status()
+
+            if response.status_code != 206:
+                received = 0
+
+            content_length = response.headers.get('Content-Length')
+            record['expected_size'] = received + int(content_length) if content_length is not None else None
+
+            # The hash is updated with every chunk written, only a resumed part is read again
+            digest = hashlib.sha256()
+            if received > 0:
+                digest = await loop.run_in_executor(None, _file_sha256, part_file)
+
+            def write(file, data):
+                file.write(data)
+                digest.update(data)
+
+            with open(part_file, 'ab' if received > 0 else 'wb', buffering=0) as file:
+                buffer = bytearray()
+                async for chunk in response.aiter_bytes():
+                    buffer += chunk
+                    received += len(chunk)
+                    record['bytes_received'] = received
+                    if len(buffer) >= chunk_size:
+                        await loop.run_in_executor(None, write, file, bytes(buffer))
+                        buffer.clear()
+                if len(buffer) > 0:
+                    await loop.run_in_executor(None, write, file, bytes(buffer))
+
+        if record['expected_size'] is not None and received != record['expected_size']:
+            raise OSError(f"Incomplete download of {url}: {received} of {record['expected_size']} bytes.")
+    else:
+        digest = await loop.run_in_executor(None, _file_sha256, part_file)
+
+    record['sha256'] = digest.hexdigest()
+    os.replace(part_file, filename)
+    record['complete'] = True
+
+    return filename
+
+
+async def fetch_files(
+        jobs: list,
+        concurrency: int = 8,
+        chunk_size: int = 1 << 20,
+        timeout: float = 60,
+        manifest_file: str = None,
+        on_complete=None,
+) -> list:
+    """
+    Downloads many URLs concurrently over one pool of keep-alive connections.
+    With a manifest, completed downloads are skipped at once and interrupted ones resumed.
+
+    :param jobs: List of (key, URL, filename) tuples. Key identifies the download in the manifest
+    :param concurrency: Maximum number of downloads in flight
+    :param chunk_size: Size of the file write buffer in bytes
+    :param timeout: Network timeout in seconds
+    :param manifest_file: Path of manifest .json file. Default is no manifest
+    :param on_complete: Function called with (key, file path) as soon as each download succeeds.
+    It runs on a thread of its own, so it may block, eg. on a full queue, without stalling the downloads
+    :return: List of saved file paths in the order of jobs, None for failed downloads
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    manifest = load_manifest(manifest_file) if manifest_file is not None else {}
+    fetched_bytes = 0
+    start = time.monotonic()
+
+    # Callbacks run one at a time, off the event loop and off its default executor used for DNS lookups
+    callbacks = ThreadPoolExecutor(1)
+
+    async with httpx.AsyncClient(timeout=timeout, **_client_options(concurrency)) as client:
+        progress = tqdm(total=len(jobs))
+
+        async def fetch(key, url, filename):
+            nonlocal fetched_bytes
+
+            if not (is_downloaded(manifest, key) and manifest[key]['path'] == filename):
+                async with semaphore:
+                    record = manifest.setdefault(key, {})
+                    part_file = filename + ".part"
+                    resumed = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+                    try:
+                        await fetch_file(client, url, filename, chunk_size, record)
+                        fetched_bytes += max(0, record['bytes_received'] - resumed)
+                    except (httpx.HTTPError, OSError) as error:
+                        print(f"Something went wrong while downloading: {url}. {error!r}")
+                        return None
+                    finally:
+                        progress.update(1)
+                        if manifest_file is not None:
+                            save_manifest(manifest, manifest_file)
+            else:
+                progress.update(1)
+
+            if on_complete is not None:
+                await loop.run_in_executor(callbacks, on_complete, key, filename)
+
+            return filename
+
+        try:
+            results = await asyncio.gather(*[fetch(*job) for job in jobs])
+        finally:
+            callbacks.shutdown(wait=False)
+        progress.close()
+
+    record_throughput('download', fetched_bytes, time.monotonic() - start)
+
+    return list(results)
+
+
+def download_files(
+        jobs: list,
+        concurrency: int = 8,
+        chunk_size: int = 1 << 20,
+        manifest_file: str = None,
+        on_complete=None,
+) -> list:
+    """
+    Blocking wrapper around 'fetch_files'.
+
+    :param jobs: List of (key, URL, filename) tuples
+    :param concurrency: Maximum number of downloads in flight
+    :param chunk_size: Size of the file write buffer in bytes
+    :param manifest_file: Path of manifest .json file. Default is no manifest
+    :param on_complete: Function called with (key, file path) as soon as each download succeeds
+    :return: List of saved file paths in the order of jobs, None for failed downloads
+    """
+    tracer = get_tracer()
+    with tracer.span("download_files", 'stage', jobs=len(jobs)):
+        results = asyncio.run(fetch_files(jobs, concurrency, chunk_size, manifest_file=manifest_file,
+                                          on_complete=on_complete))
+        tracer.count_bytes(bytes_written=sum(os.path.getsize(filename) for filename in results
+                                             if filename is not None))
+
+    return results
@@ -0,0 +1,163 @@
+import re
+import numpy as np
+import pandas as pd
+
+from common.info import timestamps_to_seconds
+from common.timestamp import timestamp_to_seconds
+
+
+# Names of the filters 'video_mask' knows, and the column each one reads
+video_filters = {
+    'published_after': 'Publish_date',
+    'published_before': 'Publish_date',
+    'min_views': 'Views',
+    'max_views': 'Views',
+    'min_length': 'Length',
+    'max_length': 'Length',
+    'author': 'Author',
+}
+
+# Compiled regex matching a count with an optional suffix, eg. '1.5M' or '250k'
+regex_count = re.compile(r"^(\d+(?:\.\d+)?)\s*([kKmMbB]?)$")
+
+# Compiled regex matching a length in hours, minutes or seconds, eg. '3h' or '90m'
+regex_length = re.compile(r"^(\d+(?:\.\d+)?)\s*([hHmMsS])$")
+
+count_suffixes = {'': 1, 'k': 1e3, 'm': 1e6, 'b': 1e9}
+length_suffixes = {'h': 3600, 'm': 60, 's': 1}
+
+
+def parse_count(value: str) -> int:
+    """
+    Parses a count such as a number of views, eg. '1000000', '1M' or '250k'.
+
+    :param value: Count string
+    :return: Integer count
+    """
+    match = regex_count.match(str(value).strip().replace(",", "").replace("_", ""))
+    if match is None:
+        raise ValueError(f"Invalid count: {value}")
+
+    return round(float(match.group(1)) * count_suffixes[match.group(2).lower()])
+
+
+def parse_length(value: str) -> int:
+    """
+    Parses a media length, eg. '3h', '90m' or a timestamp such as '2:30:00'.
+
+    :param value: Length string
+    :return: Integer seconds
+    """
+    value = str(value).strip()
+    match = regex_length.match(value)
+    if match is not None:
+        return round(float(match.group(1)) * length_suffixes[match.group(2).lower()])
+
+    if value.isdigit():
+        return int(value)
+
+    return timestamp_to_seconds(value)
+
+
+def parse_filters(text: str) -> dict:
+    """
+    Parses comma separated filters of the 'video_mask' type, eg.
+    'published_after=2021-01-01, min_views=1M, max_length=3h, author=Lex Fridman'.
+
+    :param text: Filters string, empty for no filters
+    :return: Dict of filter name -> value
+    """
+    filters = {}
+    for part in text.split(","):
+        if part.strip() == "":
+            continue
+
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in video_filters or value.strip() == "":
+            raise ValueError(f"Invalid filter: {part.strip()}. Use one of {', '.join(video_filters)}=value")
+
+        filters[name] = value.strip()
+
+    return filters
+
+
+def video_mask(
+        videos: pd.DataFrame,
+        filters: dict = None,
+) -> np.ndarray:
+    """
+    Evaluates filters on the columns of a table of videos, each as one vectorized comparison.
+    Works on the .csv file of the 'channel_videos_list' type as well as on the 'videos' of
+    'load_chapter_store', where lengths are already seconds and dates already parsed.
+
+    published_after, published_before - Dates, exclusive, eg. '2021-01-01'
+    min_views, max_views               - Counts, inclusive, eg. '1M', see 'parse_count'
+    min_length, max_length             - Lengths, inclusive, eg. '3h', see 'parse_length'
+    author                             - Author name, or list of names
+
+    :param videos: Pandas DataFrame with 'Publish_date', 'Views', 'Length' & 'Author' columns
+    :param filters: Dict of filter name -> value. Default is no filters
+    :return: Boolean array with a value per video, True if it passes all filters
+    """
+    mask = np.ones(len(videos), dtype=bool)
+    if not filters:
+        return mask
+
+    unknown = set(filters) - set(video_filters)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+    # Each column is converted once, however many filters read it
+    columns = {}
+
+    def column(name):
+        if name not in columns:
+            values = videos[name]
+            if name == 'Publish_date':
+                values = pd.to_datetime(values).values.astype('datetime64[D]')
+            elif name == 'Length' and not pd.api.types.is_numeric_dtype(values):
+                values = timestamps_to_seconds(values).values
+            elif name == 'Author':
+                values = values.astype(str).values
+            else:
+                values = np.asarray(values)
+            columns[name] = values
+        return columns[name]
+
+    for name, value in filters.items():
+        values = column(video_filters[name])
+
+        if name == 'published_after':
+            mask &= values > np.datetime64(pd.Timestamp(value).date(), 'D')
+        elif name == 'published_before':
+            mask &= values < np.datetime64(pd.Timestamp(value).date(), 'D')
+        elif name == 'min_views':
+            mask &= values >= parse_count(value)
+        elif name == 'max_views':
+            mask &= values <= parse_count(value)
+        elif name == 'min_length':
+            mask &= values >= parse_length(value)
+        elif name == 'max_length':
+            mask &= values <= parse_length(value)
+        elif name == 'author':
+            mask &= np.isin(values, [value] if isinstance(value, str) else list(value))
+
+    return mask
+
+
+def filter_videos(
+        dataframe: pd.DataFrame,
+        filters: dict = None,
+) -> pd.DataFrame:
+    """
+    Returns the rows of a DataFrame that pass the filters, see 'video_mask'.
+
+    :param dataframe: Pandas DataFrame of the 'channel_videos_list' return form
+    :param filters: Dict of filter name -> value. Default is no filters
+    :return: Filtered DataFrame, with the original index
+    """
+    if not filters:
+        return dataframe
+
+    return dataframe[video_mask(dataframe, filters)]
@@ -1,9 +1,74 @@
+import os
+import time
+import hashlib
+import threading
+import multiprocessing
+
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import PIL
 from PIL import (
     Image,
     ImageDraw,
     ImageFont,
 )
 
+from common.tracing import traced
+from common.resources import link_file
+from common.throughput import record_throughput
+from common.variables import (
+    card_font,
+    cache_dir,
+)
+
+
+@lru_cache(maxsize=None)
+def load_font(
+        font_file: str,
+        text_size: int,
+):
+    """
+    Loads a TrueType font once per process and size. Falls back to Pillow's default font
+    if font_file cannot be opened.
+
+    :param font_file: Path of font file
+    :param text_size: Text size in pt
+    :return: ImageFont
+    """
+    try:
+        return ImageFont.truetype(font_file, text_size)
+    except OSError:
+        print(f"Could not open font {font_file}, using the default font instead.")
+        try:
+            return ImageFont.load_default(text_size)
+        except TypeError:
+            return ImageFont.load_default()
+
+
+@lru_cache(maxsize=None)
+def _font_id(font_file: str) -> str:
+    # What 'load_font' renders with: the font file as it is now, or Pillow's default font
+    try:
+        ImageFont.truetype(font_file, 10)
+    except OSError:
+        return f"default font of Pillow {PIL.__version__}"
+
+    if not os.path.isfile(font_file):
+        # Found by name in the system font dirs
+        return font_file
+
+    stat = os.stat(font_file)
+    return f"{os.path.abspath(font_file)} {stat.st_size} {stat.st_mtime_ns}"
+
+
+def _text_size(draw, message: str, font) -> tuple:
+    # 'textsize' was removed in Pillow 10
+    if hasattr(draw, "multiline_textbbox"):
+        left, top, right, bottom = draw.multiline_textbbox((0, 0), message, font=font)
+        return right - left, bottom - top
+
+    return draw.textsize(message, font=font)
+
 
 def text_image(
         message: str,
@@ -12,7 +77,8 @@ def text_image(
         height: int = 900,
         text_size: int = 30,
         image_color: str = 'black',
-        text_color: str = 'white'
+        text_color: str = 'white',
+        font_file: str = card_font,
 ) -> None:
     """
     Saves an image with text on it.
@@ -24,15 +90,16 @@ def text_image(
     :param text_size: Text size in pt
     :param image_color: Image color
     :param text_color: Text color
+    :param font_file: Path of font file. Default is 'card_font'
     :return: None
     """
 
-    font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", text_size)
+    font = load_font(font_file, text_size)
 
     img = Image.new('RGB', (width, height), color=image_color)
 
     draw = ImageDraw.Draw(img)
-    w, h = draw.textsize(message, font=font)
+    w, h = _text_size(draw, message, font)
 
     center = (width-w)/2, (height-h)/2
     draw.text(center, message, fill=text_color, font=font)
@@ -45,7 +112,8 @@ def text_to_image(
         existing_image: str,
         filename: str,
         text_size: int = 30,
-        text_color: str = 'white'
+        text_color: str = 'white',
+        font_file: str = card_font,
 ) -> None:
     """
     Saves an image with text on it.
@@ -55,19 +123,156 @@ def text_to_image(
     :param filename: Image filename to save new image as
     :param text_size: Text size in pt
     :param text_color: Text color
+    :param font_file: Path of font file. Default is 'card_font'
     :return: None
     """
 
-    font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", text_size)
+    font = load_font(font_file, text_size)
 
     img = Image.open(existing_image, 'r')
     draw = ImageDraw.Draw(img)
 
     width = img.size[0]
     height = img.size[1]
-    w, h = draw.textsize(message, font=font)
+    w, h = _text_size(draw, message, font)
 
     center = (width - w) / 2, (height - h) / 2
     draw.text(center, message, fill=text_color, font=font)
 
     img.save(filename)
+
+
+def card_key(
+        message: str,
+        width: int = 1600,
+        height: int = 900,
+        text_size: int = 30,
+        image_color: str = 'black',
+        text_color: str = 'white',
+        font_file: str = card_font,
+) -> str:
+    """
+    Returns the content address of a card, a hash of everything that changes how it looks.
+    The font is the one actually rendered with, so cards drawn with the fallback font of
+    'load_font' are not cached as drawn with font_file. See 'text_image' for parameters.
+
+    :return: Hex digest string
+    """
+    fields = (message, width, height, text_size, image_color, text_color, _font_id(font_file))
+
+    return hashlib.sha1(repr(fields).encode('utf-8')).hexdigest()
+
+
+def _render_card(arguments: tuple) -> float:
+    # Runs in a worker process, 'load_font' keeps its fonts between cards.
+    # Returns the CPU time it took, which the parent cannot see in its children's rusage
+    cached_file, message, options = arguments
+    cpu = time.process_time()
+
+    tmp_file = f"{cached_file}.{os.getpid()}.tmp{os.path.splitext(cached_file)[1]}"
+    text_image(message, tmp_file, **options)
+    os.replace(tmp_file, cached_file)
+
+    return time.process_time() - cpu
+
+
+_card_pool = None
+_card_pool_lock = threading.Lock()
+_card_cpu_seconds = 0.0
+
+
+def card_cpu_seconds() -> float:
+    """
+    Returns the CPU time the workers of 'get_card_pool' spent rendering cards for this process.
+    They are children of the fork server, so it is not in this process' RUSAGE_CHILDREN.
+
+    :return: Number of CPU seconds
+    """
+    return _card_cpu_seconds
+
+
+def get_card_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool that renders cards, creating it on first use.
+    Workers are started by a fork server where possible, else spawned, never forked from this
+    process: it runs download, scheduler & stage threads, whose locks a forked child could
+    inherit held. Scripts using the pool need a '__main__' guard, as workers import them.
+
+    :return: ProcessPoolExecutor
+    """
+    global _card_pool
+
+    with _card_pool_lock:
+        if _card_pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                # The server imports Pillow once, instead of every worker on start
+                context.set_forkserver_preload(["common.image"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _card_pool = ProcessPoolExecutor(os.cpu_count() or 1, mp_context=context)
+
+        return _card_pool
+
+
+@traced
+def render_cards(
+        cards: list,
+        width: int = 1600,
+        height: int = 900,
+        text_size: int = 30,
+        image_color: str = 'black',
+        text_color: str = 'white',
+        font_file: str = card_font,
+        card_dir: str = None,
+) -> list:
+    """
+    Renders many cards of the 'text_image' type. Every card is saved once in card_dir under
+    the hash of its message and looks, see 'card_key', and hard linked or copied to its filename.
+    Cards not rendered by a previous run are rendered in parallel by 'get_card_pool'.
+
+    :param cards: List of (message, filename) tuples
+    :param width: Image width
+    :param height: Image height
+    :param text_size: Text size in pt
+    :param image_color: Image color
+    :param text_color: Text color
+    :param font_file: Path of font file. Default is 'card_font'
+    :param card_dir: Path of dir of rendered cards. Default is 'cards' inside 'cache_dir'
+    :return: List of saved filenames
+    """
+    global _card_cpu_seconds
+
+    if card_dir is None:
+        card_dir = f"{cache_dir}/cards"
+    os.makedirs(card_dir, exist_ok=True)
+
+    options = {
+        'width': width,
+        'height': height,
+        'text_size': text_size,
+        'image_color': image_color,
+        'text_color': text_color,
+        'font_file': font_file,
+    }
+
+    cached_files = [f"{card_dir}/{card_key(message, **options)}{os.path.splitext(filename)[1]}"
+                    for message, filename in cards]
+
+    # Each missing card is rendered once, even if several filenames share it
+    missing = {}
+    for cached_file, (message, filename) in zip(cached_files, cards):
+        if cached_file not in missing and not os.path.exists(cached_file):
+            missing[cached_file] = (cached_file, message, options)
+
+    if len(missing) > 0:
+        start = time.monotonic()
+        cpu = sum(get_card_pool().map(_render_card, missing.values()))
+        with _card_pool_lock:
+            _card_cpu_seconds += cpu
+        record_throughput('card', len(missing), time.monotonic() - start)
+
+    for cached_file, (message, filename) in zip(cached_files, cards):
+        link_file(cached_file, filename)
+
+    return [filename for message, filename in cards]
@@ -0,0 +1,251 @@
+import os
+import io
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+from common.tracing import traced
+from common.store import csv_signature
+from common.info import extract_chapters
+from common.query import (
+    compile_query,
+    keywords_plan,
+    evaluate_plan,
+    video_bitset,
+    bitset_ids,
+)
+from common.variables import regex_non_word
+
+
+def chapter_index_path(csv_file: str) -> str:
+    """
+    Returns the default location of the chapter index for a .csv file.
+
+    :param csv_file: Path of the .csv file of the 'channel_videos_list' type
+    :return: Path of the index file, eg. 'videos.index.pkl'
+    """
+    return os.path.splitext(csv_file)[0] + ".index.pkl"
+
+
+def new_chapter_index() -> dict:
+    """
+    Returns an empty chapter index.
+
+    videos   - list of (URL, media name, guest) tuples, one per indexed row
+    chapters - list of (video number, chapter name, start, end) tuples
+    terms    - dict of chapter word -> posting list of chapter numbers
+
+    :return: Dict with empty 'videos', 'chapters' & 'terms'
+    """
+    return {
+        'videos': [],
+        'chapters': [],
+        'terms': {},
+        'csv_size': 0,
+        'csv_mtime_ns': None,
+        'csv_digest': hashlib.sha1().hexdigest(),
+    }
+
+
+def add_to_chapter_index(
+        index: dict,
+        dataframe: pd.DataFrame,
+) -> dict:
+    """
+    Extracts the chapters of every row of a DataFrame and adds them to an index.
+
+    :param index: Dict of 'new_chapter_index' type to update in place
+    :param dataframe: Pandas DataFrame of the 'channel_videos_list' return form
+    :return: Updated index
+    """
+    videos = index['videos']
+    chapters = index['chapters']
+    terms = index['terms']
+
+    first_video = len(videos)
+    for name, url, description in zip(dataframe['Name'], dataframe['URL_Link'], dataframe['Description']):
+        media_name = regex_non_word.sub("_", name)
+        guest = description.split(".")[0]
+        videos.append((url, media_name, guest))
+
+    # Video number of each chapter is its row position after the already indexed videos
+    table = extract_chapters(dataframe.reset_index(drop=True))
+    video_ids = (table.index + first_video).tolist()
+    for video_id, chapter, start, end in zip(video_ids, table['Chapter'], table['Start_time'], table['End_time']):
+        chapter_id = len(chapters)
+        chapters.append((video_id, chapter, start, end))
+
+        # Each chapter is added once per distinct word
+        for word in set(regex_non_word.split(chapter)):
+            terms.setdefault(word, []).append(chapter_id)
+
+    return index
+
+
+@traced
+def build_chapter_index(dataframe: pd.DataFrame) -> dict:
+    """
+    Builds an in-memory chapter index from a DataFrame.
+
+    :param dataframe: Pandas DataFrame of the 'channel_videos_list' return form
+    :return: Dict of 'new_chapter_index' type
+    """
+    return add_to_chapter_index(new_chapter_index(), dataframe)
+
+
+def save_chapter_index(
+        index: dict,
+        index_file: str,
+) -> None:
+    """
+    Saves a chapter index to disk.
+
+    :param index: Dict of 'new_chapter_index' type
+    :param index_file: Path of file to save to
+    :return: None
+    """
+    tmp_file = index_file + ".tmp"
+    with open(tmp_file, 'wb') as file:
+        pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(tmp_file, index_file)
+
+
+@traced
+def load_chapter_index(
+        csv_file: str,
+        index_file: str = None,
+) -> dict:
+    """
+    Loads the chapter index of a .csv file, building it on first use. If rows were appended
+    to the .csv file since the index was saved, only the new rows are parsed and indexed.
+    If the already indexed part of the file changed, the index is rebuilt from scratch.
+    The .csv file is only read if its size or modification time changed, see 'csv_signature'.
+
+    :param csv_file: Path of the .csv file of the 'channel_videos_list' type
+    :param index_file: Path of the index file. Default is 'chapter_index_path(csv_file)'
+    :return: Dict of 'new_chapter_index' type
+    """
+    if index_file is None:
+        index_file = chapter_index_path(csv_file)
+
+    try:
+        with open(index_file, 'rb') as file:
+            index = pickle.load(file)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        index = new_chapter_index()
+
+    signature = csv_signature(csv_file)
+    if index['csv_size'] == signature['csv_size'] and index.get('csv_mtime_ns') == signature['csv_mtime_ns']:
+        return index
+
+    with open(csv_file, 'rb') as file:
+        data = file.read()
+
+    indexed_size = index['csv_size']
+    if indexed_size > len(data) or hashlib.sha1(data[:indexed_size]).hexdigest() != index['csv_digest']:
+        index = new_chapter_index()
+        indexed_size = 0
+
+    if indexed_size == len(data):
+        # Only touched, saved so the next load skips reading it
+        index['csv_mtime_ns'] = signature['csv_mtime_ns']
+        save_chapter_index(index, index_file)
+        return index
+
+    if indexed_size == 0:
+        dataframe = pd.read_csv(io.BytesIO(data))
+    else:
+        # Parse only the appended rows, re-using the header line
+        header = data[:data.index(b"\n") + 1]
+        dataframe = pd.read_csv(io.BytesIO(header + data[indexed_size:]))
+
+    add_to_chapter_index(index, dataframe)
+    index['csv_size'] = len(data)
+    index['csv_digest'] = hashlib.sha1(data).hexdigest()
+    index['csv_mtime_ns'] = signature['csv_mtime_ns']
+
+    save_chapter_index(index, index_file)
+
+    return index
+
+
+def query_chapter_index(
+        index: dict,
+        keywords: list = None,
+        videos: np.ndarray = None,
+) -> dict:
+    """
+    Returns the indexed chapters that match any of the keywords and none of the
+    '-' negated keywords.
+
+    :param index: Dict of 'new_chapter_index' type
+    :param keywords: List of string keywords to check against video chapters
+    :param videos: Boolean array with a value per indexed video, eg. of 'video_mask'.
+    Only chapters of videos set are returned. Default is all videos
+    :returns: Dict of URLs with matching chapters of 'get_matching_chapters' type
+    """
+    if keywords is None:
+        keywords = [""]
+
+    bitset = evaluate_plan(index, keywords_plan(keywords))
+    if videos is not None:
+        bitset &= video_bitset(index, videos)
+
+    return chapters_to_dict(index, bitset_ids(bitset, len(index['chapters'])).tolist())
+
+
+def query_chapters(
+        index: dict,
+        query: str,
+        videos: np.ndarray = None,
+) -> dict:
+    """
+    Returns the indexed chapters that match a query of the 'compile_query' type,
+    eg. 'ai AND (consciousness OR "free will") NOT sponsor*'.
+
+    :param index: Dict of 'new_chapter_index' type
+    :param query: Query string
+    :param videos: Boolean array with a value per indexed video, eg. of 'video_mask'.
+    Only chapters of videos set are returned. Default is all videos
+    :returns: Dict of URLs with matching chapters of 'get_matching_chapters' type
+    """
+    bitset = evaluate_plan(index, compile_query(query))
+    if videos is not None:
+        bitset &= video_bitset(index, videos)
+
+    return chapters_to_dict(index, bitset_ids(bitset, len(index['chapters'])).tolist())
+
+
+def chapters_to_dict(
+        index: dict,
+        chapter_ids,
+) -> dict:
+    """
+    Groups indexed chapters by video into a dict of the 'get_matching_chapters' type.
+
+    :param index: Dict of 'new_chapter_index' type
+    :param chapter_ids: Iterable of chapter numbers
+    :returns: Dict of URLs with chapters
+    """
+    videos = index['videos']
+    chapters = index['chapters']
+
+    chapters_to_extract = {}
+    last_video = None
+    for chapter_id in sorted(chapter_ids):
+        video_id, chapter, start, end = chapters[chapter_id]
+
+        if video_id != last_video:
+            url, media_name, guest = videos[video_id]
+            chapters_to_extract[url] = {
+                'media_name': media_name,
+                'guest': guest,
+                'chapters': {},
+            }
+            last_video = video_id
+
+        chapters_to_extract[url]['chapters'][chapter] = (start, end)
+
+    return chapters_to_extract
@@ -1,22 +1,61 @@
 import os
 import re
+import shutil
+import numpy as np
+import pandas as pd
 
-from tqdm import tqdm
-from datetime import datetime
 from multiprocessing.dummy import Pool
-from subprocess import check_output
+from concurrent.futures import ThreadPoolExecutor
 
-from common.image import text_image
+from common.tracing import (
+    traced,
+    bind,
+)
+from common.image import render_cards
+from common.scheduler import (
+    get_scheduler,
+    submit_ffmpeg,
+)
+from common.throughput import record_throughput
+from common.manifest import (
+    compilation_manifest_name,
+    episode_paths,
+    episode_manifest,
+    compilation_manifest,
+    write_manifest,
+    write_episode_manifest,
+    read_episode_manifest,
+    write_concat_list,
+    write_outline,
+)
+from common.converter import (
+    smart_cut,
+    smart_cut_encoders,
+)
+from common.cache import (
+    cut_options,
+    source_digest,
+    clip_key,
+    cached_clip,
+    add_clip,
+    keyframe_index,
+)
+from common.timestamp import (
+    Chapter,
+    timestamp_to_seconds,
+    seconds_to_timestamp,
+)
 
 from common.resources import (
     list_files,
-    list_dirs,
     most_common,
     reduce_text_len,
+    link_file,
 )
 from common.variables import (
     regex_time,
     regex_non_word,
+    regex_chapter_line,
 )
 
 
@@ -60,71 +99,408 @@ def get_chapters(
     return media_chapters
 
 
+def timestamps_to_seconds(timestamps: pd.Series) -> pd.Series:
+    """
+    Converts a Series of timestamps in the %H:%M:%S or %M:%S format into integer seconds.
+    Each distinct timestamp is parsed only once.
+
+    :param timestamps: Pandas Series of timestamp strings
+    :return: Pandas Series of int32 seconds
+    """
+    codes, uniques = pd.factorize(timestamps)
+
+    seconds = np.zeros(len(uniques) + 1, dtype='int32')
+    for i, timestamp in enumerate(uniques):
+        try:
+            seconds[i] = timestamp_to_seconds(timestamp)
+        except ValueError:
+            pass
+
+    # Missing timestamps have code -1 and map to the trailing 0
+    return pd.Series(seconds[codes], index=timestamps.index)
+
+
+def extract_chapters(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    Extracts the chapters of all descriptions in a DataFrame at once. Equivalent to calling
+    'get_chapters' on every row. The lines that may hold a timestamp are found with numpy, then
+    their first timestamps and chapter names are read in a single pass of 'regex_chapter_line'.
+
+    :param dataframe: Pandas DataFrame of the 'channel_videos_list' return form
+    :returns: Pandas DataFrame indexed by the row of the owning video, with columns:
+    ID, Chapter, Start_time, End_time, Start, End. Start & End are in integer seconds
+    """
+    descriptions = dataframe['Description'].tolist()
+    text = "\n".join(descriptions)
+
+    # Offset of each description inside the joined text
+    lengths = np.fromiter((len(description) + 1 for description in descriptions),
+                          dtype=np.int64, count=len(descriptions))
+    offsets = np.cumsum(lengths) - lengths
+
+    # A timestamp needs a colon between two digits. Find the lines with such a colon with
+    # numpy, so the regex only reads those. Non-ASCII characters may be digits
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    colons = np.flatnonzero(codes[1:-1] == 58) + 1
+    before = codes[colons - 1]
+    after = codes[colons + 1]
+    colons = colons[((before - 48 <= 9) | (before > 127)) & ((after - 48 <= 9) | (after > 127))]
+    newlines = np.flatnonzero(codes == 10)
+    lines = np.searchsorted(newlines, colons)
+    lines = lines[np.append(True, lines[1:] != lines[:-1])] if len(lines) > 0 else lines
+    line_starts = np.append(0, newlines + 1)[lines]
+    line_ends = np.append(newlines, len(text))[lines]
+
+    # One regex pass over the candidate lines, joined as a text of their own, matching once per line.
+    # Chapter names are lower case, so the text is lowered at once instead of name by name
+    candidates = "\n".join([text[start:end] for start, end in zip(line_starts.tolist(), line_ends.tolist())]).lower()
+    matches = regex_chapter_line.findall(candidates) if len(lines) > 0 else []
+    start_list = np.array([start or later_start for start, later_start, name in matches], dtype=object)
+    name_list = np.array([name for start, later_start, name in matches], dtype=object)
+
+    # Lines without a timestamp, eg. a colon between two non-ASCII letters, are dropped
+    timestamped = start_list != ""
+    rows = np.searchsorted(offsets, line_starts[timestamped], side='right') - 1
+    start_list = start_list[timestamped]
+    name_list = name_list[timestamped]
+
+    # Chapter names are paired with timestamps by their order within the row, like 'get_chapters'
+    # does, so a timestamp line without a name shifts the timestamps of the names after it
+    named = np.flatnonzero(name_list != "")
+    named_rows = rows[named]
+    first_start = np.searchsorted(rows, named_rows)
+    rank = np.arange(len(named)) - np.searchsorted(named_rows, named_rows)
+    start_index = first_start + rank
+    end_index = start_index + 1
+
+    # Chapter n lasts from timestamp n until timestamp n+1 or the end of the media
+    has_end = end_index < np.searchsorted(rows, named_rows, side='right')
+    end_list = dataframe['Length'].values[named_rows].astype(object)
+    end_list[has_end] = start_list[end_index[has_end]]
+
+    seconds = timestamps_to_seconds(pd.Series(start_list, dtype=object)).values
+    end_seconds = timestamps_to_seconds(pd.Series(dataframe['Length'].values, dtype=object)).values[named_rows]
+    end_seconds[has_end] = seconds[end_index[has_end]]
+
+    chapters = pd.DataFrame({
+        'row': named_rows,
+        'ID': dataframe['ID'].values[named_rows],
+        'Chapter': name_list[named],
+        'Start_time': start_list[start_index],
+        'End_time': end_list,
+        'Start': seconds[start_index],
+        'End': end_seconds,
+    })
+
+    # Repeated chapter names keep their first position and their last timestamps. Groups are
+    # numbered in order of first appearance, each takes the row of its last appearance
+    groups = chapters.groupby(['row', 'Chapter'], sort=False).ngroup().values
+    if len(chapters) > 0 and groups.max() + 1 < len(chapters):
+        last = np.zeros(groups.max() + 1, dtype=np.int64)
+        np.maximum.at(last, groups, np.arange(len(chapters)))
+        chapters = chapters.iloc[last]
+
+    chapters.index = dataframe.index[chapters['row']]
+
+    return chapters[['ID', 'Chapter', 'Start_time', 'End_time', 'Start', 'End']]
+
+
+def chapter_split_command(
+        filename: str,
+        chapters: dict,
+        out_folder: str,
+        extension: str,
+) -> list:
+    """
+    Builds a single ffmpeg command that cuts all chapters of a media file. Every chapter is
+    opened as its own input with '-ss' & '-to' before '-i', so ffmpeg seeks straight to it
+    instead of demuxing from the start, and is mapped to its own stream copied output.
+
+    :param filename: Name of media file to cut
+    :param chapters: Dict of chapter name -> (start, end) timestamps
+    :param out_folder: Name of folder to save chapter files to
+    :param extension: Name of media extension, without the dot
+    :return: ffmpeg command as a list of arguments
+    """
+    inputs = []
+    outputs = []
+    for i, (chapter, (start, end)) in enumerate(chapters.items()):
+        new_file = regex_non_word.sub("_", chapter) + "." + extension
+
+        inputs += ["-ss", start, "-to", end, "-i", filename]
+        outputs += ["-map", f"{i}:v?", "-map", f"{i}:a?", "-c:v", "copy", "-c:a", "copy", f"{out_folder}/{new_file}"]
+
+    return ["ffmpeg"] + inputs + outputs
+
+
+@traced
+def split_episode(
+        folder_path: str,
+        media: dict,
+        extension: str,
+        single_pass: bool = False,
+        cache: bool = True,
+        smart: bool = False,
+) -> str:
+    """
+    Clips out the chapters of a single media file '<folder_path>/<media_name>.<extension>' into
+    the dir '<folder_path>/<media_name>', with its manifest, see 'episode_manifest'. Any previous
+    contents of the dir are replaced. Chapters already cut by an earlier run are taken from the
+    clip cache, see 'common.cache', and newly cut ones added to it. If any cut fails, OSError
+    is raised once all cuts are done and no manifest is written.
+    Only uses absolute paths, so it is safe to call from several threads at once.
+
+    :param folder_path: Name of folder containing the media file
+    :param media: Dict of a single media of the 'get_matching_chapters' type
+    :param extension: Name of media extension, without the dot
+    :param single_pass: Cut all chapters with one ffmpeg process, see 'chapter_split_command'
+    :param cache: Use the clip cache
+    :param smart: Cut video frame accurately, see 'smart_cut'. Media without video or with a codec
+    not in 'smart_cut_encoders' is cut with stream copy
+    :return: Message with Episode name & lists of chapter names and timestamps
+    """
+    media_name = media['media_name']
+
+    filename = media_name + '.' + extension
+    chapters = media['chapters']
+    out_folder = f"{folder_path}/{media_name}"
+
+    # Create new folder with video name, dropping chapters of a previous query
+    shutil.rmtree(out_folder, ignore_errors=True)
+    os.makedirs(out_folder)
+
+    options = cut_options(single_pass, smart)
+    digest = source_digest(f"{folder_path}/{filename}") if cache else None
+
+    missing = {}
+    keys = {}
+    for chapter in chapters.keys():
+        start = chapters[chapter][0]
+        end = chapters[chapter][1]
+        new_file = regex_non_word.sub("_", chapter) + "." + extension
+
+        if cache:
+            keys[chapter] = clip_key(digest, start, end, options)
+            cached_file = cached_clip(keys[chapter], extension)
+            if cached_file is not None:
+                try:
+                    link_file(cached_file, f"{out_folder}/{new_file}")
+                    continue
+                except FileNotFoundError:
+                    # Evicted since the lookup, cut it again
+                    pass
+
+        missing[chapter] = (start, end)
+
+    if smart and len(missing) > 0:
+        index = keyframe_index(f"{folder_path}/{filename}")
+        if index['video'] is None or index['video']['codec_name'] not in smart_cut_encoders:
+            # Audio frames are all keyframes, stream copy is already accurate
+            smart = False
+
+    # List of (chapters cut, job)
+    jobs = []
+    if smart and len(missing) > 0:
+        # Threads only wait for the parts of their cut, which are run by the ffmpeg scheduler.
+        # As many cuts at once as cpu jobs the scheduler runs at once, for their re-encoded ends
+        scheduler = get_scheduler()
+        executor = ThreadPoolExecutor(min(len(missing), max(1, scheduler.cpu_threads // scheduler.threads_per_job)))
+        for chapter, (start, end) in missing.items():
+            new_file = regex_non_word.sub("_", chapter) + "." + extension
+            jobs.append(([chapter], executor.submit(bind(smart_cut), folder_path, filename,
+                                                    timestamp_to_seconds(start), timestamp_to_seconds(end),
+                                                    f"{media_name}/{new_file}", index)))
+        executor.shutdown(wait=False)
+    elif single_pass and len(missing) > 0:
+        jobs.append((list(missing), submit_ffmpeg(chapter_split_command(filename, missing, media_name, extension),
+                                                  'io', cwd=folder_path)))
+
+    message = f"{media_name}\n"
+    manifest_chapters = []
+    for chapter in chapters.keys():
+        start = chapters[chapter][0]
+        end = chapters[chapter][1]
+        new_file = regex_non_word.sub("_", chapter) + "." + extension
+
+        if not single_pass and not smart and chapter in missing:
+            jobs.append(([chapter], submit_ffmpeg(["ffmpeg", "-i", filename, "-ss", start, "-to", end,
+                                                   "-c:v", "copy", "-c:a", "copy", f"{media_name}/{new_file}"],
+                                                  'io', cwd=folder_path)))
+
+        message += f"{chapter}, {start}, {end}\n"
+        manifest_chapters.append({
+            'name': chapter,
+            'file': new_file,
+            'image': f"{os.path.splitext(new_file)[0]}.jpeg",
+            'start': timestamp_to_seconds(start),
+            'end': timestamp_to_seconds(end),
+        })
+
+    failed = []
+    for cut_chapters, job in jobs:
+        process = job.result()
+        if process.returncode != 0:
+            failed += cut_chapters
+            continue
+
+        clip_files = [f"{out_folder}/{regex_non_word.sub('_', chapter)}.{extension}" for chapter in cut_chapters]
+        media_seconds = sum(timestamp_to_seconds(missing[chapter][1]) - timestamp_to_seconds(missing[chapter][0])
+                            for chapter in cut_chapters)
+        record_throughput('smart_cut' if smart else 'cut', media_seconds, process.elapsed)
+        record_throughput('media_bytes', sum(os.path.getsize(file) for file in clip_files), media_seconds)
+
+        # Only clips of successful cuts are cached
+        if cache:
+            for chapter, clip_file in zip(cut_chapters, clip_files):
+                add_clip(clip_file, keys[chapter], extension)
+
+    # A manifest listing clips that were not cut would send later stages looking for them
+    if len(failed) > 0:
+        raise OSError(f"Cutting {', '.join(failed)} out of {filename} failed.")
+
+    write_episode_manifest(out_folder, episode_manifest(media_name, media['guest'], extension, manifest_chapters))
+
+    return message
+
+
+@traced
 def split_media_chapters(
         folder_path: str,
         chapters_dict: dict,
+        single_pass: bool = False,
+        cache: bool = True,
+        smart: bool = False,
 ) -> list:
     """
     Given a dir with media files, clips out chapters from each media based on dict of chapters
     with name, start & end timestamps. For each file creates a new dir and puts the chapter clips inside.
-    Also creates an info.txt file with Episode name & lists of chapter names and timestamps.
-    Also creates a guest.txt file with a description of the guest.
+    Also saves a manifest in each dir with the Episode name, guest and its chapters, see 'episode_manifest'.
 
     :param folder_path: Name of folder containing the media files
     :param chapters_dict: Dict of chapters of the 'get_matching_chapters' type
+    :param single_pass: Cut all chapters of a media with one ffmpeg process, see 'chapter_split_command'
+    :param cache: Use the clip cache, see 'split_episode'
+    :param smart: Cut video frame accurately, see 'split_episode'
     :return: List of messages
     """
+    folder_path = os.path.abspath(folder_path)
 
-    def split_media(media, extension):
-        media_name = media['media_name']
+    # Get all video file names
+    files = list_files(folder_path)
 
-        filename = media_name + '.' + extension
-        chapters = media['chapters']
+    assert len(files) > 0, f"{folder_path} contains no files."
 
-        # Create new folder with video name
-        os.mkdir(media_name)
+    # Get most common file extension and use it as a base
+    extensions = [file.split(".")[-1] for file in files]
+    ext = most_common(extensions)
 
-        message = f"{media_name}\n"
-        for chapter in chapters.keys():
-            start = chapters[chapter][0]
-            end = chapters[chapter][1]
-            new_file = regex_non_word.sub("_", chapter) + "." + extension
+    arguments = [(folder_path, media, ext, single_pass, cache, smart) for media in chapters_dict.values()]
 
-            os.system(f"ffmpeg -i {filename} -ss {start} -to {end} -c:v copy -c:a copy "
-                      f"{media_name}/{new_file}")
+    # Threads only wait for their cuts, which are run by the ffmpeg scheduler
+    with Pool(max(1, min(len(arguments), 32))) as pool:
+        messages = pool.starmap(bind(split_episode), arguments)
 
-            message += f"{chapter}, {start}, {end}\n"
+    return messages
 
-        os.system(f"""echo "{message}" > "{media_name}"/info.txt""")
-        os.system(f"""echo "{media['guest']}" > "{media_name}"/guest.txt""")
 
-        return message
+def read_episode_info(episode_path: str) -> tuple:
+    """
+    Reads the manifest of an episode dir created by 'split_episode'.
 
-    # cd into folder
-    os.chdir(folder_path)
+    :param episode_path: Path of episode dir
+    :return: Tuple of Episode name and list of Chapters
+    """
+    manifest = read_episode_manifest(episode_path)
+    chapters = [Chapter(chapter['name'], chapter['start'], chapter['end']) for chapter in manifest['chapters']]
 
-    # Get all video file names
-    files = list_files(folder_path)
+    return manifest['media_name'], chapters
 
-    assert len(files) > 0, f"{folder_path} contains no files."
 
-    # Get most common file extension and use it as a base
-    extensions = [file.split(".")[-1] for file in files]
-    ext = most_common(extensions)
+def card_message(
+        guest: str,
+        chapter_name: str,
+) -> str:
+    """
+    Returns the text shown on a chapter card.
 
-    arguments = [(media, ext) for media in chapters_dict.values()]
+    :param guest: Description of the guest
+    :param chapter_name: Name of the chapter
+    :return: Card message
+    """
+    return f"Guest:\n\n{reduce_text_len(guest, 50)}\n\n\nChapter:\n\n{reduce_text_len(chapter_name, 50)}"
 
-    with Pool(os.cpu_count()) as pool:
-        results = pool.starmap(split_media, arguments)
 
-        messages = [res for res in results]
+def episode_cards(episode_path: str) -> list:
+    """
+    Lists the card of each chapter of an episode dir, showing the guest and chapter name.
 
-    # cd back into main directory
-    os.chdir("..")
+    :param episode_path: Path of episode dir created by 'split_episode'
+    :return: List of (card message, image path, reduced chapter name, duration in seconds) tuples
+    """
+    manifest = read_episode_manifest(episode_path)
 
-    return messages
+    cards = []
+    for chapter in manifest['chapters']:
+        message = card_message(manifest['guest'], chapter['name'])
+        image_name = f"{episode_path}/{chapter['image']}"
+
+        cards.append((message, image_name, reduce_text_len(chapter['name'], 50), chapter['duration']))
+
+    return cards
+
+
+@traced
+def episode_images(
+        episode_path: str,
+        text_size: int = 35,
+) -> list:
+    """
+    Creates an image for each chapter of an episode dir, see 'episode_cards' & 'render_cards'.
+
+    :param episode_path: Path of episode dir created by 'split_episode'
+    :param text_size: Text size in pt
+    :return: List of (image path, reduced chapter name, duration in seconds) tuples
+    """
+    cards = episode_cards(episode_path)
+    render_cards([(message, image_name) for message, image_name, _, _ in cards], text_size=text_size)
+
+    return [(image_name, chapter_name, duration) for _, image_name, chapter_name, duration in cards]
+
+
+def episode_title(media_name: str) -> str:
+    """
+    Shortens an episode's media name to the first two words of its title, for outlines.
+
+    :param media_name: Media name, eg. 'Elon_Musk__Neuralink__AI__Lex_Fridman_Podcast__49'
+    :return: Short title, eg. 'Elon Musk'
+    """
+    episode_name = media_name.split("Lex")[0]
+    episode_name = re.sub("_", " ", episode_name)
+    try:
+        first, second = episode_name.split(" ")[:2]
+        episode_name = first + " " + second
+    except ValueError:
+        pass
 
+    return episode_name
 
+
+def compilation_info(paths: list) -> dict:
+    """
+    Returns the manifest of a compilation of episode dirs, see 'compilation_manifest'.
+
+    :param paths: List of paths of episode dirs created by 'split_episode', in compilation order
+    :return: Dict of 'compilation_manifest' type
+    """
+    episodes = []
+    for episode_path in paths:
+        manifest = read_episode_manifest(episode_path)
+        episodes.append({'title': episode_title(manifest['media_name']), 'path': episode_path, 'manifest': manifest})
+
+    return compilation_manifest(episodes)
+
+
+@traced
 def list_image_info(
         folder_path: str,
         out_filename: str = "media.txt",
@@ -133,77 +509,35 @@ def list_image_info(
     For each episode's chapter exports an image with description and whole text file containing
     media to be concatenated.
     Given a dir with dirs containing chapter files, creates an image for each chapter inside each dir.
-    In main dir creates an 'images' dir with a media.txt file listing chapter images and their durations.
+    In main dir saves the compilation manifest, see 'compilation_info', and creates an 'images' dir
+    with an 'out_filename' file listing chapter images and their durations and an outline.txt file.
 
     :param folder_path: Name of folder containing the media files
     :param out_filename: Name of file to save results to
     :return: List of image file names
     """
+    folder_path = os.path.abspath(folder_path)
 
-    os.chdir(folder_path)
+    # Episode dirs inside current dir
+    paths = episode_paths(folder_path)
 
-    # List of directories inside current dir
-    dirs = list_dirs(folder_path)
+    assert len(paths) > 0, f"{folder_path} contains no episode directories."
 
-    assert len(dirs) > 0, f"{folder_path} contains no directories."
+    images_path = f"{folder_path}/images"
+    os.makedirs(images_path, exist_ok=True)
 
-    os.mkdir("images")
+    # Render the cards of all episodes at once
+    render_cards([(message, image_name) for path in paths for message, image_name, _, _ in episode_cards(path)],
+                 text_size=35)
 
-    files_list = []
-    start_timestamp = datetime.strptime("00:00:00", "%H:%M:%S")
-    os.system(f"echo OUTLINE >> images/outline.txt")
-    for directory in tqdm(dirs):
-
-        guest = check_output(['cat', f"{directory}/guest.txt"]).decode('utf-8')
-        guest = reduce_text_len(guest, 50)
-        with open(f"{directory}/info.txt", 'r') as file:
-            text = file.read()
-            lines = text.split("\n")
-
-            episode_name = lines[0].split("Lex")[0]
-            episode_name = re.sub("_", " ", episode_name)
-            try:
-                first, second = episode_name.split(" ")[:2]
-                episode_name = first + " " + second
-            except ValueError:
-                pass
-
-            for chapter in lines[1:]:
-                if chapter != "":
-                    start, end = regex_time.findall(chapter)
-                    chapter_name = regex_time.split(chapter)[0][:-2]
-                    chapter_name = reduce_text_len(chapter_name, 50)
-
-                    message = f"Guest:\n\n{guest}\n\n\nChapter:\n\n{chapter_name}"
-                    title = regex_non_word.sub("_", chapter_name)
-                    image_name = f"{directory}/{title}.jpeg"
-                    # Create image for the chapter
-                    text_image(message, image_name, text_size=35)
-
-                    try:
-                        start = datetime.strptime(start, "%H:%M:%S")
-                    except ValueError:
-                        start = datetime.strptime(start, "%M:%S")
-                    try:
-                        end = datetime.strptime(end, "%H:%M:%S")
-                    except ValueError:
-                        end = datetime.strptime(end, "%M:%S")
-
-                    duration = end - start
-
-                    # Write filename of image and duration to list
-                    os.system(f"""echo "file '{folder_path}/{image_name}'" >> images/{out_filename}""")
-                    os.system(f"echo duration {duration} >> images/{out_filename}")
-
-                    # Write Outline to file
-                    os.system(f"echo {start_timestamp.time()} - {chapter_name}, {episode_name} >> images/outline.txt")
-                    # Update start of timestamp
-                    start_timestamp += duration
-
-                    files_list.append(f"{folder_path}/{image_name}")
-
-    # Add last filename again due to ffmpeg quirk
-    os.system(f"""echo "file '{folder_path}/{image_name}'" >> images/{out_filename}""")
+    manifest = compilation_info(paths)
+    write_manifest(f"{folder_path}/{compilation_manifest_name}", manifest)
+
+    chapters = [chapter for episode in manifest['episodes'] for chapter in episode['chapters']]
+    files_list = [chapter['image'] for chapter in chapters]
+
+    write_concat_list(f"{images_path}/{out_filename}", files_list, [chapter['duration'] for chapter in chapters])
+    write_outline(f"{images_path}/outline.txt", manifest)
 
     return files_list
 
@@ -214,66 +548,39 @@ def list_chapters_and_info(
         out_filename: str = "media.txt",
 ) -> list:
     """
-    Given a dir containing directories with chapters, outputs a file listing them.
+    Given a dir containing directories with chapters, outputs a file listing them in chapter order
+    and a concat_info.txt file with each Episode name and the timestamps of its chapters.
 
     :param folder_path: Name of folder containing the media files
-    :param file_extension: Name of file extension
+    :param file_extension: Not used, chapter files are listed by their episode manifest
     :param out_filename: Name of file to save results to
-    :return: List of relative file locations of media to be concatenated
+    :return: List of absolute file locations of media to be concatenated
     """
-    os.chdir(folder_path)
+    folder_path = os.path.abspath(folder_path)
 
-    # List of directories inside current dir
-    dirs = list_dirs(folder_path)
+    paths = episode_paths(folder_path)
 
-    # List of files inside current dir
-    files = list_files(folder_path)
-
-    # Get most common file extension and use it as a base
-    if file_extension == "":
-        extensions = [file.split(".")[-1] for file in files]
-        file_extension = most_common(extensions)
-
-    assert len(dirs) > 0, f"{folder_path} contains no directories."
+    assert len(paths) > 0, f"{folder_path} contains no episode directories."
 
     files_list = []
-    start_time = datetime.strptime("00:00:00", "%H:%M:%S")
-    for directory in dirs:
-
-        file_location = f"{folder_path}/{directory}/*.{file_extension}"
-        # Write absolute filepath for concatenation
-        os.system(f"""for f in {file_location};"""
-                  f"""do echo "file '$f'" >> {folder_path}/{out_filename}; done""")
-        files_list.append(file_location)
-
-        with open(f"{directory}/info.txt", 'r') as file:
-            text = file.read()
-            lines = text.split("\n")
-            podcast_name = lines[0]
+    lines = []
+    start_time = 0
+    for path in paths:
+        manifest = read_episode_manifest(path)
 
-            # Write Episode name for concat video description
-            os.system(f"echo '{podcast_name}' >> concat_info.txt")
+        # Episode name for concat video description
+        lines.append(manifest['media_name'])
 
-            for chapter in lines[1:]:
-                if chapter != "":
-                    start, end = regex_time.findall(chapter)
-                    chapter_name = regex_time.split(chapter)[0][:-2]
+        for chapter in manifest['chapters']:
+            files_list.append(f"{path}/{chapter['file']}")
 
-                    try:
-                        start = datetime.strptime(start, "%H:%M:%S")
-                    except ValueError:
-                        start = datetime.strptime(start, "%M:%S")
-                    try:
-                        end = datetime.strptime(end, "%H:%M:%S")
-                    except ValueError:
-                        end = datetime.strptime(end, "%M:%S")
+            # Timestamp & chapter name of Episode for concat video description
+            lines.append(f"{seconds_to_timestamp(start_time)} - {chapter['name']}")
+            start_time += chapter['duration']
 
-                    duration = end - start
-
-                    # Write timestamp & chapter name of Episode for concat video description
-                    os.system(f"echo '{start_time.time()}' - '{chapter_name}' >> concat_info.txt")
-
-                    start_time += duration
+    write_concat_list(f"{folder_path}/{out_filename}", files_list)
+    with open(f"{folder_path}/concat_info.txt", 'w') as file:
+        file.write("\n".join(lines) + "\n")
 
     return files_list
 
@@ -289,29 +596,19 @@ def query_keywords(
     :param key_words: List of keywords to query
     :return: None
     """
-    total_length = datetime.strptime("00:00:00", "%H:%M:%S")
-    count_chapters = 0
-    chapters_string = ""
-    for chapter in chapters_dict:
-
-        for chapter_name in chapters_dict[chapter]['chapters']:
-            start, end = chapters_dict[chapter]['chapters'][chapter_name][:2]
-            try:
-                start_time = datetime.strptime(start, "%H:%M:%S")
-            except ValueError:
-                start_time = datetime.strptime(start, "%M:%S")
-            try:
-                end_time = datetime.strptime(end, "%H:%M:%S")
-            except ValueError:
-                end_time = datetime.strptime(end, "%M:%S")
-
-            duration = end_time - start_time
-            total_length += duration
-
-            chapters_string += f"{total_length.time()}" + " - " + chapter_name + "\n"
-            count_chapters += 1
-
-    total_duration = total_length.time()
+    chapters = [Chapter.from_timestamps(chapter_name, *chapters_dict[url]['chapters'][chapter_name][:2])
+                for url in chapters_dict
+                for chapter_name in chapters_dict[url]['chapters']]
+
+    durations = np.fromiter((chapter.duration for chapter in chapters), dtype=np.int64, count=len(chapters))
+    # Running total at the end of each chapter
+    total_lengths = np.cumsum(durations)
+    count_chapters = len(chapters)
+
+    chapters_string = "".join(f"{seconds_to_timestamp(total_length)} - {chapter.name}\n"
+                              for total_length, chapter in zip(total_lengths.tolist(), chapters))
+
+    total_duration = seconds_to_timestamp(durations.sum())
 
     print(
         f"\nList of all chapters: \n{chapters_string}\n"
@@ -0,0 +1,263 @@
+import os
+import json
+
+from common.timestamp import seconds_to_timestamp
+from common.resources import list_dirs
+
+
+# Name of the manifest inside each episode dir and inside a compilation's folder
+episode_manifest_name = "episode.json"
+compilation_manifest_name = "compilation.json"
+
+
+def write_manifest(
+        filename: str,
+        manifest: dict,
+) -> str:
+    """
+    Saves a manifest as .json in one buffered write. The file is replaced atomically,
+    so readers never see a partly written manifest.
+
+    :param filename: Path of .json file
+    :param manifest: Dict to save
+    :return: Path of .json file
+    """
+    tmp_file = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as file:
+        file.write(json.dumps(manifest, indent=2, ensure_ascii=False))
+    os.replace(tmp_file, filename)
+
+    return filename
+
+
+def read_manifest(filename: str) -> dict:
+    """
+    Loads a manifest saved by 'write_manifest'.
+
+    :param filename: Path of .json file
+    :return: Dict
+    """
+    with open(filename, 'r') as file:
+        return json.load(file)
+
+
+def episode_manifest(
+        media_name: str,
+        guest: str,
+        extension: str,
+        chapters: list,
+) -> dict:
+    """
+    Returns the manifest of an episode dir: the episode and its chapters in order.
+
+    :param media_name: Name of the episode's media file, without extension
+    :param guest: Description of the guest
+    :param extension: Name of media extension, without the dot
+    :param chapters: List of chapter dicts with 'name', 'file', 'image', 'start' & 'end' in seconds
+    :return: Dict
+    """
+    return {
+        'media_name': media_name,
+        'guest': guest,
+        'extension': extension,
+        'chapters': [dict(chapter, duration=chapter['end'] - chapter['start']) for chapter in chapters],
+    }
+
+
+def write_episode_manifest(
+        episode_path: str,
+        manifest: dict,
+) -> str:
+    """
+    Saves the manifest of an episode dir, see 'episode_manifest'.
+
+    :param episode_path: Path of episode dir
+    :param manifest: Dict of 'episode_manifest' type
+    :return: Path of manifest
+    """
+    return write_manifest(f"{episode_path}/{episode_manifest_name}", manifest)
+
+
+def read_episode_manifest(episode_path: str) -> dict:
+    """
+    Loads the manifest of an episode dir created by 'split_episode'.
+
+    :param episode_path: Path of episode dir
+    :return: Dict of 'episode_manifest' type
+    """
+    return read_manifest(f"{episode_path}/{episode_manifest_name}")
+
+
+def episode_paths(folder_path: str) -> list:
+    """
+    Returns the paths of the episode dirs in a folder, the dirs with a manifest, sorted by name.
+
+    :param folder_path: Name of folder containing the episode dirs
+    :return: List of paths
+    """
+    return [f"{folder_path}/{directory}" for directory in sorted(list_dirs(folder_path))
+            if os.path.exists(f"{folder_path}/{directory}/{episode_manifest_name}")]
+
+
+def compilation_manifest(episodes: list) -> dict:
+    """
+    Returns the manifest of a compilation: its episodes in order, each with its title and
+    chapters, and where every chapter starts in the compilation.
+
+    :param episodes: List of dicts with 'title' & 'path' of the episode dir and 'manifest' of
+    'episode_manifest' type
+    :return: Dict
+    """
+    start = 0
+    entries = []
+    for episode in episodes:
+        chapters = []
+        for chapter in episode['manifest']['chapters']:
+            chapters.append({
+                'name': chapter['name'],
+                'file': f"{episode['path']}/{chapter['file']}",
+                'image': f"{episode['path']}/{chapter['image']}",
+                'start': start,
+                'duration': chapter['duration'],
+            })
+            start += chapter['duration']
+
+        entries.append({
+            'media_name': episode['manifest']['media_name'],
+            'title': episode['title'],
+            'path': episode['path'],
+            'chapters': chapters,
+        })
+
+    return {'episodes': entries, 'duration': start}
+
+
+def write_concat_list(
+        filename: str,
+        files: list,
+        durations: list = None,
+        repeat_last: bool = True,
+) -> str:
+    """
+    Saves a list of files for the ffmpeg concat demuxer. Quotes in file names are escaped.
+
+    :param filename: Path of list file
+    :param files: List of file paths in concat order
+    :param durations: List of durations in seconds of each file, eg. of images. Default is none.
+    The last file is repeated, as ffmpeg ignores the duration of the last entry
+    :param repeat_last: Repeat the last file if there are durations. False for files that have
+    their own length, where durations only set when the next file starts
+    :return: Path of list file
+    """
+    lines = []
+    for number, path in enumerate(files):
+        lines.append("file '{}'".format(path.replace("'", "'\\''")))
+        if durations is not None:
+            lines.append(f"duration {durations[number]}")
+
+    if durations is not None and repeat_last and len(files) > 0:
+        lines.append(lines[-2])
+
+    with open(filename, 'w') as file:
+        file.write("\n".join(lines) + "\n")
+
+    return filename
+
+
+def read_concat_list(filename: str) -> list:
+    """
+    Reads the files of a list for the ffmpeg concat demuxer, eg. one saved by 'write_concat_list'.
+
+    :param filename: Path of list file
+    :return: List of absolute file paths in concat order. Relative paths are resolved against the list's dir
+    """
+    folder_path = os.path.dirname(os.path.abspath(filename))
+
+    files = []
+    with open(filename, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line.startswith("file "):
+                continue
+
+            path = line[5:].strip()
+            if path.startswith("'") and path.endswith("'"):
+                path = path[1:-1].replace("'\\''", "'")
+            files.append(os.path.join(folder_path, path))
+
+    return files
+
+
+def outline_lines(manifest: dict) -> list:
+    """
+    Returns the outline of a compilation, one line per chapter with its start, name and episode.
+
+    :param manifest: Dict of 'compilation_manifest' type
+    :return: List of strings
+    """
+    return [f"{seconds_to_timestamp(chapter['start'])} - {chapter['name']}, {episode['title']}"
+            for episode in manifest['episodes'] for chapter in episode['chapters']]
+
+
+def write_outline(
+        filename: str,
+        manifest: dict,
+) -> str:
+    """
+    Saves the outline of a compilation as text, see 'outline_lines'.
+
+    :param filename: Path of text file
+    :param manifest: Dict of 'compilation_manifest' type
+    :return: Path of text file
+    """
+    with open(filename, 'w') as file:
+        file.write("\n".join(["OUTLINE"] + outline_lines(manifest)) + "\n")
+
+    return filename
+
+
+def _escape_metadata(text: str) -> str:
+    # Special characters of the ffmetadata format
+    for char in ("\\", "=", ";", "#", "\n"):
+        text = text.replace(char, "\\" + char)
+
+    return text
+
+
+def ffmetadata(
+        manifest: dict,
+        durations: list = None,
+        title: str = None,
+) -> str:
+    """
+    Returns the chapters of a compilation in the ffmetadata format, for '-map_chapters'.
+    Each chapter is named like its outline line, see 'outline_lines'.
+
+    :param manifest: Dict of 'compilation_manifest' type
+    :param durations: List of durations in seconds of each chapter's clip. Default is the duration
+    of each chapter in the manifest. Measured durations keep chapters aligned with the joined clips
+    :param title: Title of the compilation. Default is none
+    :return: String
+    """
+    chapters = [(chapter, episode) for episode in manifest['episodes'] for chapter in episode['chapters']]
+    if durations is None:
+        durations = [chapter['duration'] for chapter, _ in chapters]
+
+    lines = [";FFMETADATA1"]
+    if title is not None:
+        lines.append(f"title={_escape_metadata(title)}")
+
+    start = 0
+    for (chapter, episode), duration in zip(chapters, durations):
+        end = start + round(duration * 1000)
+        name = f"{chapter['name']}, {episode['title']}"
+        lines += [
+            "[CHAPTER]",
+            "TIMEBASE=1/1000",
+            f"START={start}",
+            f"END={end}",
+            f"title={_escape_metadata(name)}",
+        ]
+        start = end
+
+    return "\n".join(lines) + "\n"
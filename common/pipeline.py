@@ -0,0 +1,199 @@
+import os
+import queue
+import threading
+
+from datetime import datetime
+
+from common.tracing import (
+    traced,
+    bind,
+)
+from common.downloader import download_media
+from common.info import (
+    split_episode,
+    episode_images,
+    compilation_info,
+)
+from common.converter import (
+    encode_episode,
+    concat_files,
+    concat_audio,
+)
+from common.manifest import (
+    compilation_manifest_name,
+    write_manifest,
+    write_outline,
+)
+from common.resources import list_media
+
+
+def run_stage(
+        func,
+        inbox: queue.Queue,
+        outbox: queue.Queue,
+        workers: int = 1,
+) -> list:
+    """
+    Starts worker threads that take episodes from inbox, pass each to func and put the result
+    in outbox. None marks the end of the episodes: once every worker has seen it, it is passed
+    on to outbox. An episode whose func raises is reported and dropped.
+
+    :param func: Function taking and returning an episode dict
+    :param inbox: Queue to read episodes from
+    :param outbox: Queue to put processed episodes in
+    :param workers: Number of episodes processed at once
+    :return: List of started threads
+    """
+    def worker():
+        while True:
+            episode = inbox.get()
+            if episode is None:
+                # Let the other workers of this stage see the end too
+                inbox.put(None)
+                break
+
+            try:
+                outbox.put(func(episode))
+            except Exception as error:
+                print(f"{func.__name__} failed for {episode['media']['media_name']}. {error!r}")
+
+    def close():
+        for thread in threads:
+            thread.join()
+        outbox.put(None)
+
+    threads = [threading.Thread(target=bind(worker), daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    closer = threading.Thread(target=close, daemon=True)
+    closer.start()
+
+    return threads + [closer]
+
+
+@traced
+def run_pipeline(
+        folder_path: str,
+        chapters_dict: dict,
+        media_type: int = 1,
+        out_filename: str = "Final/final_video.mp4",
+        episode_filename: str = "concat_media.mp4",
+        single_pass: bool = True,
+        smart_cut: bool = False,
+        audio_only: bool = False,
+        cover_file: str = None,
+        workers: int = 4,
+        queue_size: int = 4,
+        concurrency: int = 8,
+) -> str:
+    """
+    Streams every episode through download, split, render and encode on its own, connected by
+    bounded queues, so early episodes are encoding while later ones are still downloading.
+    Media files already in folder_path are not downloaded again. The final concat starts as soon
+    as the last episode is encoded, with episodes in the order of chapters_dict.
+    An audio only compilation skips render and encode, its chapter clips are joined with a
+    chapter table as soon as the last episode is split, see 'concat_audio'.
+
+    :param folder_path: Name of folder to download media to and build the compilation in
+    :param chapters_dict: Dict of chapters of the 'get_matching_chapters' type
+    :param media_type: 0 for Video, 1 for Audio. Default 1-Audio
+    :param out_filename: Name of final output file relative to folder_path
+    :param episode_filename: Name of each episode's output file
+    :param single_pass: Cut all chapters of a media with one ffmpeg process
+    :param smart_cut: Cut chapters frame accurately, see 'smart_cut'. Off by default, as the encode
+    stage replaces the video of every chapter with its card
+    :param audio_only: Output only audio with chapter metadata instead of chapter images, eg. to a .m4a or .mp3 file
+    :param cover_file: Path of cover art image of an audio only compilation. Default is none
+    :param workers: Number of episodes each stage processes at once
+    :param queue_size: Maximum number of episodes waiting between two stages
+    :param concurrency: Maximum number of simultaneous downloads
+    :return: Path of final output file
+    """
+    folder_path = os.path.abspath(folder_path)
+    os.makedirs(folder_path, exist_ok=True)
+
+    downloaded = queue.Queue(queue_size)
+    split = queue.Queue(queue_size)
+    rendered = queue.Queue(queue_size)
+    encoded = queue.Queue()
+
+    def episode(url, filename):
+        return {
+            'url': url,
+            'media': chapters_dict[url],
+            'path': filename,
+            'extension': filename.split(".")[-1],
+        }
+
+    def download():
+        # Media already in the folder, eg. from a run without a manifest
+        existing = list_media(folder_path)
+
+        pending = {}
+        for url, media in chapters_dict.items():
+            if media['media_name'] in existing:
+                downloaded.put(episode(url, existing[media['media_name']]))
+            else:
+                pending[url] = media
+
+        try:
+            if len(pending) > 0:
+                download_media(pending, folder_path, media_type, concurrency,
+                               on_complete=lambda url, filename: downloaded.put(episode(url, filename)))
+        finally:
+            downloaded.put(None)
+
+    def split_stage(item):
+        split_episode(folder_path, item['media'], item['extension'], single_pass, smart=smart_cut)
+        item['episode_path'] = f"{folder_path}/{item['media']['media_name']}"
+
+        return item
+
+    def render_stage(item):
+        item['images'] = episode_images(item['episode_path'])
+
+        return item
+
+    def encode_stage(item):
+        encode_episode(item['episode_path'], episode_filename, item['extension'])
+
+        return item
+
+    print(f"{datetime.now()} - Started streaming {len(chapters_dict)} episode/s in {folder_path}")
+
+    threading.Thread(target=bind(download), daemon=True).start()
+    if audio_only:
+        run_stage(split_stage, downloaded, encoded, workers)
+    else:
+        run_stage(split_stage, downloaded, split, workers)
+        run_stage(render_stage, split, rendered, workers)
+        run_stage(encode_stage, rendered, encoded, workers)
+
+    finished = {}
+    while True:
+        item = encoded.get()
+        if item is None:
+            break
+        finished[item['url']] = item
+        print(f"{datetime.now()} - {'Split' if audio_only else 'Encoded'} {len(finished)}/{len(chapters_dict)}: "
+              f"{item['media']['media_name']}")
+
+    assert len(finished) > 0, f"No episodes of {folder_path} made it through the pipeline."
+
+    # Episodes finish in any order, the compilation keeps the order of chapters_dict
+    items = [finished[url] for url in chapters_dict if url in finished]
+
+    manifest = compilation_info([item['episode_path'] for item in items])
+    write_manifest(f"{folder_path}/{compilation_manifest_name}", manifest)
+
+    os.makedirs(f"{folder_path}/images", exist_ok=True)
+    write_outline(f"{folder_path}/images/outline.txt", manifest)
+
+    os.makedirs(os.path.dirname(f"{folder_path}/{out_filename}"), exist_ok=True)
+
+    if audio_only:
+        return concat_audio(folder_path, manifest, out_filename, cover_file)
+
+    return concat_files(folder_path, [f"{item['media']['media_name']}/{episode_filename}" for item in items],
+                        out_filename)
@@ -0,0 +1,254 @@
+import os
+import json
+
+from common.timestamp import timestamp_to_seconds
+from common.downloader import video_id
+from common.fetch import (
+    load_manifest,
+    is_downloaded,
+)
+from common.cache import (
+    source_digest,
+    clip_key,
+    cached_clip,
+    cut_options,
+)
+from common.image import card_key
+from common.info import card_message
+from common.resources import list_media
+from common.scheduler import get_scheduler
+from common.throughput import (
+    load_throughput,
+    stage_rate,
+)
+from common.variables import cache_dir
+
+
+# Bytes per second of media assumed for video downloads until 'media_bytes' is measured
+default_video_bytes = 300e3
+
+
+def _stage(count, byte_count, cpu_seconds, wall_seconds) -> dict:
+    return {
+        'count': count,
+        'bytes': int(byte_count),
+        'cpu_seconds': round(cpu_seconds, 2),
+        'wall_seconds': round(wall_seconds, 2),
+    }
+
+
+def plan_query(
+        chapters_dict: dict,
+        folder_path: str,
+        media_type: int = 1,
+        single_pass: bool = True,
+        smart_cut: bool = False,
+        audio_only: bool = False,
+        throughput_file: str = None,
+) -> dict:
+    """
+    Turns the result of a query into a plan of the work exporting it takes: downloads needed
+    versus already on disk, clips to cut versus cached, cards to render versus cached and
+    segments to encode. Each stage gets an estimate of bytes, CPU-seconds and wall time from
+    the throughput measured by earlier runs, see 'common.throughput', and the budgets of the
+    ffmpeg scheduler. Nothing is downloaded, cut or rendered.
+
+    :param chapters_dict: Dict of chapters of the 'get_matching_chapters' type
+    :param folder_path: Name of folder media is or would be downloaded to
+    :param media_type: 0 for Video, 1 for Audio. Default 1-Audio
+    :param single_pass: Whether chapters would be cut with one ffmpeg process per media
+    :param smart_cut: Whether chapters would be cut frame accurately
+    :param audio_only: Whether the compilation would be audio with a chapter table, without cards & segments
+    :param throughput_file: Path of measured throughput .json file. Default is 'throughput_path()'
+    :return: Dict with 'episodes', counts of 'downloads', 'clips', 'cards' & 'segments',
+    an estimate per stage in 'stages' and their 'total'
+    """
+    folder_path = os.path.abspath(folder_path)
+    throughput = load_throughput(throughput_file)
+    scheduler = get_scheduler()
+
+    manifest = load_manifest(f"{folder_path}/.manifest.json")
+    existing = list_media(folder_path) if os.path.isdir(folder_path) else {}
+
+    if 'media_bytes' not in throughput and media_type == 0:
+        media_bytes = default_video_bytes
+    else:
+        media_bytes = stage_rate(throughput, 'media_bytes')
+
+    episodes = []
+    for url, media in chapters_dict.items():
+        media_name = media['media_name']
+        chapters = media['chapters']
+        if media_name in existing:
+            filename = existing[media_name]
+        elif is_downloaded(manifest, video_id(url)):
+            filename = manifest[video_id(url)]['path']
+        else:
+            filename = None
+
+        if filename is not None:
+            extension = filename.split(".")[-1]
+            digest = source_digest(filename)
+        else:
+            extension = digest = None
+
+        durations = []
+        cut_seconds = 0
+        clips_cached = 0
+        cards_cached = 0
+        for chapter, (start, end) in chapters.items():
+            durations.append(timestamp_to_seconds(end) - timestamp_to_seconds(start))
+
+            if digest is not None and cached_clip(clip_key(digest, start, end, cut_options(single_pass, smart_cut)),
+                                                  extension, touch=False) is not None:
+                clips_cached += 1
+            else:
+                cut_seconds += durations[-1]
+
+            card = card_key(card_message(media['guest'], chapter), text_size=35)
+            if os.path.exists(f"{cache_dir}/cards/{card}.jpeg"):
+                cards_cached += 1
+
+        episodes.append({
+            'url': url,
+            'media_name': media_name,
+            'downloaded': filename is not None,
+            'chapters': len(chapters),
+            'media_seconds': sum(durations),
+            'cut_seconds': cut_seconds,
+            # The last chapter ends at the end of the media at the latest
+            'source_seconds': max([timestamp_to_seconds(end) for start, end in chapters.values()], default=0),
+            'clips_cached': clips_cached,
+            'cards_cached': cards_cached,
+        })
+
+    chapter_count = sum(episode['chapters'] for episode in episodes)
+    media_seconds = sum(episode['media_seconds'] for episode in episodes)
+    clips_cached = sum(episode['clips_cached'] for episode in episodes)
+    cards_cached = sum(episode['cards_cached'] for episode in episodes)
+    downloads = [episode for episode in episodes if not episode['downloaded']]
+
+    cut_seconds = sum(episode['cut_seconds'] for episode in episodes)
+    cpu_threads = scheduler.cpu_threads
+    io_jobs = scheduler.io_jobs
+
+    download_bytes = sum(episode['source_seconds'] for episode in downloads) * media_bytes
+    download_wall = download_bytes / stage_rate(throughput, 'download')
+
+    cut_job_seconds = cut_seconds / stage_rate(throughput, 'smart_cut' if smart_cut else 'cut')
+
+    segments = 0 if audio_only else chapter_count
+    cards_render = 0 if audio_only else chapter_count - cards_cached
+    card_wall = cards_render / stage_rate(throughput, 'card')
+
+    still_cpu = segments / stage_rate(throughput, 'still')
+    mux_bytes = 0 if audio_only else media_seconds * media_bytes
+    mux_job_seconds = mux_bytes / stage_rate(throughput, 'mux')
+
+    if audio_only:
+        # All chapter clips are joined once
+        concat_count = 1
+        concat_bytes = media_seconds * media_bytes
+    else:
+        # Every episode is concatenated once, then all episodes once more
+        concat_count = len(episodes) + 1
+        concat_bytes = 2 * mux_bytes
+    concat_wall = concat_bytes / stage_rate(throughput, 'concat')
+
+    stages = {
+        'download': _stage(len(downloads), download_bytes, 0, download_wall),
+        'cut': _stage(chapter_count - clips_cached, cut_seconds * media_bytes, cut_job_seconds,
+                      cut_job_seconds / io_jobs),
+        'card': _stage(cards_render, 0, card_wall * (os.cpu_count() or 1), card_wall),
+        'still': _stage(segments, 0, still_cpu, still_cpu / cpu_threads),
+        'mux': _stage(segments, mux_bytes, mux_job_seconds, mux_job_seconds / io_jobs),
+        'concat': _stage(concat_count, concat_bytes, concat_wall, concat_wall),
+    }
+
+    streamed = [stage['wall_seconds'] for name, stage in stages.items() if name != 'concat']
+
+    return {
+        'folder_path': folder_path,
+        'media_seconds': media_seconds,
+        'episodes': episodes,
+        'downloads': {'needed': len(downloads), 'cached': len(episodes) - len(downloads)},
+        'clips': {'cut': chapter_count - clips_cached, 'cached': clips_cached},
+        'cards': {'render': cards_render, 'cached': cards_cached},
+        'segments': {'encode': segments},
+        'stages': stages,
+        'total': {
+            'bytes': sum(stage['bytes'] for stage in stages.values()),
+            'cpu_seconds': round(sum(stage['cpu_seconds'] for stage in stages.values()), 2),
+            # Stages overlap when streamed, only the final concat waits for all of them
+            'wall_seconds': round(max(streamed, default=0) + stages['concat']['wall_seconds'], 2),
+            'serial_wall_seconds': round(sum(stage['wall_seconds'] for stage in stages.values()), 2),
+        },
+    }
+
+
+def plan_fits(
+        plan: dict,
+        max_wall_seconds: float = None,
+        max_bytes: int = None,
+        max_cpu_seconds: float = None,
+) -> bool:
+    """
+    Checks a plan against limits, to admit or reject a query before running it.
+
+    :param plan: Dict of 'plan_query' type
+    :param max_wall_seconds: Maximum estimated wall time. Default is no limit
+    :param max_bytes: Maximum estimated bytes. Default is no limit
+    :param max_cpu_seconds: Maximum estimated CPU-seconds. Default is no limit
+    :return: True if the plan is within all limits
+    """
+    total = plan['total']
+    limits = (
+        (max_wall_seconds, total['wall_seconds']),
+        (max_bytes, total['bytes']),
+        (max_cpu_seconds, total['cpu_seconds']),
+    )
+
+    return all(limit is None or value <= limit for limit, value in limits)
+
+
+def save_plan(
+        plan: dict,
+        filename: str,
+) -> str:
+    """
+    Saves a plan as .json.
+
+    :param plan: Dict of 'plan_query' type
+    :param filename: Path of .json file
+    :return: Path of .json file
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, 'w') as file:
+        json.dump(plan, file, indent=2)
+
+    return filename
+
+
+def format_plan(plan: dict) -> str:
+    """
+    Returns a plan as human readable text.
+
+    :param plan: Dict of 'plan_query' type
+    :return: String
+    """
+    lines = [
+        f"Plan for {plan['folder_path']}:",
+        f"Downloads: {plan['downloads']['needed']} needed, {plan['downloads']['cached']} on disk",
+        f"Clips: {plan['clips']['cut']} to cut, {plan['clips']['cached']} cached",
+        f"Cards: {plan['cards']['render']} to render, {plan['cards']['cached']} cached",
+        f"Segments: {plan['segments']['encode']} to encode",
+    ]
+    for name, stage in plan['stages'].items():
+        lines.append(f"  {name:<8} {stage['bytes'] / 1e6:>10.1f} MB {stage['cpu_seconds']:>10.1f} cpu-s "
+                     f"{stage['wall_seconds']:>10.1f} s")
+
+    total = plan['total']
+    lines.append(f"Estimated total: {total['bytes'] / 1e6:.1f} MB, {total['cpu_seconds']:.1f} cpu-s, "
+                 f"{total['wall_seconds']:.1f} s ({total['serial_wall_seconds']:.1f} s without overlap)")
+
+    return "\n".join(lines)
@@ -0,0 +1,127 @@
+import json
+import subprocess
+
+
+# Stream fields that must be equal for media files to be joined without re-encoding
+concat_stream_fields = (
+    'codec_type',
+    'codec_name',
+    'profile',
+    'level',
+    'width',
+    'height',
+    'pix_fmt',
+    'sample_aspect_ratio',
+    'r_frame_rate',
+    'time_base',
+    'sample_rate',
+    'channels',
+    'channel_layout',
+)
+
+
+def probe_streams(filename: str) -> list:
+    """
+    Reads the streams of a media file with ffprobe.
+
+    :param filename: Path of media file
+    :return: List of stream dicts as reported by ffprobe, eg. {'codec_type': 'video', 'width': 1600, ...}
+    """
+    process = subprocess.run(["ffprobe", "-v", "error", "-show_streams",
+                              "-of", "json", filename], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise OSError(f"ffprobe could not read {filename}: {process.stderr.strip()}")
+
+    return json.loads(process.stdout).get('streams', [])
+
+
+def concat_signature(streams: list) -> tuple:
+    """
+    Returns the parameters of the streams of a media file that the concat demuxer needs to match.
+
+    :param streams: List of stream dicts of the 'probe_streams' type
+    :return: Tuple with a tuple of 'concat_stream_fields' values per audio & video stream
+    """
+    return tuple(tuple(stream.get(field) for field in concat_stream_fields) for stream in streams
+                 if stream.get('codec_type') in ('audio', 'video'))
+
+
+def probe_gops(filename: str) -> tuple:
+    """
+    Reads the keyframes of the first video stream of a media file with ffprobe, leaving out
+    cover art, and counts the packets of each GOP. Only packet headers are read, nothing is decoded.
+
+    :param filename: Path of media file
+    :return: Tuple of a sorted list of keyframe times in seconds from the start of the file and a
+    list of the number of packets from each keyframe to the next in decode order, both empty if it has no video
+    """
+    process = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "V:0",
+                              "-show_entries", "packet=pts_time,flags:format=start_time",
+                              "-of", "json", filename], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise OSError(f"ffprobe could not read {filename}: {process.stderr.strip()}")
+
+    probe = json.loads(process.stdout)
+    # Seeking with '-ss' is relative to the start of the file, not to timestamp 0
+    start_time = float(probe.get('format', {}).get('start_time', 0) or 0)
+
+    # Packets are listed in decode order, packets before the first keyframe can not be decoded
+    gops = []
+    for packet in probe.get('packets', []):
+        if 'K' in packet.get('flags', '') and packet.get('pts_time', 'N/A') != 'N/A':
+            gops.append([float(packet['pts_time']) - start_time, 0])
+        if len(gops) > 0:
+            gops[-1][1] += 1
+    gops.sort()
+
+    return [keyframe for keyframe, frames in gops], [frames for keyframe, frames in gops]
+
+
+def probe_keyframes(filename: str) -> list:
+    """
+    Reads the times of the keyframes of the first video stream of a media file, see 'probe_gops'.
+
+    :param filename: Path of media file
+    :return: Sorted list of keyframe times in seconds from the start of the file, empty if it has no video
+    """
+    return probe_gops(filename)[0]
+
+
+def probe_frame_times(
+        filename: str,
+        input_options: list = (),
+) -> list:
+    """
+    Reads the presentation times of the frames of the first video stream of a media file with
+    ffprobe, leaving out cover art. Only packet headers are read, nothing is decoded.
+
+    :param filename: Path of media file
+    :param input_options: ffprobe options of the input, eg. ['-f', 'concat', '-safe', '0']
+    :return: Sorted list of frame times in seconds from the start of the file, empty if it has no video
+    """
+    process = subprocess.run(["ffprobe", "-v", "error"] + list(input_options)
+                             + ["-select_streams", "V:0", "-show_entries", "packet=pts_time:format=start_time",
+                                "-of", "json", filename], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise OSError(f"ffprobe could not read {filename}: {process.stderr.strip()}")
+
+    probe = json.loads(process.stdout)
+    start_time = float(probe.get('format', {}).get('start_time', 0) or 0)
+
+    return sorted(float(packet['pts_time']) - start_time for packet in probe.get('packets', [])
+                  if packet.get('pts_time', 'N/A') != 'N/A')
+
+
+def probe_duration(filename: str) -> float:
+    """
+    Reads the duration of a media file with ffprobe.
+
+    :param filename: Path of media file
+    :return: Duration in seconds
+    """
+    process = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                              "-of", "json", filename], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise OSError(f"ffprobe could not read {filename}: {process.stderr.strip()}")
+
+    return float(json.loads(process.stdout)['format']['duration'])
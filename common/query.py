@@ -0,0 +1,310 @@
+import re
+import bisect
+import numpy as np
+
+from functools import lru_cache
+
+from common.variables import regex_non_word
+
+
+# Compiled regex matching a token of a query: a parenthesis, a quoted phrase or a word
+regex_query_token = re.compile(r'\s*(?:([()])|"([^"]*)"?|([^\s()"]+))')
+
+# Operators are upper case, so 'and' & 'or' in a chapter name can still be searched for
+query_operators = ("AND", "OR", "NOT")
+
+
+def _words(text: str) -> tuple:
+    # Words of a query term, split like chapter names are split into index terms
+    return tuple(word for word in regex_non_word.split(text.lower()) if word)
+
+
+def tokenize_query(query: str) -> list:
+    """
+    Splits a query into tokens.
+
+    :param query: Query string, eg. 'ai AND (consciousness OR "free will") NOT sponsor*'
+    :return: List of (kind, value) tuples, where kind is 'paren', 'phrase', 'operator' or 'word'
+    """
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = regex_query_token.match(query, position)
+        paren, phrase, word = match.groups()
+        if paren is not None:
+            tokens.append(('paren', paren))
+        elif phrase is not None:
+            tokens.append(('phrase', phrase))
+        elif word in query_operators:
+            tokens.append(('operator', word))
+        else:
+            tokens.append(('word', word))
+        position = match.end()
+
+    return tokens
+
+
+def _term(kind: str, value: str) -> list:
+    # Instructions of a single term
+    if kind == 'word' and value.startswith("-") and len(value) > 1:
+        return _term(kind, value[1:]) + [('not',)]
+
+    if kind == 'word' and value.endswith("*"):
+        words = _words(value[:-1])
+        if len(words) == 0:
+            return [('all',)]
+        if len(words) > 1:
+            # Eg. 'free-wi*', the phrase of all but the last word and the prefix
+            return [('phrase', words[:-1]), ('prefix', words[-1]), ('and',)]
+        return [('prefix', words[0])]
+
+    words = _words(value)
+    if len(words) == 0:
+        return [('none',)]
+    if len(words) == 1:
+        return [('term', words[0])]
+
+    return [('phrase', words)]
+
+
+@lru_cache(maxsize=256)
+def compile_query(query: str) -> tuple:
+    """
+    Compiles a query into a plan of bitset instructions in postfix order, see 'evaluate_plan'.
+
+    Terms are words, "quoted phrases" and prefixes ending with '*'. They are combined with
+    AND, OR, NOT and parentheses. AND binds tighter than OR and is implied between terms,
+    so 'ai NOT sponsor*' is 'ai AND NOT sponsor*'. A leading '-' negates a word, like NOT.
+
+    :param query: Query string, eg. 'ai AND (consciousness OR "free will") NOT sponsor*'
+    :return: Tuple of instructions, eg. (('term', 'ai'), ('prefix', 'sponsor'), ('not',), ('and',))
+    """
+    tokens = tokenize_query(query)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def parse_or():
+        nonlocal position
+        plan = parse_and()
+        while peek() == ('operator', 'OR'):
+            position += 1
+            plan += parse_and() + [('or',)]
+        return plan
+
+    def parse_and():
+        nonlocal position
+        plan = parse_not()
+        while True:
+            kind, value = peek()
+            if (kind, value) == ('operator', 'AND'):
+                position += 1
+            elif kind is None or (kind, value) in (('operator', 'OR'), ('paren', ')')):
+                return plan
+            plan += parse_not() + [('and',)]
+
+    def parse_not():
+        nonlocal position
+        if peek() == ('operator', 'NOT'):
+            position += 1
+            return parse_not() + [('not',)]
+        return parse_term()
+
+    def parse_term():
+        nonlocal position
+        kind, value = peek()
+        if kind is None:
+            raise ValueError(f"Incomplete query: {query}")
+        position += 1
+
+        if (kind, value) == ('paren', '('):
+            plan = parse_or()
+            if peek() != ('paren', ')'):
+                raise ValueError(f"Missing ')' in query: {query}")
+            position += 1
+            return plan
+
+        if kind in ('paren', 'operator'):
+            raise ValueError(f"Unexpected '{value}' in query: {query}")
+
+        return _term(kind, value)
+
+    if len(tokens) == 0:
+        return (('all',),)
+
+    plan = parse_or()
+    if position < len(tokens):
+        raise ValueError(f"Unexpected '{tokens[position][1]}' in query: {query}")
+
+    return tuple(plan)
+
+
+def keywords_plan(keywords: list) -> tuple:
+    """
+    Compiles a list of keywords of the 'get_matching_chapters' type into a plan: chapters with
+    any of the keywords, as a whole word, and none of the '-' negated keywords.
+
+    :param keywords: List of string keywords
+    :return: Tuple of instructions, see 'compile_query'
+    """
+    included = [('term', keyword.lower()) for keyword in keywords if not keyword.startswith("-")]
+    excluded = [('term', keyword[1:].lower()) for keyword in keywords if keyword.startswith("-")]
+
+    plan = [('none',)]
+    for instruction in included:
+        plan += [instruction, ('or',)]
+    for instruction in excluded:
+        plan += [instruction, ('not',), ('and',)]
+
+    return tuple(plan)
+
+
+def ranking_query(query: str) -> tuple:
+    """
+    Splits a query of the 'compile_query' type for ranked search. The terms it looks for are
+    joined into free text to rank by, without operators, quotes or '*'. The terms it excludes
+    are kept as a plan with every other term replaced by 'all', so the plan only rules out
+    chapters the query's negations rule out, however the terms are combined.
+
+    :param query: Query string, eg. 'neural networks -sponsor'
+    :return: Tuple of the text to rank by, eg. 'neural networks', and a plan of instructions, see 'evaluate_plan'
+    """
+    # Each entry is a (plan, words) variant for under an even and under an odd number of NOTs.
+    # Terms under an even number are looked for
+    stack = []
+    for instruction in compile_query(query):
+        operator = instruction[0]
+        if operator == 'all':
+            stack.append((((instruction,), []), ((instruction,), [])))
+        elif operator in ('term', 'prefix', 'phrase', 'none'):
+            words = instruction[1] if operator == 'phrase' else instruction[1:]
+            stack.append((((('all',),), list(words)), ((instruction,), [])))
+        elif operator == 'not':
+            even, odd = stack.pop()
+            stack.append(((odd[0] + (instruction,), odd[1]), (even[0] + (instruction,), even[1])))
+        else:
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(tuple((left[parity][0] + right[parity][0] + (instruction,),
+                                left[parity][1] + right[parity][1]) for parity in (0, 1)))
+
+    plan, words = stack.pop()[0]
+
+    return " ".join(words), plan
+
+
+def _bitset(
+        chapter_ids,
+        count: int,
+) -> np.ndarray:
+    # One bit per chapter, packed 8 to a byte
+    bits = np.zeros(count, dtype=bool)
+    bits[np.fromiter(chapter_ids, dtype=np.int64)] = True
+
+    return np.packbits(bits)
+
+
+def bitset_ids(
+        bitset: np.ndarray,
+        count: int,
+) -> np.ndarray:
+    """
+    Returns the numbers of the chapters set in a bitset.
+
+    :param bitset: Packed uint8 array, see 'evaluate_plan'
+    :param count: Number of chapters
+    :return: Sorted int64 array
+    """
+    return np.flatnonzero(np.unpackbits(bitset, count=count))
+
+
+def video_bitset(
+        index: dict,
+        mask: np.ndarray,
+) -> np.ndarray:
+    """
+    Returns the bitset of the chapters of the videos set in a mask, eg. of 'video_mask'.
+
+    :param index: Dict of 'new_chapter_index' type
+    :param mask: Boolean array with a value per indexed video
+    :return: Packed uint8 array with a bit per chapter
+    """
+    chapters = index['chapters']
+    video_ids = np.fromiter((chapter[0] for chapter in chapters), dtype=np.int64, count=len(chapters))
+
+    return np.packbits(np.asarray(mask, dtype=bool)[video_ids])
+
+
+def evaluate_plan(
+        index: dict,
+        plan: tuple,
+) -> np.ndarray:
+    """
+    Evaluates a plan over the numbered chapters of a chapter index. Every term is looked up
+    once as a bitset of one bit per chapter, and every operator is a single vectorized
+    bitwise operation, so a query's cost does not depend on how its terms are combined.
+    Phrases are matched against the chapter names of chapters having all of their words.
+
+    :param index: Dict of 'new_chapter_index' type
+    :param plan: Tuple of instructions of 'compile_query' type
+    :return: Packed uint8 array with a bit per chapter, see 'bitset_ids'
+    """
+    terms = index['terms']
+    chapters = index['chapters']
+    count = len(chapters)
+
+    bitsets = {}
+    sorted_terms = None
+
+    def term_bitset(word):
+        if word not in bitsets:
+            bitsets[word] = _bitset(terms.get(word, ()), count)
+        return bitsets[word]
+
+    stack = []
+    for instruction in plan:
+        operator = instruction[0]
+        if operator == 'term':
+            stack.append(term_bitset(instruction[1]))
+
+        elif operator == 'prefix':
+            if sorted_terms is None:
+                sorted_terms = sorted(terms)
+            prefix = instruction[1]
+            first = bisect.bisect_left(sorted_terms, prefix)
+            last = bisect.bisect_left(sorted_terms, prefix + "\U0010ffff")
+            postings = [chapter_id for word in sorted_terms[first:last] for chapter_id in terms[word]]
+            stack.append(_bitset(postings, count))
+
+        elif operator == 'phrase':
+            words = instruction[1]
+            candidates = term_bitset(words[0])
+            for word in words[1:]:
+                candidates = candidates & term_bitset(word)
+
+            size = len(words)
+            matching = []
+            for chapter_id in bitset_ids(candidates, count).tolist():
+                chapter_words = _words(chapters[chapter_id][1])
+                if any(chapter_words[i:i + size] == words for i in range(len(chapter_words) - size + 1)):
+                    matching.append(chapter_id)
+            stack.append(_bitset(matching, count))
+
+        elif operator == 'all':
+            stack.append(np.invert(_bitset((), count)))
+        elif operator == 'none':
+            stack.append(_bitset((), count))
+        elif operator == 'not':
+            stack.append(np.invert(stack.pop()))
+        elif operator == 'and':
+            right = stack.pop()
+            stack.append(stack.pop() & right)
+        elif operator == 'or':
+            right = stack.pop()
+            stack.append(stack.pop() | right)
+        else:
+            raise ValueError(f"Unknown query instruction: {operator}")
+
+    return stack.pop()
@@ -1,15 +1,15 @@
 import os
+import shutil
+import hashlib
 
 
 def delete_redundant_dirs(path: str) -> None:
-    os.chdir(path)
-
     files = set([file.split(".")[0] for file in list_files(path)])
     dirs = set(list_dirs(path))
 
     diff = dirs.difference(files)
     for dif in diff:
-        os.system(f"rm -r {dif}")
+        shutil.rmtree(os.path.join(path, dif))
 
 
 def most_common(list_):
@@ -50,6 +50,18 @@ def list_files(folder_path: str,) -> list:
     return files
 
 
+def list_media(folder_path: str) -> dict:
+    """
+    Returns the media files in a specified directory by their name without extension.
+    Unfinished downloads are left out.
+
+    :param folder_path: Path to directory to inspect
+    :return: Dict of media name -> file path
+    """
+    return {os.path.splitext(file)[0]: f"{folder_path}/{file}" for file in list_files(folder_path)
+            if not file.endswith(".part")}
+
+
 def list_dirs_paths(folder_path: str,) -> list:
     """
     Returns a list of all directory paths in a specified directory.
@@ -89,8 +101,6 @@ def rename_file_extension(
     :param new_extension: Name of file extension to be given, including dot, eg. '.wav'
     :return: List of renamed files
     """
-    os.chdir(folder_path)
-
     # Get all files in directory
     files = list_files(folder_path)
 
@@ -98,14 +108,63 @@ def rename_file_extension(
     for file in files:
         name = file.split(".")[0]
         name += new_extension
-        command = f"""mv {file} {name}"""
-        os.system(command)
+        os.rename(os.path.join(folder_path, file), os.path.join(folder_path, name))
 
         renamed_files.append(name)
 
     return renamed_files
 
 
+def file_digest(filename: str) -> str:
+    """
+    Returns the sha1 hex digest of a file, read in chunks.
+
+    :param filename: Path of file to hash
+    :return: Hex digest string
+    """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def link_file(
+        source: str,
+        filename: str,
+) -> None:
+    """
+    Places a file at a new path without copying its data where possible. Tries a hard link,
+    then a reflink (copy-on-write clone, Linux only) and finally falls back to a copy.
+    An existing file at filename is replaced.
+
+    :param source: Path of existing file
+    :param filename: Path to place it at
+    :return: None
+    """
+    if os.path.lexists(filename):
+        os.remove(filename)
+
+    try:
+        os.link(source, filename)
+        return
+    except OSError:
+        pass
+
+    try:
+        import fcntl
+
+        with open(source, 'rb') as source_file, open(filename, 'wb') as file:
+            # FICLONE
+            fcntl.ioctl(file.fileno(), 0x40049409, source_file.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+
+    shutil.copyfile(source, filename)
+
+
 def reduce_text_len(
         text: str,
         max_len: int,
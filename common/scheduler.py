@@ -0,0 +1,297 @@
+import os
+import time
+import threading
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+from common.tracing import (
+    get_tracer,
+    rss_bytes,
+    bind,
+)
+from common.manifest import read_concat_list
+
+
+def _file_bytes(
+        command: list,
+        cwd: str = None,
+) -> dict:
+    # Sizes of the input files and the output file of an ffmpeg command. The input of
+    # the concat demuxer is the media it lists, not the list
+    def path(filename):
+        return os.path.join(cwd or os.getcwd(), filename)
+
+    def size(filename):
+        return os.path.getsize(path(filename)) if os.path.isfile(path(filename)) else 0
+
+    inputs = []
+    input_format = None
+    for i, argument in enumerate(command[:-1]):
+        if argument == "-f":
+            input_format = command[i + 1]
+        elif argument == "-i":
+            if input_format == "concat" and os.path.isfile(path(command[i + 1])):
+                inputs.extend(read_concat_list(path(command[i + 1])))
+            else:
+                inputs.append(command[i + 1])
+            input_format = None
+
+    return {
+        'bytes_read': sum(size(filename) for filename in inputs),
+        'bytes_written': size(command[-1]),
+    }
+
+
+class FFmpegScheduler:
+    """
+    Admits ffmpeg jobs against two separate budgets, so many callers can share one machine
+    without oversubscribing it:
+
+    cpu - encoding jobs. Each job takes 'threads' CPU threads from a budget of 'cpu_threads'
+          and gets '-threads' set on its output accordingly.
+    io  - stream copy jobs, limited to 'io_jobs' running at once.
+
+    Jobs block in 'run' until admitted, or can be queued with 'submit' from any thread.
+    """
+
+    def __init__(
+            self,
+            cpu_threads: int = None,
+            threads_per_job: int = 2,
+            io_jobs: int = 4,
+    ) -> None:
+        """
+        :param cpu_threads: Total CPU thread budget. Default is os.cpu_count()
+        :param threads_per_job: Default number of threads given to each cpu job
+        :param io_jobs: Maximum number of io jobs running at once
+        """
+        self.cpu_threads = cpu_threads or os.cpu_count() or 1
+        self.threads_per_job = max(1, min(threads_per_job, self.cpu_threads))
+        self.io_jobs = io_jobs
+
+        self._condition = threading.Condition()
+        self._cpu_in_use = 0
+        self._io_in_use = 0
+        self._waiting = {'cpu': 0, 'io': 0}
+        self._completed = 0
+        self._failed = 0
+        self._busy_thread_seconds = 0.0
+        self._started = time.monotonic()
+
+        # A pool per budget, with enough workers to keep it full. Queued cpu jobs then can not
+        # take the workers io jobs need, the rest of submitted jobs wait in the queue of their pool
+        self._executors = {
+            'cpu': ThreadPoolExecutor(max_workers=self.cpu_threads, thread_name_prefix="ffmpeg-cpu"),
+            'io': ThreadPoolExecutor(max_workers=self.io_jobs, thread_name_prefix="ffmpeg-io"),
+        }
+
+    def _acquire(self, kind: str, threads: int) -> None:
+        with self._condition:
+            self._waiting[kind] += 1
+            if kind == 'cpu':
+                self._condition.wait_for(lambda: self._cpu_in_use + threads <= self.cpu_threads)
+                self._cpu_in_use += threads
+            else:
+                self._condition.wait_for(lambda: self._io_in_use < self.io_jobs)
+                self._io_in_use += 1
+            self._waiting[kind] -= 1
+
+    def _release(self, kind: str, threads: int, elapsed: float, returncode: int) -> None:
+        with self._condition:
+            if kind == 'cpu':
+                self._cpu_in_use -= threads
+                self._busy_thread_seconds += threads * elapsed
+            else:
+                self._io_in_use -= 1
+            self._completed += 1
+            self._failed += returncode != 0
+            self._condition.notify_all()
+
+    def run(
+            self,
+            command: list,
+            kind: str = 'cpu',
+            threads: int = None,
+            cwd: str = None,
+    ) -> subprocess.CompletedProcess:
+        """
+        Runs an ffmpeg command once the budget allows it, blocking the calling thread.
+
+        :param command: ffmpeg command as a list of arguments, starting with 'ffmpeg'
+        :param kind: 'cpu' for encoding jobs, 'io' for stream copy jobs
+        :param threads: Number of CPU threads for a cpu job. Default is 'threads_per_job'
+        :param cwd: Directory to run the command in. Default is the current working dir
+        :return: CompletedProcess of the finished command, with its run time in seconds as 'elapsed'
+        """
+        if kind not in ('cpu', 'io'):
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        threads = min(threads or self.threads_per_job, self.cpu_threads) if kind == 'cpu' else 0
+        if kind == 'cpu':
+            # Applies to the encoder of the last output file
+            command = command[:-1] + ["-threads", str(threads), command[-1]]
+
+        tracer = get_tracer()
+        queued = time.perf_counter()
+        self._acquire(kind, threads)
+        start = time.perf_counter()
+        if start - queued > 1e-3:
+            tracer.add(f"wait {kind}", 'queue', queued, start)
+
+        returncode = -1
+        usage = None
+        try:
+            # Children running at once would otherwise all read the terminal
+            child = subprocess.Popen(command, cwd=cwd, stdin=subprocess.DEVNULL)
+            if hasattr(os, "wait4"):
+                # Reap the child ourselves to get its own CPU time and peak memory
+                _, status, usage = os.wait4(child.pid, 0)
+                child.returncode = os.waitstatus_to_exitcode(status)
+            else:
+                child.wait()
+            returncode = child.returncode
+        finally:
+            end = time.perf_counter()
+            self._release(kind, threads, end - start, returncode)
+
+            args = {'output': command[-1], 'command': " ".join(command)[:1000], 'cwd': cwd,
+                    'exit_code': returncode}
+            args.update(_file_bytes(command, cwd))
+            # Also counted by the stages waiting for the job
+            tracer.count_bytes(args['bytes_read'], args['bytes_written'])
+            if usage is not None:
+                args['cpu_seconds'] = round(usage.ru_utime + usage.ru_stime, 6)
+                args['peak_rss_bytes'] = rss_bytes(usage.ru_maxrss)
+            tracer.add(f"ffmpeg {kind}", 'ffmpeg', start, end, args)
+
+        process = subprocess.CompletedProcess(command, returncode)
+        # Run time without the wait for admission
+        process.elapsed = end - start
+
+        return process
+
+    def submit(
+            self,
+            command: list,
+            kind: str = 'cpu',
+            threads: int = None,
+            cwd: str = None,
+    ):
+        """
+        Queues an ffmpeg command to run in the background. See 'run' for parameters.
+
+        :return: concurrent.futures.Future of the CompletedProcess
+        """
+        if kind not in ('cpu', 'io'):
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        with self._condition:
+            self._waiting[kind] += 1
+
+        def start():
+            with self._condition:
+                self._waiting[kind] -= 1
+
+            return self.run(command, kind, threads, cwd)
+
+        return self._executors[kind].submit(bind(start))
+
+    def stats(self) -> dict:
+        """
+        Returns the current queue depth and utilization.
+
+        :return: Dict with queued, running & completed job counts, CPU threads in use and
+        utilization, the share of the CPU thread budget in use now and on average since start
+        """
+        with self._condition:
+            elapsed = time.monotonic() - self._started
+
+            return {
+                'queued_cpu': self._waiting['cpu'],
+                'queued_io': self._waiting['io'],
+                'running_io': self._io_in_use,
+                'cpu_threads_in_use': self._cpu_in_use,
+                'cpu_threads': self.cpu_threads,
+                'utilization': self._cpu_in_use / self.cpu_threads,
+                'average_utilization': self._busy_thread_seconds / (elapsed * self.cpu_threads) if elapsed else 0.0,
+                'completed': self._completed,
+                'failed': self._failed,
+            }
+
+    def report(self) -> str:
+        """
+        Returns a one-line summary of 'stats'.
+
+        :return: String
+        """
+        stats = self.stats()
+
+        return (f"ffmpeg jobs - queued cpu/io: {stats['queued_cpu']}/{stats['queued_io']}, "
+                f"running io: {stats['running_io']}, "
+                f"cpu threads: {stats['cpu_threads_in_use']}/{stats['cpu_threads']} "
+                f"({stats['utilization']:.0%} now, {stats['average_utilization']:.0%} average), "
+                f"completed: {stats['completed']}, failed: {stats['failed']}")
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FFmpegScheduler:
+    """
+    Returns the process wide scheduler that all ffmpeg work goes through, creating it with
+    default budgets on first use.
+
+    :return: FFmpegScheduler
+    """
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FFmpegScheduler()
+
+        return _scheduler
+
+
+def configure_scheduler(
+        cpu_threads: int = None,
+        threads_per_job: int = 2,
+        io_jobs: int = 4,
+) -> FFmpegScheduler:
+    """
+    Replaces the process wide scheduler with one using the given budgets.
+    See 'FFmpegScheduler' for parameters.
+
+    :return: FFmpegScheduler
+    """
+    global _scheduler
+
+    with _scheduler_lock:
+        _scheduler = FFmpegScheduler(cpu_threads, threads_per_job, io_jobs)
+
+        return _scheduler
+
+
+def run_ffmpeg(
+        command: list,
+        kind: str = 'cpu',
+        threads: int = None,
+        cwd: str = None,
+) -> subprocess.CompletedProcess:
+    """
+    Runs an ffmpeg command through the process wide scheduler. See 'FFmpegScheduler.run'.
+    """
+    return get_scheduler().run(command, kind, threads, cwd)
+
+
+def submit_ffmpeg(
+        command: list,
+        kind: str = 'cpu',
+        threads: int = None,
+        cwd: str = None,
+):
+    """
+    Queues an ffmpeg command on the process wide scheduler. See 'FFmpegScheduler.submit'.
+    """
+    return get_scheduler().submit(command, kind, threads, cwd)
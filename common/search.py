@@ -0,0 +1,253 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from common.tracing import traced
+from common.index import (
+    load_chapter_index,
+    chapters_to_dict,
+)
+from common.query import (
+    ranking_query,
+    evaluate_plan,
+)
+
+
+# Character n-grams within words, so 'network' matches 'networks' and 'conscious' matches 'consciousness'
+vectorizer_options = {
+    'analyzer': 'char_wb',
+    'ngram_range': (3, 5),
+    'lowercase': True,
+    'sublinear_tf': True,
+    'dtype': np.float32,
+}
+
+
+def search_index_path(csv_file: str) -> str:
+    """
+    Returns the default location of the search index for a .csv file.
+
+    :param csv_file: Path of the .csv file of the 'channel_videos_list' type
+    :return: Path of the search index without extension, eg. 'videos.search'. The sparse
+    matrix is saved as '.npz' and the vocabulary as '.pkl'
+    """
+    return os.path.splitext(csv_file)[0] + ".search"
+
+
+def _vectorizer(
+        vocabulary: dict,
+        idf: np.ndarray,
+) -> TfidfVectorizer:
+    # A fitted vectorizer, rebuilt from a saved vocabulary without refitting
+    vectorizer = TfidfVectorizer(vocabulary=vocabulary, **vectorizer_options)
+    vectorizer.idf_ = idf
+
+    return vectorizer
+
+
+@traced
+def build_search_index(
+        index: dict,
+        descriptions: list = None,
+        description_weight: float = 0.0,
+) -> dict:
+    """
+    Vectorizes the chapter names of a chapter index as TF-IDF rows.
+
+    With descriptions, each video's description is vectorized too, with the same vocabulary.
+    Its rows are stacked under the chapter rows, so a query is still scored against every
+    chapter and every description with one sparse matrix-vector product, see 'rank_chapters'.
+
+    :param index: Dict of 'new_chapter_index' type
+    :param descriptions: List of video descriptions, one per video of the index. Default is none
+    :param description_weight: Weight of a video's description in the score of its chapters,
+    0 to ignore descriptions
+    :return: Dict with sparse 'matrix', 'vocabulary', 'idf', int32 'video_ids' of every
+    chapter, 'description_weight', 'csv_digest' & 'vectorizer'
+    """
+    names = [chapter for video_id, chapter, start, end in index['chapters']]
+    video_ids = np.array([video_id for video_id, chapter, start, end in index['chapters']], dtype=np.int32)
+
+    weighted = description_weight > 0 and descriptions is not None
+    if not weighted:
+        description_weight = 0.0
+
+    vectorizer = TfidfVectorizer(**vectorizer_options)
+    if weighted:
+        vectorizer.fit(names + list(descriptions))
+        matrix = sparse.vstack([vectorizer.transform(names), vectorizer.transform(descriptions)])
+    else:
+        matrix = vectorizer.fit_transform(names)
+
+    return {
+        'matrix': sparse.csr_matrix(matrix),
+        'vocabulary': vectorizer.vocabulary_,
+        'idf': vectorizer.idf_.astype(np.float32),
+        'video_ids': video_ids,
+        'description_weight': description_weight,
+        'csv_digest': index['csv_digest'],
+        'vectorizer': vectorizer,
+    }
+
+
+def save_search_index(
+        search_index: dict,
+        search_file: str,
+) -> None:
+    """
+    Saves a search index to disk, the matrix as '.npz' and the rest as '.pkl'.
+
+    :param search_index: Dict of 'build_search_index' type
+    :param search_file: Path to save to, without extension
+    :return: None
+    """
+    fields = {key: value for key, value in search_index.items() if key not in ('matrix', 'vectorizer')}
+
+    # numpy adds '.npz' to names without it
+    tmp_file = search_file + ".tmp.npz"
+    sparse.save_npz(tmp_file, search_index['matrix'], compressed=False)
+    os.replace(tmp_file, search_file + ".npz")
+
+    tmp_file = search_file + ".pkl.tmp"
+    with open(tmp_file, 'wb') as file:
+        pickle.dump(fields, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, search_file + ".pkl")
+
+
+@traced
+def load_search_index(
+        csv_file: str,
+        index: dict = None,
+        description_weight: float = 0.0,
+        search_file: str = None,
+) -> dict:
+    """
+    Loads the search index of a .csv file, vectorizing its chapters on first use. It is rebuilt
+    if the chapter index changed since it was saved, or if it was built with another description_weight.
+
+    :param csv_file: Path of the .csv file of the 'channel_videos_list' type
+    :param index: Dict of 'new_chapter_index' type. Default is 'load_chapter_index(csv_file)'
+    :param description_weight: Weight of a video's description in the score of its chapters,
+    0 to ignore descriptions
+    :param search_file: Path of the search index without extension. Default is 'search_index_path(csv_file)'
+    :return: Dict of 'build_search_index' type
+    """
+    if index is None:
+        index = load_chapter_index(csv_file)
+    if search_file is None:
+        search_file = search_index_path(csv_file)
+
+    try:
+        with open(search_file + ".pkl", 'rb') as file:
+            search_index = pickle.load(file)
+        search_index['matrix'] = sparse.load_npz(search_file + ".npz").tocsr()
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError):
+        search_index = None
+
+    if (search_index is not None
+            and search_index['csv_digest'] == index['csv_digest']
+            and len(search_index['video_ids']) == len(index['chapters'])
+            and search_index['description_weight'] == description_weight):
+        search_index['vectorizer'] = _vectorizer(search_index['vocabulary'], search_index['idf'])
+        return search_index
+
+    descriptions = None
+    if description_weight > 0:
+        descriptions = pd.read_csv(csv_file, usecols=['Description'])['Description'].fillna("").tolist()
+
+    search_index = build_search_index(index, descriptions, description_weight)
+    save_search_index(search_index, search_file)
+
+    return search_index
+
+
+def rank_chapters(
+        search_index: dict,
+        query: str,
+        top_k: int = 20,
+        min_score: float = 0.1,
+        videos: np.ndarray = None,
+        chapters: np.ndarray = None,
+) -> list:
+    """
+    Scores every indexed chapter against a query with one sparse matrix-vector product and
+    returns the best ones. Scores are cosine similarities of the TF-IDF vectors, plus the
+    weighted similarity of the chapter's video description if the index has descriptions.
+
+    :param search_index: Dict of 'build_search_index' type
+    :param query: Free text, eg. 'neural networks'
+    :param top_k: Maximum number of chapters to return
+    :param min_score: Minimum score of a chapter to return
+    :param videos: Boolean array with a value per indexed video, eg. of 'video_mask'.
+    Only chapters of videos set are returned. Default is all videos
+    :param chapters: Boolean array with a value per indexed chapter. Only chapters set are returned.
+    Default is all chapters
+    :return: List of (chapter number, score) tuples, best first
+    """
+    video_ids = search_index['video_ids']
+    chapter_count = len(video_ids)
+
+    query_vector = search_index['vectorizer'].transform([query])
+    scores = (search_index['matrix'] @ query_vector.T).toarray().ravel()
+
+    weight = search_index['description_weight']
+    if weight > 0:
+        scores = (scores[:chapter_count] + weight * scores[chapter_count:][video_ids]) / (1 + weight)
+
+    if videos is not None:
+        scores[~np.asarray(videos, dtype=bool)[video_ids]] = 0
+    if chapters is not None:
+        scores[~np.asarray(chapters, dtype=bool)] = 0
+
+    if top_k < chapter_count:
+        best = np.argpartition(-scores, top_k)[:top_k]
+    else:
+        best = np.arange(chapter_count)
+    best = best[np.argsort(-scores[best], kind='stable')]
+
+    return [(int(chapter_id), float(scores[chapter_id])) for chapter_id in best if scores[chapter_id] >= min_score]
+
+
+def search_chapter_index(
+        index: dict,
+        search_index: dict,
+        query: str,
+        top_k: int = 20,
+        min_score: float = 0.1,
+        videos: np.ndarray = None,
+) -> dict:
+    """
+    Returns the chapters most relevant to a query, see 'rank_chapters'. Videos are ordered by
+    their best chapter, chapters within a video by their start. The query may use the syntax of
+    'compile_query': the terms it looks for are ranked, chapters it excludes are left out, see 'ranking_query'.
+
+    :param index: Dict of 'new_chapter_index' type the search index was built from
+    :param search_index: Dict of 'build_search_index' type
+    :param query: Query string, eg. 'neural networks -sponsor'
+    :param top_k: Maximum number of chapters to return
+    :param min_score: Minimum score of a chapter to return
+    :param videos: Boolean array with a value per indexed video. Default is all videos
+    :returns: Dict of URLs with matching chapters of 'get_matching_chapters' type
+    """
+    text, plan = ranking_query(query)
+
+    # Queries without negations exclude nothing
+    chapters = None
+    if any(instruction[0] in ('term', 'prefix', 'phrase', 'none') for instruction in plan):
+        chapters = np.unpackbits(evaluate_plan(index, plan), count=len(index['chapters'])).astype(bool)
+
+    ranked = rank_chapters(search_index, text, top_k, min_score, videos, chapters)
+    chapters_dict = chapters_to_dict(index, [chapter_id for chapter_id, score in ranked])
+
+    # Dicts keep insertion order, so re-insert the videos by rank
+    videos = index['videos']
+    order = {}
+    for chapter_id, score in ranked:
+        url = videos[index['chapters'][chapter_id][0]][0]
+        order.setdefault(url, len(order))
+
+    return {url: chapters_dict[url] for url in sorted(chapters_dict, key=order.get)}
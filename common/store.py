@@ -0,0 +1,189 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from common.info import (
+    extract_chapters,
+    timestamps_to_seconds,
+)
+from common.variables import regex_non_word
+
+
+# Columns unique to each row, saved as fixed width unicode arrays
+video_string_columns = ('Name', 'URL_Link', 'ID')
+# Columns saved as int32 codes + a list of categories
+video_categorical_columns = ('Author', 'Media_name', 'Guest')
+chapter_categorical_columns = ('Chapter', 'Start_time', 'End_time')
+
+
+def chapter_store_path(csv_file: str) -> str:
+    """
+    Returns the default location of the chapter store for a .csv file.
+
+    :param csv_file: Path of the .csv file of the 'channel_videos_list' type
+    :return: Path of the store dir, eg. 'videos.store'
+    """
+    return os.path.splitext(csv_file)[0] + ".store"
+
+
+def _save_categorical(
+        store_dir: str,
+        name: str,
+        values: pd.Series,
+) -> list:
+    categorical = pd.Categorical(values)
+    np.save(f"{store_dir}/{name}.npy", categorical.codes.astype('int32'))
+
+    return [str(category) for category in categorical.categories]
+
+
+def csv_signature(csv_file: str) -> dict:
+    """
+    Identifies a version of a .csv file by its size and modification time, without reading it.
+
+    :param csv_file: Path of the .csv file
+    :return: Dict with 'csv_size' & 'csv_mtime_ns'
+    """
+    stat = os.stat(csv_file)
+
+    return {'csv_size': stat.st_size, 'csv_mtime_ns': stat.st_mtime_ns}
+
+
+def build_chapter_store(
+        csv_file: str,
+        store_dir: str = None,
+) -> str:
+    """
+    Parses a .csv file once and saves its videos and chapters as a columnar store of .npy files.
+    Timestamps are saved as int32 seconds, columns unique to each row as unicode arrays, other
+    text columns as int32 codes into a list of categories and descriptions as one utf-8 blob with
+    offsets, so they can be read one at a time.
+
+    :param csv_file: Path of the .csv file of the 'channel_videos_list' type
+    :param store_dir: Path of dir to save to. Default is 'chapter_store_path(csv_file)'
+    :return: Path of the store dir
+    """
+    if store_dir is None:
+        store_dir = chapter_store_path(csv_file)
+
+    signature = csv_signature(csv_file)
+    dataframe = pd.read_csv(csv_file)
+    chapters = extract_chapters(dataframe.reset_index(drop=True))
+
+    # Build in a temporary dir and swap it in when complete
+    tmp_dir = store_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.mkdir(tmp_dir)
+
+    dataframe['Media_name'] = dataframe['Name'].str.replace(regex_non_word, "_", regex=True)
+    dataframe['Guest'] = dataframe['Description'].str.split(".").str[0]
+
+    for column in video_string_columns:
+        np.save(f"{tmp_dir}/videos.{column}.npy", dataframe[column].to_numpy(dtype=str))
+
+    categories = {}
+    for column in video_categorical_columns:
+        categories[column] = _save_categorical(tmp_dir, f"videos.{column}", dataframe[column])
+
+    np.save(f"{tmp_dir}/videos.Length.npy", timestamps_to_seconds(dataframe['Length']).values)
+    np.save(f"{tmp_dir}/videos.Views.npy", dataframe['Views'].values.astype('int64'))
+    publish_date = pd.to_datetime(dataframe['Publish_date']).values.astype('datetime64[D]')
+    np.save(f"{tmp_dir}/videos.Publish_date.npy", publish_date.astype('int32'))
+
+    for column in chapter_categorical_columns:
+        categories[column] = _save_categorical(tmp_dir, f"chapters.{column}", chapters[column])
+
+    np.save(f"{tmp_dir}/chapters.Video.npy", chapters.index.values.astype('int32'))
+    np.save(f"{tmp_dir}/chapters.Start.npy", chapters['Start'].values.astype('int32'))
+    np.save(f"{tmp_dir}/chapters.End.npy", chapters['End'].values.astype('int32'))
+
+    # Descriptions are only read on demand, through their offsets
+    offsets = [0]
+    with open(f"{tmp_dir}/descriptions.bin", 'wb') as file:
+        for description in dataframe['Description']:
+            offsets.append(offsets[-1] + file.write(description.encode('utf-8')))
+    np.save(f"{tmp_dir}/descriptions.offsets.npy", np.array(offsets, dtype='int64'))
+
+    with open(f"{tmp_dir}/meta.json", 'w') as file:
+        json.dump({**signature, 'categories': categories}, file)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+
+    return store_dir
+
+
+def load_chapter_store(
+        csv_file: str,
+        store_dir: str = None,
+) -> dict:
+    """
+    Opens the chapter store of a .csv file, memory-mapping its columns. The store is
+    (re)built first if it is missing or the size or modification time of the .csv file changed
+    since it was built, see 'csv_signature'.
+
+    :param csv_file: Path of the .csv file of the 'channel_videos_list' type
+    :param store_dir: Path of the store dir. Default is 'chapter_store_path(csv_file)'
+    :return: Dict with 'videos' & 'chapters' DataFrames and 'store_dir'. Chapters have
+    columns Video, Chapter, Start_time, End_time, Start, End where Video is the video row
+    """
+    if store_dir is None:
+        store_dir = chapter_store_path(csv_file)
+
+    try:
+        with open(f"{store_dir}/meta.json", 'r') as file:
+            meta = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        meta = {}
+
+    signature = csv_signature(csv_file)
+    if any(meta.get(key) != value for key, value in signature.items()):
+        build_chapter_store(csv_file, store_dir)
+        with open(f"{store_dir}/meta.json", 'r') as file:
+            meta = json.load(file)
+
+    def load(name):
+        return np.load(f"{store_dir}/{name}.npy", mmap_mode='r')
+
+    def load_categorical(table, column):
+        return pd.Categorical.from_codes(load(f"{table}.{column}"), meta['categories'][column])
+
+    videos = pd.DataFrame({column: load(f"videos.{column}") for column in video_string_columns})
+    for column in video_categorical_columns:
+        videos[column] = load_categorical("videos", column)
+    videos['Length'] = load("videos.Length")
+    videos['Views'] = load("videos.Views")
+    videos['Publish_date'] = np.asarray(load("videos.Publish_date")).astype('datetime64[D]')
+
+    chapters = pd.DataFrame({'Video': load("chapters.Video")})
+    for column in chapter_categorical_columns:
+        chapters[column] = load_categorical("chapters", column)
+    chapters['Start'] = load("chapters.Start")
+    chapters['End'] = load("chapters.End")
+
+    return {
+        'videos': videos,
+        'chapters': chapters,
+        'store_dir': store_dir,
+    }
+
+
+def store_description(
+        store: dict,
+        video: int,
+) -> str:
+    """
+    Reads the description of a single video from a chapter store.
+
+    :param store: Dict of 'load_chapter_store' type
+    :param video: Row number of the video
+    :return: Description string
+    """
+    offsets = np.load(f"{store['store_dir']}/descriptions.offsets.npy", mmap_mode='r')
+    start, end = int(offsets[video]), int(offsets[video + 1])
+
+    with open(f"{store['store_dir']}/descriptions.bin", 'rb') as file:
+        file.seek(start)
+        return file.read(end - start).decode('utf-8')
@@ -0,0 +1,100 @@
+import os
+import json
+import threading
+
+from common.variables import cache_dir
+
+
+# Rates assumed until a stage has been measured
+default_rates = {
+    'download': 5e6,  # bytes downloaded per second, all downloads together
+    'media_bytes': 16e3,  # bytes per second of media
+    'cut': 200.0,  # seconds of media cut per second, per ffmpeg job
+    'smart_cut': 20.0,  # seconds of media cut frame accurately per second, per chapter
+    'card': 20.0,  # cards rendered per second, all workers together
+    'still': 1.5,  # still segments encoded per second, per ffmpeg job
+    'mux': 20e6,  # bytes of chapter media muxed with its still per second, per ffmpeg job
+    'concat': 100e6,  # bytes of media joined per second
+}
+
+# Weight of older measurements, so rates follow the machine they run on
+decay = 0.9
+
+_lock = threading.Lock()
+
+
+def throughput_path() -> str:
+    """
+    Returns the default location of measured throughput.
+
+    :return: Path of 'throughput.json' inside 'cache_dir'
+    """
+    return f"{cache_dir}/throughput.json"
+
+
+def load_throughput(throughput_file: str = None) -> dict:
+    """
+    Loads measured throughput of each stage.
+
+    :param throughput_file: Path of .json file. Default is 'throughput_path()'
+    :return: Dict of stage -> {'amount': decayed amount, 'seconds': decayed seconds}
+    """
+    if throughput_file is None:
+        throughput_file = throughput_path()
+
+    try:
+        with open(throughput_file, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_throughput(
+        stage: str,
+        amount: float,
+        seconds: float,
+        throughput_file: str = None,
+) -> None:
+    """
+    Adds a measurement of a stage, eg. 3 cards rendered in 0.2 seconds.
+
+    :param stage: Name of stage, one of 'default_rates'
+    :param amount: Amount of work done, in the unit of the stage
+    :param seconds: Seconds it took
+    :param throughput_file: Path of .json file. Default is 'throughput_path()'
+    :return: None
+    """
+    if amount <= 0 or seconds <= 0:
+        return
+
+    if throughput_file is None:
+        throughput_file = throughput_path()
+
+    with _lock:
+        throughput = load_throughput(throughput_file)
+        record = throughput.setdefault(stage, {'amount': 0.0, 'seconds': 0.0})
+        record['amount'] = record['amount'] * decay + amount
+        record['seconds'] = record['seconds'] * decay + seconds
+
+        os.makedirs(os.path.dirname(throughput_file), exist_ok=True)
+        with open(throughput_file + ".tmp", 'w') as file:
+            json.dump(throughput, file, indent=2)
+        os.replace(throughput_file + ".tmp", throughput_file)
+
+
+def stage_rate(
+        throughput: dict,
+        stage: str,
+) -> float:
+    """
+    Returns the measured rate of a stage, or its default if it was never measured.
+
+    :param throughput: Dict of 'load_throughput' type
+    :param stage: Name of stage, one of 'default_rates'
+    :return: Amount of work per second
+    """
+    record = throughput.get(stage)
+    if record is None or record['seconds'] <= 0:
+        return default_rates[stage]
+
+    return record['amount'] / record['seconds']
@@ -0,0 +1,83 @@
+from common.variables import regex_hms
+
+
+def timestamp_to_seconds(timestamp: str) -> int:
+    """
+    Converts a timestamp in the %H:%M:%S or %M:%S format into integer seconds.
+    Hours are not limited to 24, eg. '25:00:00' is 90000 seconds.
+
+    :param timestamp: Timestamp string, eg. '1:54:35' or '54:35'
+    :return: Number of seconds
+    """
+    result = regex_hms.match(timestamp)
+    if result is None:
+        raise ValueError(f"Invalid timestamp: {timestamp}")
+
+    hours, minutes, seconds = result.groups(default="0")
+
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def timestamp_to_milliseconds(timestamp: str) -> int:
+    """
+    Converts a timestamp in the %H:%M:%S or %M:%S format into integer milliseconds.
+
+    :param timestamp: Timestamp string, eg. '1:54:35' or '54:35'
+    :return: Number of milliseconds
+    """
+    return timestamp_to_seconds(timestamp) * 1000
+
+
+def seconds_to_timestamp(seconds: int) -> str:
+    """
+    Converts a number of seconds into a timestamp in the %H:%M:%S format.
+    Hours keep counting past 24 instead of wrapping around.
+
+    :param seconds: Number of seconds
+    :return: Timestamp string, eg. '01:54:35'
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+class Chapter:
+    """
+    Media chapter with its start and end in integer seconds.
+    """
+    __slots__ = ('name', 'start', 'end')
+
+    def __init__(
+            self,
+            name: str,
+            start: int,
+            end: int,
+    ) -> None:
+        self.name = name
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_timestamps(
+            cls,
+            name: str,
+            start: str,
+            end: str,
+    ) -> "Chapter":
+        """
+        Constructs a Chapter from timestamps in the %H:%M:%S or %M:%S format.
+
+        :param name: Chapter name
+        :param start: Start timestamp
+        :param end: End timestamp
+        :return: Chapter
+        """
+        return cls(name, timestamp_to_seconds(start), timestamp_to_seconds(end))
+
+    @property
+    def duration(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self) -> str:
+        return f"Chapter({self.name!r}, {self.start}, {self.end})"
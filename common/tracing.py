@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import contextvars
+
+from functools import wraps
+from contextlib import contextmanager
+from collections import deque
+
+from common.variables import trace_max_events
+
+# Args of the spans open in the current context, innermost last
+_open_spans = contextvars.ContextVar("open_spans", default=())
+
+
+def rss_bytes(max_rss: int) -> int:
+    """
+    Converts 'ru_maxrss' of resource.getrusage to bytes. It is in kilobytes on Linux and bytes on macOS.
+
+    :param max_rss: Value of 'ru_maxrss'
+    :return: Number of bytes
+    """
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class Tracer:
+    """
+    Records timed spans of pipeline stages and subprocesses from any thread, for export as a
+    Chrome trace (chrome://tracing or https://ui.perfetto.dev) and as Prometheus metrics.
+
+    Every span records its wall time and, where known, CPU time, peak RSS, bytes read & written
+    and exit code in its 'args'. Only the last max_events spans are kept for the trace, the
+    metrics are totalled as spans finish and count all of them.
+    """
+
+    def __init__(
+            self,
+            max_events: int = trace_max_events,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=max_events)
+        self._dropped = 0
+        self._totals = {}
+        self._started = time.perf_counter()
+
+    def add(
+            self,
+            name: str,
+            category: str,
+            start: float,
+            end: float,
+            args: dict = None,
+            thread: int = None,
+    ) -> None:
+        """
+        Records a finished span.
+
+        :param name: Name of span, eg. the stage function
+        :param category: Kind of span, eg. 'stage' or 'ffmpeg'
+        :param start: time.perf_counter() at the start
+        :param end: time.perf_counter() at the end
+        :param args: Dict of measurements and details of the span
+        :param thread: Id of thread the span ran on. Default is the current thread
+        :return: None
+        """
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self._started) * 1e6),
+            'dur': round((end - start) * 1e6),
+            'pid': os.getpid(),
+            'tid': thread if thread is not None else threading.get_ident(),
+            'args': args or {},
+        }
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                self._dropped += 1
+            self._events.append(event)
+
+            total = self._totals.setdefault((category, name), {
+                'calls': 0, 'failures': 0, 'seconds': 0.0, 'cpu_seconds': 0.0,
+                'bytes_read': 0, 'bytes_written': 0, 'peak_rss_bytes': 0,
+            })
+            args = event['args']
+            total['calls'] += 1
+            total['failures'] += 'error' in args or args.get('exit_code', 0) != 0
+            total['seconds'] += event['dur'] / 1e6
+            total['cpu_seconds'] += args.get('cpu_seconds', 0.0)
+            total['bytes_read'] += args.get('bytes_read', 0)
+            total['bytes_written'] += args.get('bytes_written', 0)
+            total['peak_rss_bytes'] = max(total['peak_rss_bytes'], args.get('peak_rss_bytes', 0))
+
+    def count_bytes(
+            self,
+            bytes_read: int = 0,
+            bytes_written: int = 0,
+    ) -> None:
+        """
+        Adds bytes read & written, eg. by an ffmpeg job, to every span open in the current context,
+        so stages total the bytes of the work they wait for. See 'bind' for other threads.
+
+        :param bytes_read: Number of bytes read
+        :param bytes_written: Number of bytes written
+        :return: None
+        """
+        for args in _open_spans.get():
+            with self._lock:
+                args['bytes_read'] = args.get('bytes_read', 0) + bytes_read
+                args['bytes_written'] = args.get('bytes_written', 0) + bytes_written
+
+    @contextmanager
+    def span(
+            self,
+            name: str,
+            category: str = 'stage',
+            **args,
+    ):
+        """
+        Times the enclosed block as a span, with the CPU time of the calling thread and the peak
+        RSS of the process. Bytes counted inside the block are added to its args, see 'count_bytes'.
+        The yielded dict of args can be updated inside the block. A raised exception is recorded
+        as 'error' and re-raised.
+
+        :param name: Name of span
+        :param category: Kind of span
+        :param args: Details of the span to record, eg. the episode
+        :return: Dict of args
+        """
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        args.setdefault('bytes_read', 0)
+        args.setdefault('bytes_written', 0)
+        token = _open_spans.set(_open_spans.get() + (args,))
+        try:
+            yield args
+        except BaseException as error:
+            args['error'] = repr(error)
+            raise
+        finally:
+            _open_spans.reset(token)
+            args['cpu_seconds'] = round(time.thread_time() - cpu_start, 6)
+            args['peak_rss_bytes'] = rss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+            self.add(name, category, start, time.perf_counter(), args)
+
+    def events(self) -> list:
+        """
+        Returns a copy of the recorded spans kept, the last 'max_events'.
+
+        :return: List of Chrome trace event dicts
+        """
+        with self._lock:
+            return list(self._events)
+
+    def chrome_trace(self) -> dict:
+        """
+        Returns all spans in the Chrome trace event format.
+
+        :return: Dict with 'traceEvents'
+        """
+        with self._lock:
+            dropped = self._dropped
+
+        return {'traceEvents': self.events(), 'displayTimeUnit': 'ms', 'otherData': {'dropped_events': dropped}}
+
+    def prometheus(self) -> str:
+        """
+        Returns totals per span as a Prometheus text format snapshot: calls, failures, wall &
+        CPU seconds, bytes read & written and the largest peak RSS of each category and name.
+
+        :return: String
+        """
+        with self._lock:
+            totals = {key: dict(total) for key, total in self._totals.items()}
+
+        metrics = (
+            ('calls', 'counter', "Number of finished spans"),
+            ('failures', 'counter', "Number of spans that raised or exited with a non-zero code"),
+            ('seconds', 'counter', "Wall time of spans in seconds"),
+            ('cpu_seconds', 'counter', "CPU time of spans in seconds"),
+            ('bytes_read', 'counter', "Bytes read by spans"),
+            ('bytes_written', 'counter', "Bytes written by spans"),
+            ('peak_rss_bytes', 'gauge', "Largest peak resident set size of spans in bytes"),
+        )
+
+        lines = []
+        for metric, kind, description in metrics:
+            name = f"podcast_span_{metric}" + ("_total" if kind == 'counter' else "")
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (category, span), total in sorted(totals.items()):
+                span = span.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{name}{{category="{category}",span="{span}"}} {total[metric]:g}')
+
+        return "\n".join(lines) + "\n"
+
+    def save(
+            self,
+            trace_file: str = None,
+            metrics_file: str = None,
+    ) -> None:
+        """
+        Saves the Chrome trace as .json and/or the Prometheus snapshot as text.
+
+        :param trace_file: Path of trace .json file. Default is not to save it
+        :param metrics_file: Path of metrics text file. Default is not to save it
+        :return: None
+        """
+        if trace_file is not None:
+            with open(trace_file, 'w') as file:
+                json.dump(self.chrome_trace(), file)
+
+        if metrics_file is not None:
+            with open(metrics_file, 'w') as file:
+                file.write(self.prometheus())
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """
+    Returns the process wide tracer that all stages and subprocesses record to.
+
+    :return: Tracer
+    """
+    return _tracer
+
+
+def bind(func):
+    """
+    Wraps func to run in a copy of the current context, so spans it runs in a pool or executor
+    thread count their bytes to the spans open here, see 'Tracer.count_bytes'.
+    """
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def traced(func):
+    """
+    Decorator recording every call of a stage function as a span on the process wide tracer.
+    The first argument, eg. the episode path, is recorded as 'target'.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        details = {'target': str(args[0])[:200]} if len(args) > 0 and isinstance(args[0], str) else {}
+
+        with _tracer.span(func.__name__, 'stage', **details):
+            return func(*args, **kwargs)
+
+    return wrapper
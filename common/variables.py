@@ -1,8 +1,20 @@
+import os
 import re
 
 
 # Compiled regex matching media timestamp, eg. '01:54:35' (%H:%M:%S)
-regex_time = re.compile(r"(\d?[:]?\d+[:]\d+)")
+# The lookahead does not change what is matched but lets the regex engine skip ahead
+# to the next digit or colon instead of trying every position.
+regex_time = re.compile(r"(?=[\d:])(\d?[:]?\d+[:]\d+)")
+
+# Compiled regex matching a timestamp's hours, minutes & seconds, eg. '1:54:35' or '54:35'
+regex_hms = re.compile(r"^(?:(\d+):)?(\d+):(\d+)$")
+
+# Compiled regex matching every line. Captures the line's first timestamp, if any, like
+# 'regex_time', and its text from the first letter, if any, as the chapter name. A timestamp
+# at the start of the line, the usual case, is captured by the first group without a lookahead
+regex_chapter_line = re.compile(r"^(?:(\d?:?\d+:\d+)|(?=[^\n]*?(\d?:?\d+:\d+)))?"
+                                r"[^\w\n]*(?:[\d_]+[^\w\n]*)*([^\W\d_][^\n]*)?", re.MULTILINE)
 
 # Compiled regex matching any non-word characters
 regex_non_word = re.compile(r"[^\w]+|[_]+")
@@ -18,3 +30,16 @@ column_names = (
     'Author',
     'ID'
 )
+
+# Font of chapter cards and titles, can be set with the CARD_FONT environment variable
+card_font = os.getenv("CARD_FONT", "/System/Library/Fonts/Helvetica.ttc")
+
+# Dir of files cached between runs, can be set with the PODCAST_CACHE environment variable
+cache_dir = os.getenv("PODCAST_CACHE", os.path.expanduser("~/.cache/PodcastAnalyzer"))
+
+# Maximum size of the clip cache in bytes, can be set with the CLIP_CACHE_SIZE environment variable
+clip_cache_size = int(os.getenv("CLIP_CACHE_SIZE", 50 * 1024 ** 3))
+
+# Maximum number of spans the tracer keeps for its Chrome trace, can be set with the
+# TRACE_MAX_EVENTS environment variable. Metric totals count every span
+trace_max_events = int(os.getenv("TRACE_MAX_EVENTS", 100000))
@@ -0,0 +1,159 @@
+import os
+
+from common.info import (
+    split_media_chapters,
+    list_image_info,
+)
+from common.converter import (
+    concat_media_chapters_and_images,
+    concat_media_demuxer,
+)
+from common.pipeline import run_pipeline
+from common.resources import (
+    list_dirs,
+    list_files,
+    most_common,
+)
+
+
+class Workspace:
+    """
+    Working directory of one compilation: the downloaded media files, one dir per episode with
+    its chapters, an 'images' dir and the final output.
+
+    Every path is resolved against 'root' and no stage changes the process working directory,
+    so several workspaces can be processed from different threads of the same process.
+    """
+
+    def __init__(self, root: str) -> None:
+        """
+        :param root: Path of the dir containing the downloaded media files
+        """
+        self.root = os.path.abspath(root)
+
+    def __repr__(self) -> str:
+        return f"Workspace({self.root!r})"
+
+    def path(self, *parts: str) -> str:
+        """
+        Returns the absolute path of a file or dir inside the workspace.
+
+        :param parts: Path components relative to root
+        :return: Absolute path
+        """
+        return os.path.join(self.root, *parts)
+
+    def makedirs(self, *parts: str) -> str:
+        """
+        Creates a dir inside the workspace, if it does not exist yet.
+
+        :param parts: Path components relative to root
+        :return: Absolute path of the dir
+        """
+        path = self.path(*parts)
+        os.makedirs(path, exist_ok=True)
+
+        return path
+
+    def episode_dirs(self) -> list:
+        """
+        Returns the absolute paths of all episode dirs.
+
+        :return: List of paths
+        """
+        return [self.path(directory) for directory in list_dirs(self.root)
+                if directory not in ("images", "Final")]
+
+    def media_extension(self) -> str:
+        """
+        Returns the most common file extension of the downloaded media files.
+
+        :return: Extension without the dot, eg. 'mp4'
+        """
+        return most_common([file.split(".")[-1] for file in list_files(self.root)])
+
+    def split(
+            self,
+            chapters_dict: dict,
+            single_pass: bool = True,
+            smart: bool = False,
+    ) -> list:
+        """
+        Clips out the chapters of every episode, see 'split_media_chapters'.
+
+        :param chapters_dict: Dict of chapters of the 'get_matching_chapters' type
+        :param single_pass: Cut all chapters of a media with one ffmpeg process
+        :param smart: Cut video frame accurately, see 'smart_cut'
+        :return: List of messages
+        """
+        return split_media_chapters(self.root, chapters_dict, single_pass=single_pass, smart=smart)
+
+    def render_images(self, out_filename: str = "media.txt") -> list:
+        """
+        Creates an image for each chapter, see 'list_image_info'.
+
+        :param out_filename: Name of file inside 'images' listing images and durations
+        :return: List of image paths
+        """
+        return list_image_info(self.root, out_filename)
+
+    def encode(
+            self,
+            out_filename: str = "concat_media.mp4",
+            file_ext: str = "mp4",
+            still: bool = True,
+    ) -> None:
+        """
+        Combines chapters with their images and concats each episode, see 'concat_media_chapters_and_images'.
+
+        :param out_filename: Name of each episode's output file
+        :param file_ext: Name of chapter media extension, without the dot
+        :param still: Encode each image once and loop it under the audio
+        :return: None
+        """
+        concat_media_chapters_and_images(self.root, out_filename, file_ext, still)
+
+    def concat(
+            self,
+            out_filename: str = "Final/final_video.mp4",
+            media_list: str = "media.txt",
+    ) -> str:
+        """
+        Concatenates the encoded episodes into the final media file.
+
+        :param out_filename: Name of output file relative to root
+        :param media_list: Name of file listing the episodes to concat
+        :return: Absolute path of output file
+        """
+        self.makedirs(os.path.dirname(out_filename))
+
+        return concat_media_demuxer(self.root, media_list, out_filename)
+
+    def stream(
+            self,
+            chapters_dict: dict,
+            media_type: int = 1,
+            out_filename: str = "Final/final_video.mp4",
+            smart_cut: bool = False,
+            audio_only: bool = False,
+            cover_file: str = None,
+            workers: int = 4,
+            queue_size: int = 4,
+    ) -> str:
+        """
+        Downloads, splits, renders, encodes and concats all episodes with each episode moving
+        through the stages on its own, see 'run_pipeline'.
+
+        :param chapters_dict: Dict of chapters of the 'get_matching_chapters' type
+        :param media_type: 0 for Video, 1 for Audio. Default 1-Audio
+        :param out_filename: Name of final output file relative to root
+        :param smart_cut: Cut chapters frame accurately, see 'smart_cut'. Off by default, the chapter
+        video is replaced with its card
+        :param audio_only: Output only audio with chapter metadata instead of chapter images
+        :param cover_file: Path of cover art image of an audio only compilation. Default is none
+        :param workers: Number of episodes each stage processes at once
+        :param queue_size: Maximum number of episodes waiting between two stages
+        :return: Absolute path of output file
+        """
+        return run_pipeline(self.root, chapters_dict, media_type, out_filename, smart_cut=smart_cut,
+                            audio_only=audio_only, cover_file=cover_file, workers=workers, queue_size=queue_size)
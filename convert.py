@@ -1,53 +1,83 @@
 import os
-import re
-import pandas as pd
 from pprint import pprint
 
-from common.downloader import get_matching_chapters
-from common.converter import (
-    concat_media_chapters_and_images,
-    concat_media_demuxer,
+from common.index import (
+    load_chapter_index,
+    query_chapters,
 )
-from common.info import (
-    list_image_info,
-    split_media_chapters,
-    query_keywords,
+from common.store import load_chapter_store
+from common.filters import (
+    parse_filters,
+    video_mask,
 )
+from common.search import (
+    load_search_index,
+    search_chapter_index,
+)
+from common.scheduler import get_scheduler
+from common.tracing import get_tracer
+from common.info import query_keywords
+from common.planner import (
+    plan_query,
+    format_plan,
+    save_plan,
+)
+from common.workspace import Workspace
+
+
+if __name__ == "__main__":
+    workspace = Workspace(os.getcwd() + "/audios")
+
+    # Pre-cleaned data set to exclude videos that are not podcasts
+    index = load_chapter_index("LexFridman_All_Podcasts.csv")
 
+    # Provide a query to look for
+    query = input("Please enter a query to look for in video chapters.\n"
+                  "Combine words, \"phrases\" and prefix* with AND, OR, NOT and parentheses: ")
 
-folder_path = os.getcwd() + "/audios"
+    # Filters on the video columns run first, so only chapters of the videos that pass are matched
+    filters = parse_filters(input("Filter videos, eg. published_after=2021-01-01, min_views=1M, max_length=3h, "
+                                  "author=Lex Fridman.\nUse commas for multiple filters, leave empty for none: "))
+    videos = video_mask(load_chapter_store("LexFridman_All_Podcasts.csv")['videos'], filters) if filters else None
 
-# Pre-cleaned data set to exclude videos that are not podcasts
-df = pd.read_csv("LexFridman_All_Podcasts.csv")
+    # Ranked search scores chapters by relevance to the words looked for, weighted with the episode
+    # description. Chapters the query excludes, eg. with -sponsor or NOT sponsor, are left out
+    ranked = input("Rank chapters by relevance instead of matching the query exactly?: [y/n] ").lower() == "y"
 
-# Provide keywords to look for
-keywords = input("Please enter keywords to look for in video description.\n"
-                 "Use commas for multiple keywords: ")
-keywords = [key for key in re.split(r", |,", keywords)]
+    if ranked:
+        search_index = load_search_index("LexFridman_All_Podcasts.csv", index, description_weight=0.25)
+        chapters = search_chapter_index(index, search_index, query, top_k=20, videos=videos)
+    else:
+        # Check every chapter against the compiled query
+        chapters = query_chapters(index, query, videos)
+    pprint(chapters)
+    query_keywords(chapters, [query])
 
-# Check against each video description for matching keywords
-chapters = get_matching_chapters(df, keywords)
-pprint(chapters)
-query_keywords(chapters, keywords)
-proceed = input("Do you want to export media?: [y/n] ")
-proceed = proceed.lower()
+    # Audio only skips chapter images & video encoding, chapters are embedded as metadata
+    audio_only = input("Export audio only, with chapter metadata instead of images?: [y/n] ").lower() == "y"
 
-if proceed == "y":
-    # Cut out chapters matching keywords
-    split_media_chapters(folder_path, chapters)
+    # Estimate the work of exporting before asking
+    plan = plan_query(chapters, workspace.root, audio_only=audio_only)
+    print(format_plan(plan))
+    print(f"Plan saved in: {save_plan(plan, workspace.path('plan.json'))}\n")
 
-    # Create image for each chapter with guest's description on as text
-    list_image_info(folder_path)
+    proceed = input("Do you want to export media?: [y/n] ")
+    proceed = proceed.lower()
 
-    # Concat chapters and images of each episode
-    concat_media_chapters_and_images(folder_path)
+    if proceed == "y":
+        # Download missing media, cut out chapters, create an image for each chapter and encode
+        # them, with every episode moving through the stages on its own, then concat all episodes
+        if audio_only:
+            file_name = workspace.stream(chapters, out_filename="Final/final_audio.m4a", audio_only=True)
+        else:
+            file_name = workspace.stream(chapters, out_filename="Final/final_video.mp4")
 
-    # Final media file concatenation
-    os.mkdir('Final')
-    file_name = 'Final/' + "final_video.mp4"
-    concat_media_demuxer(folder_path, out_filename=file_name)
+        print(f"Final media saved in: {file_name}")
+        print(get_scheduler().report())
 
-    print(f"Final media saved in: {folder_path}/{file_name}")
+        # Timeline of every stage & ffmpeg process, and totals per stage
+        get_tracer().save(workspace.path("trace.json"), workspace.path("metrics.prom"))
+        print(f"Trace saved in: {workspace.path('trace.json')}, metrics in: {workspace.path('metrics.prom')}")
 
-else:
-    print("Exiting.")
+    else:
+        print("Exiting.")